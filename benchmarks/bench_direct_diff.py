@@ -0,0 +1,133 @@
+# Copyright 2024 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the reporter's direct diff (--db_type direct) with the staging path
+(import into a local DuckDB or SQLite staging database, then run the report
+queries) on synthetic extracts of growing size, and prints the catalog size
+from which the staging path is faster, if any.
+
+Usage:
+    python benchmarks/bench_direct_diff.py [--staging duckdb] [--objects 1000,10000,100000] [--repeat 3]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(REPO_DIR, "src", "db_compare"), os.path.join(REPO_DIR, "src", "db_compare", "collector")]
+
+import yaml
+
+from importer.__main__ import connect_embedded_staging, list_directory_extracts, load_extracts_to_embedded
+from reporter import __main__ as reporter
+from reporter import direct_diff
+
+OBJECT_TYPES = ["TABLE", "VIEW", "INDEX", "PROCEDURE", "PACKAGE BODY", "FUNCTION"]
+COLUMNS_PER_TABLE = 8
+
+
+def write_instance_archive(directory, pkey, objects, drop_ratio, rng):
+    """Writes the extract archive of an instance holding the objects, minus a random drop_ratio of them."""
+    objects = [item for item in objects if rng.random() >= drop_ratio]
+    with zipfile.ZipFile(os.path.join(directory, f"{pkey}.zip"), "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(f"{pkey}__instances__data.csv", f"PKEY|CON_ID\n{pkey}|0\n")
+        zip_file.writestr(f"{pkey}__dbobjectnames__data.csv", "PKEY|CON_ID|OWNER|OBJECT_NAME|OBJECT_TYPE|DMA_SOURCE_ID|DMA_MANUAL_ID\n" +
+                          "".join(f"{pkey}|0|{owner}|{name}|{object_type}||\n" for owner, name, object_type in objects))
+        zip_file.writestr(f"{pkey}__columns__data.csv", "PKEY|CON_ID|OWNER|TABLE_NAME|COLUMN_NAME|DATA_TYPE|DATA_LENGTH|DATA_PRECISION|DATA_SCALE|NULLABLE|DMA_SOURCE_ID|DMA_MANUAL_ID\n" +
+                          "".join(f"{pkey}|0|{owner}|{name}|COL_{column}|VARCHAR2|30|||Y||\n"
+                                  for owner, name, object_type in objects if object_type == "TABLE"
+                                  for column in range(COLUMNS_PER_TABLE) if rng.random() >= drop_ratio))
+        zip_file.writestr(f"{pkey}__sourcecodedetailed__data.csv", "PKEY|CON_ID|OWNER|NAME|TYPE|NR_LINES|DMA_SOURCE_ID|DMA_MANUAL_ID\n" +
+                          "".join(f"{pkey}|0|{owner}|{name}|{object_type}|{rng.randint(10, 500)}||\n"
+                                  for owner, name, object_type in objects if object_type in ("PROCEDURE", "PACKAGE BODY", "FUNCTION")))
+
+
+def write_extracts(directory, object_count, seed=0):
+    """Writes the archives of two instances of object_count objects that differ by a few percent."""
+    rng = random.Random(seed)
+    objects = [(f"SCHEMA_{index % 20}", f"OBJECT_{index}", OBJECT_TYPES[index % len(OBJECT_TYPES)]) for index in range(object_count)]
+    write_instance_archive(directory, "source", objects, 0.01, rng)
+    write_instance_archive(directory, "target", objects, 0.03, rng)
+
+
+def time_direct(extract_files, config):
+    """Returns the seconds the direct diff takes to read the extracts and compute the sections."""
+    start_time = time.perf_counter()
+    diff = direct_diff.ExtractDiff(direct_diff.read_extract_tables(extract_files), "source", "target")
+    for query_file in config.values():
+        diff.section(query_file)
+    return time.perf_counter() - start_time
+
+
+def time_staging(extract_files, config, precompute_config, db_type, database_path):
+    """Returns the seconds the staging path takes to load the extracts and run the report queries."""
+    start_time = time.perf_counter()
+    conn = connect_embedded_staging(db_type, database_path, "schema_compare")
+    try:
+        load_extracts_to_embedded(conn, db_type, "schema_compare", extract_files, full_reload=True)
+        reporter.use_staging_connection(db_type, embedded_connection=conn)
+        reporter.execute_queries(config, "source", "target", None, None, None, "schema_compare", precompute_config=precompute_config)
+    finally:
+        conn.close()
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the catalog size from which the staging path beats the direct diff.")
+    parser.add_argument("--staging", default="duckdb", choices=["duckdb", "sqlite"], help="Local staging database of the staging path (default: duckdb)")
+    parser.add_argument("--objects", default="1000,10000,100000", help="Comma-separated object counts per instance (default: 1000,10000,100000)")
+    parser.add_argument("--repeat", default=3, type=int, help="Runs per size and path, the median is reported (default: 3)")
+    args = parser.parse_args()
+
+    with open(os.path.join(reporter.get_script_path(), reporter.CONFIG_FILE), "r") as f:
+        config = {section: query_file for section, query_file in yaml.safe_load(f).items() if query_file in direct_diff.SECTIONS}
+    with open(os.path.join(reporter.get_script_path(), reporter.PRECOMPUTE_CONFIG_FILE), "r") as f:
+        precompute_config = yaml.safe_load(f)
+
+    print(f"{'objects':>10} {'direct':>10} {args.staging:>10}")
+    crossover = None
+    with tempfile.TemporaryDirectory() as directory:
+        for object_count in [int(item) for item in args.objects.split(",")]:
+            extract_directory = os.path.join(directory, str(object_count))
+            os.makedirs(extract_directory)
+            write_extracts(extract_directory, object_count)
+            with contextlib.redirect_stdout(io.StringIO()):
+                extract_files = list_directory_extracts(extract_directory, extract_directory)
+                direct_seconds = statistics.median(time_direct(extract_files, config) for _ in range(args.repeat))
+                staging_seconds = statistics.median(time_staging(extract_files, config, precompute_config, args.staging, os.path.join(directory, f"staging.{args.staging}"))
+                                                    for _ in range(args.repeat))
+            print(f"{object_count:>10} {direct_seconds:9.3f}s {staging_seconds:9.3f}s")
+            if crossover is None and staging_seconds < direct_seconds:
+                crossover = object_count
+    if os.path.exists(reporter.LOG_FILE):
+        os.remove(reporter.LOG_FILE)
+
+    if crossover:
+        print(f"\nThe {args.staging} staging path is faster from {crossover} objects per instance.")
+    else:
+        print("\nThe direct diff is faster at every size measured.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# Copyright 2024 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs the Oracle collector with --parallelism and --shards against a fake
+connection pool, which holds as many connections as the collector asks for
+and fails instead of waiting forever when none is released in time, and
+checks that the sharded queries never exhaust the pool.
+
+Usage:
+    python benchmarks/bench_sharded_extraction.py [--parallelism 1,2,4] [--shards 2,4] [--repeat 5]
+"""
+
+import argparse
+import io
+import itertools
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(REPO_DIR, "src", "db_compare"), os.path.join(REPO_DIR, "src", "db_compare", "collector")]
+
+from oracollector import __main__ as oracollector
+
+OWNERS = [f"SCHEMA_{index}" for index in range(20)]
+
+
+class PoolExhausted(Exception):
+    """Raised by FakePool when no connection was released within its timeout."""
+
+
+class FakeCursor:
+    """Returns one row per owner of the shard the query is restricted to, after a short execution delay."""
+
+    description = [("OWNER", None, None, None, None, None, None), ("NAME", None, None, None, None, None, None)]
+
+    def __init__(self, execute_seconds):
+        self.execute_seconds = execute_seconds
+        self.rows = iter(())
+
+    def execute(self, sql):
+        time.sleep(self.execute_seconds)
+        shard = re.search(r"ORA_HASH\(owner, (\d+)\) = (\d+)", sql)
+        owners = [owner for index, owner in enumerate(OWNERS) if not shard or index % (int(shard[1]) + 1) == int(shard[2])]
+        self.rows = iter([(owner, "OBJECT") for owner in owners])
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self.rows, size))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return FakeCursor(self.pool.execute_seconds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pool.release(self)
+
+
+class FakePool:
+    """
+    Connection pool of at most max_connections connections, like oracledb's
+    WAIT getmode but with a timeout. Acquiring takes a random part of
+    execute_seconds, as when the pool opens a new connection.
+    """
+
+    def __init__(self, max_connections, timeout, execute_seconds):
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.timeout = timeout
+        self.execute_seconds = execute_seconds
+
+    def acquire(self):
+        time.sleep(random.uniform(0, self.execute_seconds))
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolExhausted(f"No pooled connection released within {self.timeout}s")
+        return FakeConnection(self)
+
+    def release(self, conn):
+        self.slots.release()
+
+    def close(self):
+        pass
+
+
+def run_extraction(parallelism, shards, timeout, execute_seconds):
+    """Runs one in-memory extraction on a fake pool, returns its duration in seconds."""
+    def create_connection_pool(*args):
+        return FakePool(args[-1], timeout, execute_seconds)
+
+    oracollector.create_connection_pool = create_connection_pool
+    start_time = time.perf_counter()
+    oracollector.extract_queries_to_csv("user", None, "dbhost", "1521", "service", None, None, "./config_oracle.yaml",
+                                        parallelism=parallelism, shards=shards, archive_factory=lambda path: io.BytesIO())
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that sharded Oracle extractions do not exhaust the connection pool.")
+    parser.add_argument("--parallelism", default="1,2,4", help="Comma separated --parallelism values (default: 1,2,4)")
+    parser.add_argument("--shards", default="2,4", help="Comma separated --shards values (default: 2,4)")
+    parser.add_argument("--repeat", default=5, type=int, help="Extractions per combination (default: 5)")
+    parser.add_argument("--timeout", default=5.0, type=float, help="Seconds a connection is waited for before the pool counts as exhausted (default: 5)")
+    parser.add_argument("--execute_ms", default=20.0, type=float, help="Execution time of every fake query (default: 20)")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        for parallelism, shards in itertools.product(map(int, args.parallelism.split(",")), map(int, args.shards.split(","))):
+            try:
+                durations = [run_extraction(parallelism, shards, args.timeout, args.execute_ms / 1000) for _ in range(args.repeat)]
+            except PoolExhausted as e:
+                failures.append((parallelism, shards))
+                print(f"parallelism {parallelism}, shards {shards}: {e}")
+                continue
+            print(f"parallelism {parallelism}, shards {shards}: {args.repeat} extractions, slowest {max(durations):.2f}s")
+        os.chdir(REPO_DIR)
+
+    if failures:
+        print(f"\nPool exhausted with (parallelism, shards): {', '.join(map(str, failures))}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
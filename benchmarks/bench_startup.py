@@ -0,0 +1,107 @@
+# Copyright 2024 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the cold start time of every entry point: the time a fresh
+interpreter needs to import its module, above a bare interpreter start, and
+the slowest imports reported by `python -X importtime`.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--top 10] [--max_ms 500]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Module imported by each console script (see [tool.poetry.scripts])
+ENTRY_POINTS = {
+    "pgcollector": "pgcollector.__main__",
+    "oracollector": "oracollector.__main__",
+    "importer": "importer.__main__",
+    "reporter": "reporter.__main__",
+    "compare": "compare.__main__",
+    "compare.pipeline": "compare.pipeline",
+}
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIRS = [os.path.join(REPO_DIR, "src", "db_compare"), os.path.join(REPO_DIR, "src", "db_compare", "collector")]
+
+
+def run_python(code, importtime=False):
+    """
+    Runs code in a fresh interpreter that finds the packages of this checkout.
+
+    Returns:
+        tuple: (wall clock seconds, return code, stderr)
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(SOURCE_DIRS + [os.environ.get("PYTHONPATH", "")]))
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    start_time = time.perf_counter()
+    result = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - start_time, result.returncode, result.stderr
+
+
+def parse_importtime(stderr):
+    """Returns (cumulative microseconds, module) of every import in a -X importtime report."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), module.rstrip()))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold import time of the db_compare entry points.")
+    parser.add_argument("--repeat", default=5, type=int, help="Number of cold starts per entry point (default: 5)")
+    parser.add_argument("--top", default=10, type=int, help="Number of slowest imports shown per entry point (default: 10)")
+    parser.add_argument("--max_ms", default=None, type=float, help="Exit with an error if an entry point imports slower than this")
+    parser.add_argument("entry_points", nargs="*", default=list(ENTRY_POINTS), help="Entry points to measure (default: all)")
+    args = parser.parse_args()
+
+    baseline = statistics.median(run_python("pass")[0] for _ in range(args.repeat))
+    print(f"Bare interpreter start: {baseline * 1000:.1f} ms")
+
+    slow_entry_points = []
+    for entry_point in args.entry_points:
+        module = ENTRY_POINTS.get(entry_point, entry_point)
+        code = f"import {module}"
+        seconds, return_code, stderr = run_python(code)
+        if return_code != 0:
+            print(f"\n{entry_point}: import failed: {stderr.strip().splitlines()[-1]}")
+            continue
+        timings = [seconds] + [run_python(code)[0] for _ in range(args.repeat - 1)]
+        import_ms = max(0.0, statistics.median(timings) - baseline) * 1000
+        print(f"\n{entry_point}: {import_ms:.1f} ms (median of {args.repeat} cold starts, min {(min(timings) - baseline) * 1000:.1f} ms)")
+
+        imports = parse_importtime(run_python(code, importtime=True)[2])
+        for cumulative, imported in sorted(imports, reverse=True)[:args.top]:
+            print(f"  {cumulative / 1000:8.1f} ms  {imported}")
+
+        if args.max_ms is not None and import_ms > args.max_ms:
+            slow_entry_points.append(entry_point)
+
+    if slow_entry_points:
+        print(f"\nSlower than {args.max_ms} ms: {', '.join(slow_entry_points)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
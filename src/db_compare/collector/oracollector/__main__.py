@@ -14,19 +14,28 @@
 
 import yaml
 import oracledb
+import concurrent.futures
+import contextlib
 import csv
+import hashlib
+import heapq
+import itertools
+import json
 import os
-import zipfile
 import argparse
 import pathlib
 import platform
 import re
 import sys
-from google.cloud import secretmanager
+import threading
+import time
+
+from importer import extract_archive
 
 
 def get_secret(secret_name):
     """Fetches the secret value from Google Secret Manager."""
+    from google.cloud import secretmanager  # Only needed for gcp-secret: passwords
     client = secretmanager.SecretManagerServiceClient()
     project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
     if not project_id:
@@ -44,11 +53,351 @@ def resolve_password(password_arg):
     return password_arg
 
 
-def extract_queries_to_csv(db_user, db_password, db_host, db_port, db_service, tns, tns_path, config_file, view_type='all', protocol='tcp', schemas_to_compare=None):
+def write_cursor_to_csv(cur, csvfile, batch_size):
+    """
+    Streams the rows of an executed cursor to a CSV stream in batches of
+    batch_size rows, so that memory use does not depend on the result size.
+
+    Args:
+        cur: A cursor on which a query has been executed.
+        csvfile: Text stream the CSV data is written to.
+        batch_size: Number of rows fetched per round trip.
+
+    Returns:
+        int: The number of data rows written.
+    """
+    row_count = 0
+    writer = csv.writer(csvfile, delimiter='|')
+
+    # Write the column headers (optional, can be customized)
+    writer.writerow([desc[0] for desc in cur.description])
+
+    # Write the data rows as they arrive
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        writer.writerows(rows)
+        row_count += len(rows)
+    return row_count
+
+def arrow_schema_from_description(description):
+    """Builds the explicit Arrow schema of an extract from the Oracle column types of the cursor description."""
+    import pyarrow as pa
+    fields = []
+    for name, db_type, _, _, precision, scale, _ in description:
+        if db_type is oracledb.DB_TYPE_NUMBER and scale == 0:
+            # NUMBER(19..38) integers do not fit in int64, they are written as strings
+            arrow_type = pa.int64() if precision and precision <= extract_archive.INT64_DIGITS else pa.string()
+        elif db_type is oracledb.DB_TYPE_NUMBER:
+            arrow_type = pa.float64()
+        elif db_type in (oracledb.DB_TYPE_BINARY_FLOAT, oracledb.DB_TYPE_BINARY_DOUBLE):
+            arrow_type = pa.float64()
+        elif db_type in (oracledb.DB_TYPE_DATE, oracledb.DB_TYPE_TIMESTAMP):
+            arrow_type = pa.timestamp('us')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+def get_db_host_alpha(db_host, tns):
+    """Returns the identifier of the database used in the PKEY and file names."""
+    if tns:
+        return ''.join(c for c in tns if c.isalpha())
+    # db_host_alpha = ''.join(c for c in db_host if c.isalpha()) 
+    if all(c.isdigit() or c == '.' for c in db_host):
+        # Remove the periods and prefix with 'ip_'
+        return 'ip_' + db_host.replace('.', '_')
+    # If it's not an IP, just extract alphabetic characters
+    return ''.join(c for c in db_host if c.isalpha())
+
+def build_query_sql(query, view_type, db_host_alpha, db_user, schemas_to_compare, object_filter='', shard_filter=''):
+    """Replaces the placeholders of a configured query."""
+    sql = query["query"].replace("<view_type>", view_type).replace("<db-name>",db_host_alpha)
+    if (view_type == 'user'):
+        sql = sql.replace('owner,\n', "'" + db_user + "' as owner,\n").replace("WHERE owner NOT IN ('SYS', 'SYSTEM')\n","").replace("GROUP BY owner, ",f"GROUP BY '{db_user}', ").replace('table_owner = o.owner AND','')
+    if schemas_to_compare:
+        sql = sql.replace('<owner_filter>', f" AND owner IN ({schemas_to_compare}) {shard_filter}")
+    else:
+        sql = sql.replace('<owner_filter>', shard_filter)
+    return sql.replace('<object_filter>', object_filter)
+
+def build_shard_sqls(query, view_type, db_host_alpha, db_user, schemas_to_compare, shards):
+    """Returns one query per shard, each restricted to the owners with ORA_HASH(owner) equal to the shard number."""
+    return [build_query_sql(query, view_type, db_host_alpha, db_user, schemas_to_compare,
+                            shard_filter=f" AND ORA_HASH(owner, {shards - 1}) = {shard} ")
+            for shard in range(shards)]
+
+def build_object_filter(object_keys, key_column, view_type):
+    """
+    Builds the <object_filter> condition that restricts a query to the given
+    (owner, object name) keys. Oracle allows at most 1000 expressions per IN
+    list, so the keys are split into several lists.
+    """
+    if view_type == 'user':
+        column = key_column
+        items = sorted("'{}'".format(name.replace("'", "''")) for _, name in object_keys)
+    else:
+        column = f"(owner, {key_column})"
+        items = sorted("('{}', '{}')".format(owner.replace("'", "''"), name.replace("'", "''")) for owner, name in object_keys)
+    in_lists = [f"{column} IN ({', '.join(items[i:i + 1000])})" for i in range(0, len(items), 1000)]
+    return f" AND ({' OR '.join(in_lists)}) "
+
+def collect_object_manifest(pool, config, view_type, db_host_alpha, db_user, schemas_to_compare, batch_size=10000):
+    """
+    Reads the LAST_DDL_TIME of every catalog object with the manifest_query of
+    the configuration.
+
+    Returns:
+        dict: Maps (owner, object name) to a signature of the DDL times of all
+        objects with that name.
+    """
+    sql = build_query_sql({'query': config['manifest_query']}, view_type, db_host_alpha, db_user, schemas_to_compare)
+    objects = {}
+    with pool.acquire() as conn:
+        with conn.cursor() as cur:
+            cur.arraysize = batch_size
+            cur.execute(sql)
+            for owner, object_name, object_type, last_ddl_time in cur:
+                objects.setdefault((owner, object_name), []).append(f"{object_type}={last_ddl_time}")
+    return {key: ";".join(sorted(signatures)) for key, signatures in objects.items()}
+
+def create_connection_pool(db_user, db_password, db_host, db_port, db_service, tns, tns_path, protocol='tcp', parallelism=1):
+    """
+    Creates an oracledb connection pool that holds up to parallelism connections.
+
+    Args:
+        db_user: The username for the Oracle database.
+        db_password: The password for the Oracle database.
+        db_host: The hostname of the Oracle database.
+        db_port: The port number of the Oracle database.
+        db_service: The service name of the Oracle database.
+        tns: TNS alias, used instead of host, port and service when set.
+        tns_path: Directory containing tnsnames.ora.
+        protocol: Either "tcp" or "tcps".
+        parallelism: Maximum number of connections in the pool.
+
+    Returns:
+        oracledb.ConnectionPool: The connection pool.
+    """
+    if tns:
+        # oracledb.init_oracle_client(lib_dir=tns_path.replace("/network/admin", ""))  # Point to the Oracle client libraries
+        oracledb.init_oracle_client() 
+        return oracledb.create_pool(
+            user=db_user,
+            password=db_password,
+            dsn=tns,
+            config_dir=tns_path,
+            ssl_server_dn_match=False,  # Disable SSL certificate validation
+            min=1,
+            max=parallelism,
+            increment=1
+        )
+    dsn = oracledb.makedsn(host=db_host, port=db_port, service_name=db_service)
+    return oracledb.create_pool(
+        user=db_user,
+        password=db_password,
+        dsn=dsn,
+        protocol=protocol,
+        min=1,
+        max=parallelism,
+        increment=1
+    )
+
+def extract_query_to_member(pool, query_name, sql, z, member_name, extract_format='csv', batch_size=10000, prefetch_rows=None, unchanged_rows=None):
+    """
+    Runs one extraction query on a connection acquired from the pool and
+    streams its rows into a new member of the archive z.
+
+    In incremental mode unchanged_rows iterates over the header and the still
+    valid rows of the previous extract (see read_unchanged_rows). They are
+    written first and sql only re-extracts the changed objects, or is None
+    when none of them changed.
+
+    Returns:
+        int: The number of data rows written.
+    """
+    print(f"Extracting: {query_name} ")
+    # print(f"Extracting: {query_name} {sql}")
+    start_time = time.perf_counter()
+    with pool.acquire() as conn:
+        with conn.cursor() as cur:
+            # Tune the fetch size before execute so rows are streamed in batches
+            cur.arraysize = batch_size
+            cur.prefetchrows = prefetch_rows if prefetch_rows is not None else batch_size
+            if unchanged_rows is not None:
+                header = next(unchanged_rows)
+                if sql is not None:
+                    cur.execute(sql)
+                with extract_archive.open_archive_member(z, member_name) as csvfile:
+                    row_count = extract_archive.write_merged_csv(cur if sql is not None else None, csvfile, batch_size, header, unchanged_rows)
+            elif extract_format == 'parquet':
+                cur.execute(sql)
+                with extract_archive.open_parquet_member(z, member_name) as stream:
+                    row_count = extract_archive.write_cursor_to_parquet(cur, stream, batch_size, arrow_schema_from_description, query_name)
+            else:
+                cur.execute(sql)
+                with extract_archive.open_archive_member(z, member_name) as csvfile:
+                    row_count = write_cursor_to_csv(cur, csvfile, batch_size)
+    print(f"Extracted {row_count} rows from {query_name} in {time.perf_counter() - start_time:.2f}s")
+    return row_count
+
+class ShardMergeCursor:
+    """
+    Cursor over the rows of the shards of one query, merged on the OWNER
+    column. The shards partition the query by owner and every sharded query
+    is sorted by owner first (ORDER BY owner, ...), so the merged rows keep
+    the order of the unsharded query.
+    """
+
+    def __init__(self, cursors, batch_size):
+        self.description = cursors[0].description
+        columns = [desc[0].upper() for desc in self.description]
+        if 'OWNER' not in columns:
+            raise ValueError("Queries marked shard_by_owner must return an OWNER column.")
+        owner_index = columns.index('OWNER')
+        self.row_counts = [0] * len(cursors)
+        self.rows = heapq.merge(*(self.read_shard(shard, cur, batch_size) for shard, cur in enumerate(cursors)),
+                                key=lambda row: row[owner_index])
+
+    def read_shard(self, shard, cur, batch_size):
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            self.row_counts[shard] += len(rows)
+            yield from rows
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self.rows, size))
+
+def extract_sharded_query_to_member(pool, query_name, shard_sqls, z, member_name, extract_format='csv', batch_size=10000, prefetch_rows=None, shard_slots=None):
+    """
+    Runs the shards of one extraction query concurrently, each on its own
+    pooled connection, and streams their rows into a single member of the
+    archive z, merged in the order of the query (see ShardMergeCursor).
+
+    Every shard keeps its connection until all shards are merged. When
+    several queries are extracted concurrently, shard_slots is a semaphore
+    that limits the sharded queries running at once to the number whose
+    shards all fit in the pool, so that they cannot each hold part of the
+    pool and wait for the rest of it forever.
+
+    Returns:
+        int: The number of data rows written.
+    """
+    with shard_slots if shard_slots is not None else contextlib.nullcontext():
+        return extract_shards_to_member(pool, query_name, shard_sqls, z, member_name, extract_format, batch_size, prefetch_rows)
+
+def extract_shards_to_member(pool, query_name, shard_sqls, z, member_name, extract_format, batch_size, prefetch_rows):
+    """Runs the shards of one query and merges them into a member of the archive z, see extract_sharded_query_to_member."""
+    print(f"Extracting: {query_name} in {len(shard_sqls)} shards")
+    start_time = time.perf_counter()
+
+    def execute_shard(sql):
+        shard_start_time = time.perf_counter()
+        conn = pool.acquire()
+        try:
+            cur = conn.cursor()
+            cur.arraysize = batch_size
+            cur.prefetchrows = prefetch_rows if prefetch_rows is not None else batch_size
+            cur.execute(sql)
+        except BaseException:
+            pool.release(conn)
+            raise
+        return conn, cur, time.perf_counter() - shard_start_time
+
+    with contextlib.ExitStack() as stack:
+        # The shards are executed (scanned and sorted) concurrently, their rows are then fetched as they are merged
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shard_sqls)) as executor:
+            futures = [executor.submit(execute_shard, sql) for sql in shard_sqls]
+        for future in futures:
+            if future.exception() is None:
+                conn, cur, _ = future.result()
+                stack.callback(pool.release, conn)
+                stack.callback(cur.close)
+        shard_results = [future.result() for future in futures]  # Re-raise the first shard error, if any
+        cursor = ShardMergeCursor([cur for _, cur, _ in shard_results], batch_size)
+        if extract_format == 'parquet':
+            with extract_archive.open_parquet_member(z, member_name) as stream:
+                row_count = extract_archive.write_cursor_to_parquet(cursor, stream, batch_size, arrow_schema_from_description, query_name)
+        else:
+            with extract_archive.open_archive_member(z, member_name) as csvfile:
+                row_count = write_cursor_to_csv(cursor, csvfile, batch_size)
+
+    for shard, ((_, _, shard_seconds), shard_rows) in enumerate(zip(shard_results, cursor.row_counts)):
+        print(f"  {query_name} shard {shard + 1}/{len(shard_sqls)}: {shard_rows} rows, executed in {shard_seconds:.2f}s")
+    print(f"Extracted {row_count} rows from {query_name} in {time.perf_counter() - start_time:.2f}s")
+    return row_count
+
+def extract_query_to_archive(pool, query_name, sql, zip_file, member_name, extract_format='csv', compression='deflate', compression_level=None, batch_size=10000, prefetch_rows=None, unchanged_rows=None, shard_slots=None):
+    """Extracts one query (or the list of its shard queries) into a single member archive of its own."""
+    with extract_archive.open_archive(zip_file, compression, compression_level) as z:
+        if isinstance(sql, list):
+            return extract_sharded_query_to_member(pool, query_name, sql, z, member_name, extract_format, batch_size, prefetch_rows, shard_slots)
+        return extract_query_to_member(pool, query_name, sql, z, member_name, extract_format, batch_size, prefetch_rows, unchanged_rows)
+
+def read_object_list(object_file):
+    """Reads the OWNER, NAME and TYPE columns of a pipe delimited object list, e.g. the reporter's source_hash_mismatches.csv."""
+    with open(object_file, 'r', newline='') as f:
+        reader = csv.DictReader(f, delimiter='|')
+        return [(row['OWNER'], row['NAME'], row['TYPE']) for row in reader]
+
+def fetch_source_code(db_user, db_password, db_host, db_port, db_service, tns, tns_path, object_file, view_type='all', protocol='tcp'):
+    """
+    Fetches the full source of the objects listed in object_file (e.g. the
+    objects whose source hash differs) into one file per object under
+    sources/, so that only the mismatching bodies are transferred.
+
+    Args:
+        object_file: Pipe delimited file with OWNER, NAME and TYPE columns.
+        view_type: Type of catalog views either "all", "dba" or "user".
+    """
+    objects = read_object_list(object_file)
+    db_host_alpha = get_db_host_alpha(db_host, tns)
+    sources_dir = os.path.join("./", "sources", f"orcl-{db_host_alpha if tns else db_host}")
+    os.makedirs(sources_dir, exist_ok=True)
+
+    pool = create_connection_pool(db_user, db_password, db_host, db_port, db_service, tns, tns_path, protocol)
+    with pool.acquire() as conn:
+        with conn.cursor() as cur:
+            for owner, name, object_type in objects:
+                if view_type == 'user':
+                    cur.execute("SELECT text FROM user_source WHERE name = :name AND type = :type ORDER BY line",
+                                name=name, type=object_type)
+                else:
+                    cur.execute(f"SELECT text FROM {view_type}_source WHERE owner = :owner AND name = :name AND type = :type ORDER BY line",
+                                owner=owner, name=name, type=object_type)
+                source_file = os.path.join(sources_dir, f"{owner}.{name}.{object_type.replace(' ', '_')}.sql".replace(os.sep, '_'))
+                with open(source_file, 'w') as f:
+                    for (text,) in cur:
+                        f.write(text)
+    pool.close()
+    print(f"Fetched the source of {len(objects)} objects to {sources_dir}")
+
+def extract_queries_to_csv(db_user, db_password, db_host, db_port, db_service, tns, tns_path, config_file, view_type='all', protocol='tcp', schemas_to_compare=None, batch_size=10000, prefetch_rows=None, parallelism=1, compression='deflate', compression_level=None, compression_report=False, extract_format='csv', incremental=False, incremental_max_changes=10000, source_hash=False, shards=1, archive_factory=None, stop_event=None):
     """
     Extracts data from an Oracle database based on queries and connection settings
-    provided as input arguments. Writes each query's output to a separate CSV file,
-    and then zips all the CSV files.
+    provided as input arguments. Streams each query's output as a CSV (or
+    Parquet) member straight into a compressed zip archive, without temporary
+    files. Rows are streamed in batches of batch_size, so peak memory is
+    independent of the catalog size. With parallelism > 1 the queries run
+    concurrently on a connection pool of that size and each query is written
+    to an archive of its own, as zip archives can only be written one member
+    at a time.
+
+    In incremental mode a snapshot of the extract and of the LAST_DDL_TIME of
+    every object is kept under extracts/snapshots. The next run only
+    re-extracts the rows of new and changed objects for the queries with an
+    incremental_key, drops the rows of dropped objects and merges the rest
+    from the snapshot. The merged extract holds the same rows as a full
+    extraction but not in the order of the query: the unchanged rows come
+    first, followed by the re-extracted ones.
+
+    With shards > 1 the queries marked shard_by_owner in the configuration
+    are split by ORA_HASH(owner) into that many queries, which run
+    concurrently and are merged by owner into the same member, so a catalog
+    with many schemas is not scanned and sorted as one serial query.
 
     Args:
         db_user: The username for the Oracle database.
@@ -57,6 +406,26 @@ def extract_queries_to_csv(db_user, db_password, db_host, db_port, db_service, t
         db_port: The port number of the Oracle database.
         db_service: The service name of the Oracle database.
         config_file: Path to the YAML configuration file.
+        batch_size: Number of rows fetched per round trip (cursor arraysize).
+        prefetch_rows: Number of rows prefetched on execute (defaults to batch_size).
+        parallelism: Maximum number of queries running at the same time.
+        compression: Archive member compression, one of extract_archive.COMPRESSION_METHODS.
+        compression_level: Compression level passed to the codec (codec default if None).
+        compression_report: Print the archive size and CPU cost of every available codec.
+        extract_format: Either "csv" or "parquet" (typed columns, requires pyarrow).
+        incremental: Re-extract only the objects changed since the previous run.
+        incremental_max_changes: Run a full extraction when more objects changed.
+        source_hash: Also extract the queries that require "source_hash" (hashes of the source code).
+        shards: Number of owner shards of the queries marked shard_by_owner.
+        archive_factory: Returns the binary file object an archive is written
+            to given its path, e.g. an in-memory buffer. Archives are written to
+            the extracts directory if None.
+        stop_event: threading.Event checked before every query, the
+            extraction raises extract_archive.ExtractionCancelled once it is set.
+
+    Returns:
+        dict: Maps the path of every extract archive to the path or file
+        object it was written to.
     """
 
     # Load Configuration (Handle missing file gracefully)
@@ -67,99 +436,123 @@ def extract_queries_to_csv(db_user, db_password, db_host, db_port, db_service, t
     with open(config_file_path, 'r') as f:
         config = yaml.safe_load(f)
 
-    # Construct the connection string
-    if tns:
-        dsn = tns
-        # oracledb.init_oracle_client(lib_dir=tns_path.replace("/network/admin", ""))  # Point to the Oracle client libraries
-        oracledb.init_oracle_client() 
-        conn = oracledb.connect(
-            user=db_user,
-            password=db_password,
-            dsn=dsn,
-            config_dir=tns_path,
-            ssl_server_dn_match=False  # Disable SSL certificate validation
-        )
-    else:
-        dsn = oracledb.makedsn(host=db_host, port=db_port, service_name=db_service)
-         # Connect to the database
-        conn = oracledb.connect(
-            user=db_user,
-            password=db_password,
-            dsn=dsn,
-            protocol=protocol
-        )
-
-    # Create a cursor object
-    cur = conn.cursor()
+    parallelism = max(1, parallelism)
+    shards = max(1, shards)
+    if shards > 1 and view_type == 'user':
+        print("User catalog views hold a single owner, extracting without shards.")
+        shards = 1
+    pool_size = max(parallelism, shards)
+    pool = create_connection_pool(db_user, db_password, db_host, db_port, db_service, tns, tns_path, protocol, pool_size)
+    # Sharded queries hold one connection per shard until they are merged, only run as many at once as the pool can hold
+    shard_slots = threading.BoundedSemaphore(max(1, pool_size // shards))
 
     # Create the "extracts" directory if it doesn't exist
     extracts_dir = os.path.join("./", "extracts")
     os.makedirs(extracts_dir, exist_ok=True)
+    db_host_alpha = get_db_host_alpha(db_host, tns)
+
     if tns:
-        db_host_alpha = ''.join(c for c in tns if c.isalpha())
+        archive_name = f"orcl-extract-{db_host_alpha}"
     else:
-        # db_host_alpha = ''.join(c for c in db_host if c.isalpha()) 
-        if all(c.isdigit() or c == '.' for c in db_host):
-        # Remove the periods and prefix with 'ip_'
-            db_host_alpha = 'ip_' + db_host.replace('.', '_')
-        else:
-            # If it's not an IP, just extract alphabetic characters
-            db_host_alpha = ''.join(c for c in db_host if c.isalpha())
-    # Loop through each query in the configuration file
-    for i, query in enumerate(config['queries']):
-        # Execute the query
-        sql = query["query"].replace("<view_type>", view_type).replace("<db-name>",db_host_alpha)
-        if (view_type == 'user'):
-            sql = sql.replace('owner,\n', "'" + db_user + "' as owner,\n").replace("WHERE owner NOT IN ('SYS', 'SYSTEM')\n","").replace("GROUP BY owner, ",f"GROUP BY '{db_user}', ").replace('table_owner = o.owner AND','')
-        if schemas_to_compare:
-            sql = sql.replace('<owner_filter>', f" AND owner IN ({schemas_to_compare}) ")
-        else:
-            sql = sql.replace('<owner_filter>', '')
-        
-        print(f"Extracting: {query['name']} ")
-        # print(f"Extracting: {query['name']} {sql}")
-        cur.execute(sql)
-
-        # Fetch all rows from the query result
-        rows = cur.fetchall()
-
-        # Get the query name from the YAML (assuming it's a key in the query dict)
-        query_name = config['queries'][i].get('name', f"query_{i+1}")
+        archive_name = f"orcl-extract-{db_host}"
+    zip_file = os.path.join(extracts_dir, f"{archive_name}.zip")
 
-        # Create a CSV file for the query results
-        csv_file = os.path.join(extracts_dir, f"{db_host_alpha}_{query_name}.csv")
-
-        with open(csv_file, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter='|')
-
-            # Write the column headers (optional, can be customized)
-            writer.writerow([desc[0] for desc in cur.description])
-
-            # Write the data rows
-            writer.writerows(rows)
-
-    # Delete existing files starting with "orcl-extract-"
+    # Delete existing archives of this database
     for filename in os.listdir(extracts_dir):
-        if filename.startswith(f"orcl-extract-{db_host_alpha}"):
+        if filename == f"{archive_name}.zip" or filename.startswith(f"{archive_name}__"):
             os.remove(os.path.join(extracts_dir, filename))
 
+    # Work out which objects changed since the previous incremental run
+    snapshot_dir = os.path.join(extracts_dir, 'snapshots', archive_name)
+    manifest, stale_keys, changed_keys = None, None, None
+    if incremental and extract_format != 'csv':
+        print("Incremental extraction supports the csv extract format only, running a full extraction.")
+    elif incremental:
+        fingerprint = hashlib.sha256(json.dumps([config, view_type, schemas_to_compare, db_host_alpha, source_hash]).encode()).hexdigest()
+        manifest = collect_object_manifest(pool, config, view_type, db_host_alpha, db_user, schemas_to_compare, batch_size)
+        previous_manifest = extract_archive.load_snapshot(snapshot_dir, fingerprint)
+        if previous_manifest is not None:
+            changed_keys = {key for key, signature in manifest.items() if previous_manifest.get(key) != signature}
+            dropped_keys = previous_manifest.keys() - manifest.keys()
+            stale_keys = changed_keys | dropped_keys
+            print(f"{len(changed_keys)} new or changed and {len(dropped_keys)} dropped objects since the previous extraction")
+            if len(stale_keys) > incremental_max_changes:
+                print(f"More than {incremental_max_changes} objects changed, running a full extraction.")
+                stale_keys = None
+        else:
+            print("No snapshot of a previous extraction found, running a full extraction.")
 
-    # Zip all the CSV files in the "extracts" directory
-    if tns:
-        zip_file = os.path.join(extracts_dir, f"orcl-extract-{db_host_alpha}.zip")
-    else:
-        zip_file = os.path.join(extracts_dir, f"orcl-extract-{db_host}.zip")
-    with zipfile.ZipFile(zip_file, 'w') as z:
-        for filename in os.listdir(extracts_dir):
-            if filename.endswith(".csv"):
-                z.write(os.path.join(extracts_dir, filename), filename)
-                os.remove(os.path.join(extracts_dir, filename))
-
-    # Close the cursor and connection
-    cur.close()
-    conn.close()
+    # Build one extraction job per query in the configuration file
+    jobs = []
+    for i, query in enumerate(config['queries']):
+        # Skip optional queries that were not requested
+        if query.get('requires') == 'source_hash' and not source_hash:
+            continue
 
-    print(f"Extracted data and saved to {zip_file}")
+        # Get the query name from the YAML (assuming it's a key in the query dict)
+        query_name = query.get('name', f"query_{i+1}")
+
+        # Name of the member holding the query results
+        member_name = f"{db_host_alpha}_{query_name}.{extract_format}"
+
+        key_column = query.get('incremental_key')
+        if stale_keys is not None and key_column:
+            unchanged_rows = extract_archive.read_unchanged_rows(snapshot_dir, member_name, key_column, stale_keys)
+            if changed_keys:
+                object_filter = build_object_filter(changed_keys, key_column, view_type)
+                sql = build_query_sql(query, view_type, db_host_alpha, db_user, schemas_to_compare, object_filter)
+            else:
+                sql = None
+        elif shards > 1 and query.get('shard_by_owner'):
+            unchanged_rows = None
+            sql = build_shard_sqls(query, view_type, db_host_alpha, db_user, schemas_to_compare, shards)
+        else:
+            unchanged_rows = None
+            sql = build_query_sql(query, view_type, db_host_alpha, db_user, schemas_to_compare)
+        jobs.append((query_name, sql, member_name, unchanged_rows))
+
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    if parallelism > 1:
+        print(f"Extracting {len(jobs)} queries with parallelism {parallelism}")
+        zip_paths = [os.path.join(extracts_dir, f"{archive_name}__{job[0]}.zip") for job in jobs]
+        zip_files = [archive_factory(zip_path) for zip_path in zip_paths] if archive_factory else zip_paths
+
+        def extract_job(query_name, sql, member_name, unchanged_rows, query_zip_file):
+            extract_archive.check_stop(stop_event)
+            return extract_query_to_archive(pool, query_name, sql, query_zip_file, member_name, extract_format, compression,
+                                            compression_level, batch_size, prefetch_rows, unchanged_rows, shard_slots)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+            futures = [executor.submit(extract_job, *job, query_zip_file) for job, query_zip_file in zip(jobs, zip_files)]
+            for future in futures:
+                future.result()  # Re-raise the first extraction error, if any
+    else:
+        zip_paths = [zip_file]
+        zip_files = [archive_factory(zip_file) if archive_factory else zip_file]
+        with extract_archive.open_archive(zip_files[0], compression, compression_level) as z:
+            for query_name, sql, member_name, unchanged_rows in jobs:
+                extract_archive.check_stop(stop_event)
+                if isinstance(sql, list):
+                    extract_sharded_query_to_member(pool, query_name, sql, z, member_name, extract_format, batch_size, prefetch_rows)
+                else:
+                    extract_query_to_member(pool, query_name, sql, z, member_name, extract_format, batch_size, prefetch_rows, unchanged_rows)
+    print(f"Extracted {len(jobs)} queries in {time.perf_counter() - start_time:.2f}s")
+    archives = dict(zip(zip_paths, zip_files))
+    extract_archive.report_archive_sizes(zip_files, compression, time.process_time() - start_cpu)
+    if compression_report:
+        extract_archive.report_compression_costs(zip_files)
+    if manifest is not None:
+        extract_archive.save_snapshot(snapshot_dir, fingerprint, manifest, archives)
+
+    # Close the connection pool
+    pool.close()
+
+    if archive_factory:
+        print(f"Extracted data into {len(archives)} archives without writing to {extracts_dir}")
+    else:
+        print(f"Extracted data and saved to {', '.join(zip_paths)}")
+    return archives
 
 def main():
     parser = argparse.ArgumentParser(description='Extract data from an Oracle database')
@@ -173,6 +566,18 @@ def main():
     parser.add_argument("--schemas_to_compare", default=None,  help="Schemas to be compared (comma-separated).")
     parser.add_argument('--view_type', default='dba', type=str, help='Type of catalog views either "all or "dba" or "user"')
     parser.add_argument('--protocol', default='tcp', type=str, help='Protocol either "tcp" or "tcps"')
+    parser.add_argument('--batch_size', default=10000, type=int, help='Number of rows fetched per round trip while streaming query results (default: 10000)')
+    parser.add_argument('--parallelism', default=1, type=int, help='Number of queries extracted concurrently, each on its own pooled connection (default: 1)')
+    parser.add_argument('--prefetch_rows', default=None, type=int, help='Number of rows prefetched when a query is executed (default: same as --batch_size)')
+    parser.add_argument('--compression', default='deflate', choices=list(extract_archive.COMPRESSION_METHODS), help='Compression of the extract archive members (default: deflate)')
+    parser.add_argument('--compression_level', default=None, type=int, help='Compression level of the selected codec (default: codec default)')
+    parser.add_argument('--extract_format', default='csv', choices=extract_archive.EXTRACT_FORMATS, help='Format of the extract files: pipe delimited "csv" (default) or typed "parquet" (requires pyarrow)')
+    parser.add_argument('--compression_report', action='store_true', help='Report the archive size and CPU cost of every available compression codec')
+    parser.add_argument('--incremental', action='store_true', help='Only re-extract objects whose LAST_DDL_TIME changed since the previous incremental run and merge them with its snapshot')
+    parser.add_argument('--incremental_max_changes', default=10000, type=int, help='Run a full extraction when more objects changed than this (default: 10000)')
+    parser.add_argument('--shards', default=1, type=int, help='Split the queries marked shard_by_owner into this many owner shards extracted concurrently (default: 1)')
+    parser.add_argument('--source_hash', action='store_true', help='Also extract a server side computed hash of the source of every PL/SQL object (requires EXECUTE on DBMS_CRYPTO)')
+    parser.add_argument('--fetch_source', default=None, type=str, help='Only fetch the full source of the objects listed in this file (e.g. source_hash_mismatches.csv written by the reporter) into ./sources')
     # parser.add_argument('config_file', type=str, help='Path to the YAML configuration file')
     args = parser.parse_args()
 
@@ -184,11 +589,17 @@ def main():
 
     # Determine connection method based on provided arguments.
     if args.tns:
-      extract_queries_to_csv(args.user, password, None, None, None, args.tns, args.tns_path, "./config_oracle.yaml", args.view_type, args.protocol, schemas_to_compare)
+      connection = (None, None, None, args.tns, args.tns_path)
     elif args.host and args.port and args.service:
-      extract_queries_to_csv(args.user, password, args.host, args.port, args.service, None, None, "./config_oracle.yaml", args.view_type, args.protocol, schemas_to_compare)
+      connection = (args.host, args.port, args.service, None, None)
     else:
       print("Error: Please provide either --tns OR --host, --port, and --service.")
+      return
+
+    if args.fetch_source:
+      fetch_source_code(args.user, password, *connection, args.fetch_source, args.view_type, args.protocol)
+    else:
+      extract_queries_to_csv(args.user, password, *connection, "./config_oracle.yaml", args.view_type, args.protocol, schemas_to_compare, args.batch_size, args.prefetch_rows, args.parallelism, args.compression, args.compression_level, args.compression_report, args.extract_format, args.incremental, args.incremental_max_changes, args.source_hash, args.shards)
 
 
     # extract_queries_to_csv(args.user, args.password, args.host, args.port, args.service, "./config_oracle.yaml", args.view_type, args.protocol)
@@ -15,17 +15,21 @@
 import yaml
 import psycopg2
 import csv
+import hashlib
+import json
 import os
-import zipfile
 import argparse
 import pathlib
 import re
 import sys
-from google.cloud import secretmanager
+import time
+
+from importer import extract_archive
 
 
 def get_secret(secret_name):
     """Fetches the secret value from Google Secret Manager."""
+    from google.cloud import secretmanager  # Only needed for gcp-secret: passwords
     client = secretmanager.SecretManagerServiceClient()
     project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
     if not project_id:
@@ -42,11 +46,156 @@ def resolve_password(password_arg):
         return get_secret(secret_name)
     return password_arg
 
-def extract_queries_to_csv(db_host, db_name, db_user, db_password, config_file, schemas_to_compare=None):
+
+def write_cursor_to_csv(cur, csvfile, batch_size):
+    """
+    Streams the rows of an executed cursor to a CSV stream in batches of
+    batch_size rows, so that memory use does not depend on the result size.
+
+    Args:
+        cur: A (server side) cursor on which a query has been executed.
+        csvfile: Text stream the CSV data is written to.
+        batch_size: Number of rows fetched per round trip.
+
+    Returns:
+        int: The number of data rows written.
+    """
+    # Server side cursors only expose their description after the first fetch
+    rows = cur.fetchmany(batch_size)
+    row_count = 0
+    # Use '\n' line endings, as COPY ... TO STDOUT does, so both extraction paths produce the same files
+    writer = csv.writer(csvfile, delimiter='|', lineterminator='\n')
+
+    # Write the column headers (optional, can be customized)
+    writer.writerow([desc[0] for desc in cur.description])
+
+    # Write the data rows as they arrive
+    while rows:
+        writer.writerows(rows)
+        row_count += len(rows)
+        rows = cur.fetchmany(batch_size)
+    return row_count
+
+def arrow_schema_from_description(description):
+    """Builds the explicit Arrow schema of an extract from the Postgres type OIDs of the cursor description."""
+    import pyarrow as pa
+    arrow_types = {
+        16: pa.bool_(),                       # boolean
+        20: pa.int64(),                       # bigint
+        21: pa.int64(),                       # smallint
+        23: pa.int64(),                       # integer
+        700: pa.float64(),                    # real
+        701: pa.float64(),                    # double precision
+        1700: pa.float64(),                   # numeric
+        1114: pa.timestamp('us'),             # timestamp
+        1184: pa.timestamp('us', tz='UTC'),   # timestamptz
+    }
+    # Everything else (text, name, "char", regclass, ...) is fetched as a string
+    return pa.schema([pa.field(desc.name, arrow_types.get(desc.type_code, pa.string())) for desc in description])
+
+def build_query_sql(query, db_host_alpha, schemas_to_compare, object_filter=''):
+    """Replaces the placeholders of a configured query."""
+    sql = query["query"].replace("<db-name>",db_host_alpha)
+    if schemas_to_compare:
+        sql = sql.replace('<owner_filter>', f" AND owner IN ({schemas_to_compare}) ")
+    else:
+        sql = sql.replace('<owner_filter>', '')
+    sql = sql.replace('<object_filter>', object_filter)
+    return sql.strip().rstrip(';')
+
+def build_object_filter(object_keys, key_column):
+    """Builds the <object_filter> condition that restricts a query to the given (owner, object name) keys."""
+    items = sorted("('{}', '{}')".format(owner.replace("'", "''"), name.replace("'", "''")) for owner, name in object_keys)
+    return f" AND (owner, {key_column}) IN ({', '.join(items)}) "
+
+def collect_object_manifest(conn, config, db_host_alpha, schemas_to_compare):
+    """
+    Reads the catalog row versions (xmin) of every relation and routine with
+    the manifest_query of the configuration.
+
+    Returns:
+        dict: Maps (owner, object name) to a signature of the versions of all
+        objects with that name.
+    """
+    sql = build_query_sql({'query': config['manifest_query']}, db_host_alpha, schemas_to_compare)
+    objects = {}
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        for owner, object_name, object_type, version in cur:
+            objects.setdefault((owner, object_name), []).append(f"{object_type}={version}")
+    return {key: ";".join(sorted(signatures)) for key, signatures in objects.items()}
+
+def copy_query_to_csv(conn, sql, csvfile):
+    """
+    Streams the result of a query to a binary CSV stream with COPY ... TO
+    STDOUT, so the server does the CSV serialisation and no rows are
+    materialised in Python. The data uses the same '|' delimiter and header
+    line as write_cursor_to_csv.
+
+    Args:
+        conn: An open psycopg2 connection.
+        sql: The query to export.
+        csvfile: Binary stream the CSV data is written to.
+
+    Returns:
+        int: The number of data rows written.
+    """
+    copy_sql = f"COPY ({sql}) TO STDOUT WITH ({extract_archive.COPY_CSV_OPTIONS}, HEADER)"
+    with conn.cursor() as cur:
+        cur.copy_expert(copy_sql, csvfile)
+        return cur.rowcount
+
+def read_object_list(object_file):
+    """Reads the OWNER, NAME and TYPE columns of a pipe delimited object list, e.g. the reporter's source_hash_mismatches.csv."""
+    with open(object_file, 'r', newline='') as f:
+        reader = csv.DictReader(f, delimiter='|')
+        return [(row['OWNER'], row['NAME'], row['TYPE']) for row in reader]
+
+def fetch_source_code(db_host, db_name, db_user, db_password, object_file, db_port=None):
+    """
+    Fetches the full definition of the routines listed in object_file (e.g.
+    the routines whose source hash differs) into one file per routine under
+    sources/, so that only the mismatching bodies are transferred.
+
+    Args:
+        object_file: Pipe delimited file with OWNER, NAME and TYPE columns.
+        db_port: The port of the Postgres database (libpq default if None).
+    """
+    objects = read_object_list(object_file)
+    sources_dir = os.path.join("./", "sources", f"pg-{db_host}")
+    os.makedirs(sources_dir, exist_ok=True)
+
+    conn = psycopg2.connect(
+        host=db_host,
+        database=db_name,
+        port=db_port,
+        user=db_user,
+        password=db_password
+    )
+    with conn.cursor() as cur:
+        for owner, name, object_type in objects:
+            # Overloaded routines share a name, their definitions go to the same file
+            cur.execute("""SELECT pg_get_functiondef(p.oid) FROM pg_proc p JOIN pg_namespace n ON p.pronamespace = n.oid
+                           WHERE UPPER(n.nspname) = %s AND UPPER(p.proname) = %s ORDER BY p.oid""", (owner, name))
+            source_file = os.path.join(sources_dir, f"{owner}.{name}.{object_type.replace(' ', '_')}.sql".replace(os.sep, '_'))
+            with open(source_file, 'w') as f:
+                f.write(";\n\n".join(definition for (definition,) in cur))
+    conn.close()
+    print(f"Fetched the source of {len(objects)} routines to {sources_dir}")
+
+def extract_queries_to_csv(db_host, db_name, db_user, db_password, config_file, schemas_to_compare=None, batch_size=10000, use_copy=False, compression='deflate', compression_level=None, compression_report=False, extract_format='csv', incremental=False, incremental_max_changes=10000, source_hash=False, db_port=None, archive_factory=None, stop_event=None):
     """
     Extracts data from a Postgres database based on queries and connection settings
-    provided as input arguments. Writes each query's output to a separate CSV file,
-    and then zips all the CSV files.
+    provided as input arguments. Streams each query's output as a CSV (or
+    Parquet) member straight into a compressed zip archive, without temporary
+    files. Each query runs on a server side cursor and rows are streamed in
+    batches of batch_size, so peak memory is independent of the catalog size.
+
+    In incremental mode a snapshot of the extract and of the catalog row
+    versions (xmin) of every relation and routine is kept under
+    extracts/snapshots. The next run only re-extracts the rows of new and
+    changed objects for the queries with an incremental_key, drops the rows of
+    dropped objects and merges the rest from the snapshot.
 
     Args:
         db_host: The hostname of the Postgres database.
@@ -54,6 +203,25 @@ def extract_queries_to_csv(db_host, db_name, db_user, db_password, config_file,
         db_user: The username for the Postgres database.
         db_password: The password for the Postgres database.
         config_file: Path to the YAML configuration file.
+        batch_size: Number of rows fetched per round trip.
+        use_copy: Export each query with COPY ... TO STDOUT instead of a cursor.
+        compression: Archive member compression, one of extract_archive.COMPRESSION_METHODS.
+        compression_level: Compression level passed to the codec (codec default if None).
+        compression_report: Print the archive size and CPU cost of every available codec.
+        extract_format: Either "csv" or "parquet" (typed columns, requires pyarrow).
+        incremental: Re-extract only the objects changed since the previous run.
+        incremental_max_changes: Run a full extraction when more objects changed.
+        source_hash: Also extract the queries that require "source_hash" (hashes of the source code).
+        db_port: The port of the Postgres database (libpq default if None).
+        archive_factory: Returns the binary file object the archive is written
+            to given its path, e.g. an in-memory buffer. The archive is written
+            to the extracts directory if None.
+        stop_event: threading.Event checked before every query, the
+            extraction raises extract_archive.ExtractionCancelled once it is set.
+
+    Returns:
+        dict: Maps the path of the extract archive to the path or file object
+        it was written to.
     """
     # Load Configuration (Handle missing file gracefully)
     # Get the absolute path to the script's directory
@@ -63,87 +231,134 @@ def extract_queries_to_csv(db_host, db_name, db_user, db_password, config_file,
     with open(config_file_path, 'r') as f:
         config = yaml.safe_load(f)
 
+    if use_copy and extract_format != 'csv':
+        print("COPY exports CSV only, using a cursor for the parquet extract format.")
+        use_copy = False
+
     # Connect to the database
     conn = psycopg2.connect(
         host=db_host,
         database=db_name,
+        port=db_port,
         user=db_user,
         password=db_password
     )
 
-    # Create a cursor object
-    cur = conn.cursor()
-
     # Create the "extracts" directory if it doesn't exist
     extracts_dir = os.path.join("./", "extracts")
     os.makedirs(extracts_dir, exist_ok=True)
     db_host_alpha = ''.join(c for c in db_host if c.isalpha()) 
-    # Loop through each query in the configuration file
-    for i, query in enumerate(config['queries']):
-        # Execute the query
-        sql = query["query"].replace("<db-name>",db_host_alpha)
-        if schemas_to_compare:
-            sql = sql.replace('<owner_filter>', f" AND owner IN ({schemas_to_compare}) ")
-        else:
-            sql = sql.replace('<owner_filter>', '')
-
-        print(f"Extracting: {query['name']}")
-        cur.execute(sql)
-
-        # Fetch all rows from the query result
-        rows = cur.fetchall()
-
-        # Get the query name from the YAML (assuming it's a key in the query dict)
-        query_name = config['queries'][i].get('name', f"query_{i+1}")
 
-        # Create a CSV file for the query results
-        csv_file = os.path.join(extracts_dir, f"{query_name}.csv")
+    # Delete the existing archive of this database only, another collector may be writing its own
+    zip_file = os.path.join(extracts_dir, f"pg-extract-{db_host}.zip")
+    if os.path.exists(zip_file):
+        os.remove(zip_file)
 
-        with open(csv_file, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter='|')
+    # Work out which objects changed since the previous incremental run
+    snapshot_dir = os.path.join(extracts_dir, 'snapshots', f"pg-extract-{db_host}")
+    manifest, stale_keys, changed_keys = None, None, None
+    if incremental and extract_format != 'csv':
+        print("Incremental extraction supports the csv extract format only, running a full extraction.")
+    elif incremental:
+        fingerprint = hashlib.sha256(json.dumps([config, db_name, schemas_to_compare, db_host_alpha, source_hash]).encode()).hexdigest()
+        manifest = collect_object_manifest(conn, config, db_host_alpha, schemas_to_compare)
+        previous_manifest = extract_archive.load_snapshot(snapshot_dir, fingerprint)
+        if previous_manifest is not None:
+            changed_keys = {key for key, signature in manifest.items() if previous_manifest.get(key) != signature}
+            dropped_keys = previous_manifest.keys() - manifest.keys()
+            stale_keys = changed_keys | dropped_keys
+            print(f"{len(changed_keys)} new or changed and {len(dropped_keys)} dropped objects since the previous extraction")
+            if len(stale_keys) > incremental_max_changes:
+                print(f"More than {incremental_max_changes} objects changed, running a full extraction.")
+                stale_keys = None
+        else:
+            print("No snapshot of a previous extraction found, running a full extraction.")
 
-            # Write the column headers (optional, can be customized)
-            writer.writerow([desc[0] for desc in cur.description])
+    start_cpu = time.process_time()
+    archives = {zip_file: archive_factory(zip_file) if archive_factory else zip_file}
+    with extract_archive.open_archive(archives[zip_file], compression, compression_level) as z:
+        # Loop through each query in the configuration file
+        for i, query in enumerate(config['queries']):
+            # Skip optional queries that were not requested
+            if query.get('requires') == 'source_hash' and not source_hash:
+                continue
 
-            # Write the data rows
-            writer.writerows(rows)
+            # Get the query name from the YAML (assuming it's a key in the query dict)
+            query_name = config['queries'][i].get('name', f"query_{i+1}")
 
-    # # Zip all the CSV files
-    # zip_file = f"pg-extract-{db_host}.zip"
-    # with zipfile.ZipFile(zip_file, 'w') as z:
-    #     for filename in os.listdir():
-    #         if filename.endswith(".csv"):
-    #             z.write(filename)
-    #             os.remove(filename)
+            # Name of the member holding the query results
+            member_name = f"{query_name}.{extract_format}"
 
-    # Delete existing files starting with "orcl-extract-"
-    for filename in os.listdir(extracts_dir):
-        if filename.startswith("pg-extract-"):
-            os.remove(os.path.join(extracts_dir, filename))
+            extract_archive.check_stop(stop_event)
+            print(f"Extracting: {query['name']}")
+            key_column = query.get('incremental_key')
+            if stale_keys is not None and key_column:
+                # Merge the unchanged rows of the snapshot with the changed objects
+                unchanged_rows = extract_archive.read_unchanged_rows(snapshot_dir, member_name, key_column, stale_keys)
+                header = next(unchanged_rows)
+                cur = None
+                if changed_keys:
+                    sql = build_query_sql(query, db_host_alpha, schemas_to_compare, build_object_filter(changed_keys, key_column))
+                    cur = conn.cursor(name=f"extract_{i}")
+                    cur.itersize = batch_size
+                    cur.execute(sql)
+                with extract_archive.open_archive_member(z, member_name) as csvfile:
+                    row_count = extract_archive.write_merged_csv(cur, csvfile, batch_size, header, unchanged_rows, lineterminator='\n')
+                if cur is not None:
+                    cur.close()
+            elif use_copy:
+                sql = build_query_sql(query, db_host_alpha, schemas_to_compare)
+                with z.open(member_name, 'w', force_zip64=True) as csvfile:
+                    row_count = copy_query_to_csv(conn, sql, csvfile)
+            else:
+                sql = build_query_sql(query, db_host_alpha, schemas_to_compare)
+                # A named (server side) cursor keeps the result set on the server
+                cur = conn.cursor(name=f"extract_{i}")
+                cur.itersize = batch_size
+                cur.execute(sql)
+                if extract_format == 'parquet':
+                    with extract_archive.open_parquet_member(z, member_name) as stream:
+                        row_count = extract_archive.write_cursor_to_parquet(cur, stream, batch_size, arrow_schema_from_description, query_name)
+                else:
+                    with extract_archive.open_archive_member(z, member_name) as csvfile:
+                        row_count = write_cursor_to_csv(cur, csvfile, batch_size)
+                cur.close()
+            print(f"Extracted {row_count} rows from {query_name}")
 
+    extract_archive.report_archive_sizes(archives.values(), compression, time.process_time() - start_cpu)
+    if compression_report:
+        extract_archive.report_compression_costs(archives.values())
+    if manifest is not None:
+        extract_archive.save_snapshot(snapshot_dir, fingerprint, manifest, archives)
 
-    # Zip all the CSV files in the "extracts" directory
-    zip_file = os.path.join(extracts_dir, f"pg-extract-{db_host}.zip")
-    with zipfile.ZipFile(zip_file, 'w') as z:
-        for filename in os.listdir(extracts_dir):
-            if filename.endswith(".csv"):
-                z.write(os.path.join(extracts_dir, filename), filename)
-                os.remove(os.path.join(extracts_dir, filename))
-
-    # Close the cursor and connection
-    cur.close()
+    # Close the connection
     conn.close()
 
-    print(f"Extracted data and saved to {zip_file}")
+    if archive_factory:
+        print(f"Extracted data into an archive without writing to {extracts_dir}")
+    else:
+        print(f"Extracted data and saved to {zip_file}")
+    return archives
 
 def main():
     parser = argparse.ArgumentParser(description='Extract data from a Postgres database')
     parser.add_argument('--host', type=str, help='Hostname of the Postgres database')
+    parser.add_argument('--port', default=None, type=str, help='Port number of the Postgres database (default: 5432)')
     parser.add_argument('--database', type=str, help='Name of the Postgres database')
     parser.add_argument('--user', type=str, help='Username for the Postgres database')
     parser.add_argument('--password', type=str, help='Password for the Postgres database')
     parser.add_argument("--schemas_to_compare", default=None,  help="Schemas to be compared (comma-separated).")
+    parser.add_argument('--batch_size', default=10000, type=int, help='Number of rows fetched per round trip while streaming query results (default: 10000)')
+    parser.add_argument('--use_copy', action='store_true', help='Export each query with COPY ... TO STDOUT, streaming the server generated CSV straight to the extract file')
+    parser.add_argument('--compression', default='deflate', choices=list(extract_archive.COMPRESSION_METHODS), help='Compression of the extract archive members (default: deflate)')
+    parser.add_argument('--compression_level', default=None, type=int, help='Compression level of the selected codec (default: codec default)')
+    parser.add_argument('--extract_format', default='csv', choices=extract_archive.EXTRACT_FORMATS, help='Format of the extract files: pipe delimited "csv" (default) or typed "parquet" (requires pyarrow)')
+    parser.add_argument('--compression_report', action='store_true', help='Report the archive size and CPU cost of every available compression codec')
+    parser.add_argument('--incremental', action='store_true', help='Only re-extract objects whose catalog rows changed since the previous incremental run and merge them with its snapshot')
+    parser.add_argument('--incremental_max_changes', default=10000, type=int, help='Run a full extraction when more objects changed than this (default: 10000)')
     
+    parser.add_argument('--source_hash', action='store_true', help='Also extract a server side computed hash of the source of every PL/pgSQL routine')
+    parser.add_argument('--fetch_source', default=None, type=str, help='Only fetch the full definition of the routines listed in this file (e.g. source_hash_mismatches.csv written by the reporter) into ./sources')
     # parser.add_argument('config_file', type=str, help='Path to the YAML configuration file')
     args = parser.parse_args()
 
@@ -153,7 +368,10 @@ def main():
     if schemas_to_compare:
         schemas_to_compare = ",".join([f"'{item.strip()}'" for item in schemas_to_compare.split(',')])
 
-    extract_queries_to_csv(args.host, args.database, args.user, password,"./config.yaml", schemas_to_compare)
+    if args.fetch_source:
+        fetch_source_code(args.host, args.database, args.user, password, args.fetch_source, args.port)
+    else:
+        extract_queries_to_csv(args.host, args.database, args.user, password,"./config.yaml", schemas_to_compare, args.batch_size, args.use_copy, args.compression, args.compression_level, args.compression_report, args.extract_format, args.incremental, args.incremental_max_changes, args.source_hash, args.port)
 
 if __name__ == "__main__":
     sys.argv[0] = re.sub(r'(-script\.pyw|\.exe)?$', '', sys.argv[0])
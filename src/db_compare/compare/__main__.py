@@ -18,11 +18,13 @@ import os
 import subprocess
 import re
 import sys
-from google.cloud import secretmanager
+import threading
+import time
 
 
 def get_secret(secret_name):
     """Fetches the secret value from Google Secret Manager."""
+    from google.cloud import secretmanager  # Only needed for gcp-secret: passwords
     client = secretmanager.SecretManagerServiceClient()
     project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
     if not project_id:
@@ -39,6 +41,110 @@ def resolve_password(password_arg):
         return get_secret(secret_name)
     return password_arg
 
+def stream_output(label, process, print_lock):
+    """Prints the output lines of a stage prefixed with its label as they arrive."""
+    for line in process.stdout:
+        with print_lock:
+            print(f"[{label}] {line}", end="", flush=True)
+
+def run_concurrently(stages):
+    """
+    Runs the commands of several stages as concurrent subprocesses and merges
+    their output, each line prefixed with the label of its stage. As soon as
+    one stage fails the others are terminated.
+
+    Args:
+        stages: List of (label, command) tuples.
+
+    Returns:
+        int: 0 if all stages succeeded, otherwise the exit code of the first failing stage.
+    """
+    print_lock = threading.Lock()
+    # Unbuffered output, so the progress of the stages is shown as it happens
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    running = []
+    threads = []
+    exit_code = 0
+    try:
+        for label, command in stages:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+            thread = threading.Thread(target=stream_output, args=(label, process, print_lock), daemon=True)
+            thread.start()
+            running.append((label, process))
+            threads.append(thread)
+
+        while running:
+            for label, process in list(running):
+                return_code = process.poll()
+                if return_code is None:
+                    continue
+                running.remove((label, process))
+                if return_code != 0 and exit_code == 0:
+                    exit_code = return_code
+                    with print_lock:
+                        print(f"Error: {label} failed with exit code {return_code}, stopping the other stages.", flush=True)
+                    for _, sibling in running:
+                        sibling.terminate()
+            time.sleep(0.1)
+    finally:
+        # Also stops the stages when the orchestrator itself is interrupted
+        for _, process in running:
+            process.terminate()
+            process.wait()
+        for thread in threads:
+            thread.join()
+    return exit_code
+
+def build_sources(args, oracle_password1, postgres_password1):
+    """Returns the pipeline sources of the selected comparison mode."""
+    from compare import pipeline
+    sources = []
+    if args.oracle_to_postgres or args.oracle_to_oracle:
+        for i in ([1] if args.oracle_to_postgres else [1, 2]):
+            sources.append(pipeline.OracleSource(
+                user=getattr(args, f"oracle_user{i}"),
+                password=oracle_password1 if i == 1 else resolve_password(getattr(args, f"oracle_password{i}")),
+                host=getattr(args, f"oracle_host{i}"),
+                port=str(getattr(args, f"oracle_port{i}")),
+                service=getattr(args, f"oracle_service{i}"),
+                tns=getattr(args, f"oracle_tns{i}"),
+                tns_path=getattr(args, f"oracle_tns_path{i}"),
+                protocol=getattr(args, f"oracle_protocol{i}"),
+                view_type=args.oracle_view_type,
+                label="oracle" if args.oracle_to_postgres else f"oracle{i}"))
+    if args.oracle_to_postgres or args.postgres_to_postgres:
+        for i in ([1] if args.oracle_to_postgres else [1, 2]):
+            sources.append(pipeline.PostgresSource(
+                host=getattr(args, f"postgres_host{i}"),
+                database=getattr(args, f"postgres_database{i}"),
+                user=getattr(args, f"postgres_user{i}"),
+                password=postgres_password1 if i == 1 else resolve_password(getattr(args, f"postgres_password{i}")),
+                port=str(getattr(args, f"postgres_port{i}")),
+                label="postgres" if args.oracle_to_postgres else f"postgres{i}"))
+    return sources
+
+def run_in_process(args, oracle_password1, postgres_password1, staging_postgres_connection_string):
+    """Runs all stages in this process with the pipeline API, sharing connections and in-memory extracts."""
+    from compare import pipeline
+    from importer.__main__ import resolve_postgres_connection_string
+    if staging_postgres_connection_string:
+        staging_postgres_connection_string = resolve_postgres_connection_string(staging_postgres_connection_string)
+    staging = None if args.staging_db_type == "direct" else pipeline.Staging(project_id=args.staging_project_id, dataset_id=args.staging_dataset_id, location=args.staging_location,
+                               postgres_connection_string=staging_postgres_connection_string, schema=args.staging_schema,
+                               pool_size=max(5, args.parallelism), embedded_db_type=args.staging_db_type,
+                               database_path=args.staging_database_path)
+    collect_options = pipeline.CollectOptions(schemas_to_compare=args.schemas_to_compare, extract_format=args.extract_format,
+                                              source_hash=args.source_hash, in_memory_limit=args.in_memory_limit_mb * 1024 * 1024)
+    import_options = pipeline.ImportOptions(parallelism=args.parallelism, full_reload=args.full_reload, fast_load=args.fast_load)
+    report_options = pipeline.ReportOptions(schemas_to_compare=args.schemas_to_compare, schema_mapping=args.schema_mapping,
+                                            report_format=args.format, source_hash=args.source_hash)
+    try:
+        pipeline.run(build_sources(args, oracle_password1, postgres_password1), staging, collect_options, report_options, import_options)
+    except Exception:
+        logging.exception("Comparison failed")
+        return 1
+    return 0
+
 def main():
     """Main function for the schema comparison utility."""
     parser = argparse.ArgumentParser(description='Oracle to Postgres Database Comparison Utility')
@@ -107,11 +213,16 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)  # Ensure one is chosen
     group.add_argument("--staging_project_id", help="Your Google Cloud Project ID (for BigQuery). Use this if the staging area is BigQuery.")
     group.add_argument("--staging_postgres_connection_string", help="Connection string for your PostgreSQL database. Use this if the staging area is a postgres db. format: 'postgresql://username:pwd@ip_address/db_name' or Google Secret Manager name containing the full connection string (e.g., gcp-secret:my-secret).")
+    group.add_argument("--staging_db_type", choices=["duckdb", "sqlite", "direct"], help="Use a local DuckDB or SQLite database file as the staging area, no staging server needed, or compute the report from the extracts in memory without a staging area (direct).")
     
     # Common import arguments
     parser.add_argument("--staging_dataset_id", help="The BigQuery dataset name. Use this if the staging area is BigQuery.")
     parser.add_argument("--staging_location", default="US", help="Geographic location for the dataset (default: US). Use this if the staging area is BigQuery.")
     parser.add_argument("--staging_schema", default="schema_compare",help="Schema for your PostgreSQL database. Use this if the staging area is a postgres db.")
+    parser.add_argument("--staging_database_path", help="File of the local staging database (default: staging.duckdb or staging.sqlite). Use this with --staging_db_type.")
+    parser.add_argument("--parallelism", default=1, type=int, help="Number of tables loaded into the staging area at the same time (default: 1)")
+    parser.add_argument("--fast_load", action="store_true", help="Load the Postgres staging tables as UNLOGGED tables in a single transaction")
+    parser.add_argument("--full_reload", action="store_true", help="Drop the staging tables before loading instead of replacing only the compared instances")
   
 
     # Report options
@@ -120,6 +231,14 @@ def main():
     
     parser.add_argument('--format', default='html', choices=['html', 'text'], help='Report output format')
 
+    # Extract options
+    parser.add_argument('--extract_format', default='csv', choices=['csv', 'parquet'], help='Format of the collector extract files (parquet requires pyarrow)')
+    parser.add_argument('--source_hash', action='store_true', help='Collect server side hashes of the PL/SQL and PL/pgSQL source and report objects whose hash differs')
+
+    # Execution options
+    parser.add_argument('--subprocess', action='store_true', help='Run every stage as a separate "python -m" process exchanging files in ./extracts (fallback of the default in-process pipeline)')
+    parser.add_argument('--in_memory_limit_mb', default=256, type=int, help='Extract archives up to this size are passed from the collectors to the importer in memory, larger ones are spooled to a temporary file (default: 256, in-process only)')
+
     args = parser.parse_args()
 
     # Configure logging
@@ -131,9 +250,17 @@ def main():
     postgres_password1 = resolve_password(args.postgres_password1)
     # postgres_password2 = resolve_password(args.postgres_password2) if args.postgres_password2 else None
     staging_postgres_connection_string = resolve_password(args.staging_postgres_connection_string)
+    source_hash_args = ["--source_hash"] if args.source_hash else []
+    full_reload_args = ["--full_reload"] if args.full_reload else []
+    fast_load_args = ["--fast_load"] if args.fast_load else []
+    database_path_args = ["--database_path", args.staging_database_path] if args.staging_database_path else []
+
+    if not args.subprocess:
+        return run_in_process(args, oracle_password1, postgres_password1, staging_postgres_connection_string)
     
+    # Build the collector commands, they run concurrently as they hit different database servers
+    collector_stages = []
     if args.oracle_to_postgres:
-        print("Extracting Oracle metadata...")
         # Call oracollector
         for i in [1]:
             if getattr(args, f"oracle_tns{i}"):
@@ -146,19 +273,14 @@ def main():
             command.extend(arguments)  # Add arguments to the main command list
             command.extend(["--view_type", args.oracle_view_type])
             command.extend(["--schemas_to_compare", args.schemas_to_compare or ""])
+            command.extend(["--extract_format", args.extract_format])
+            command.extend(source_hash_args)
+            collector_stages.append(("oracle", command))
 
-            try:
-                subprocess.run(command, check=True) #check=True raises exception on error, capture_output for better error messages
-                print("Oracle metadata extraction successful.")
-            except subprocess.CalledProcessError as e:
-                print(f"Error extracting Oracle metadata: {e.stderr}")
-                return
-
-        print("Extracting Postgres metadata...")
-        
         # Call pgcollector
-        subprocess.run(["python", "-m", "pgcollector", "--host", args.postgres_host1, "--database", args.postgres_database1,
-                        "--user", args.postgres_user1, "--password", postgres_password1, "--schemas_to_compare", args.schemas_to_compare or ""], check=True)
+        collector_stages.append(("postgres", ["python", "-m", "pgcollector", "--host", args.postgres_host1, "--database", args.postgres_database1,
+                        "--user", args.postgres_user1, "--password", postgres_password1, "--port", str(args.postgres_port1), "--schemas_to_compare", args.schemas_to_compare or "",
+                        "--extract_format", args.extract_format] + source_hash_args))
         
     
     elif args.oracle_to_oracle:
@@ -175,35 +297,55 @@ def main():
                         "--user", getattr(args, f"oracle_user{i}"),
                         "--password", oracle_password,
                         "--view_type", args.oracle_view_type, 
-                        "--schemas_to_compare", args.schemas_to_compare or ""]
+                        "--schemas_to_compare", args.schemas_to_compare or "",
+                        "--extract_format", args.extract_format] + source_hash_args
                 command.extend(arguments)
-
-                result = subprocess.run(command, check=True)
-                # Print the captured output
-                print(result.stdout)
-                # print(f"Oracle metadata extraction successful for connection {i}.")
+                collector_stages.append((f"oracle{i}", command))
 
             except AttributeError as e:
                 print(f"Missing argument for connection {i}: {e}")
-                return
-            except subprocess.CalledProcessError as e:
-                print(f"Error extracting Oracle metadata for connection {i}: {e.stderr}")
-                return
+                return 1
 
     elif args.postgres_to_postgres:
          # Postgres to Postgres comparison
         for i in [1, 2]:
             pg_password = resolve_password(getattr(args, f"postgres_password{i}"))
-            subprocess.run(["python", "-m", "pgcollector", "--host", getattr(args, f"postgres_host{i}"), "--database", getattr(args, f"postgres_database{i}"),
-                          "--user", getattr(args, f"postgres_user{i}"), "--password", pg_password, "--port", getattr(args, f"postgres_port{i}"), "--schemas_to_compare", args.schemas_to_compare or ""], check=True)
+            collector_stages.append((f"postgres{i}", ["python", "-m", "pgcollector", "--host", getattr(args, f"postgres_host{i}"), "--database", getattr(args, f"postgres_database{i}"),
+                          "--user", getattr(args, f"postgres_user{i}"), "--password", pg_password, "--port", str(getattr(args, f"postgres_port{i}")), "--schemas_to_compare", args.schemas_to_compare or "",
+                          "--extract_format", args.extract_format] + source_hash_args))
+
+    print(f"Extracting metadata ({', '.join(label for label, _ in collector_stages)})...")
+    start_time = time.perf_counter()
+    exit_code = run_concurrently(collector_stages)
+    if exit_code != 0:
+        logging.error(f"Metadata extraction failed with exit code {exit_code}")
+        return exit_code
+    print(f"Metadata extraction successful in {time.perf_counter() - start_time:.2f}s.")
     
+    if args.staging_db_type == "direct":
+        print("Generating the comparison report from the extracts...")
+        result = subprocess.run(["python", "-m", "reporter", "--db_type", "direct", "--extract_directory", "extracts", "--schemas_to_compare", args.schemas_to_compare or "",
+                                 "--schema_mapping", args.schema_mapping or "", "--format", args.format] + source_hash_args)
+        if result.returncode != 0:
+            # Keep the extracts to rerun the reporter on them
+            logging.error(f"Report generation failed with exit code {result.returncode}, the extracts are kept in extracts")
+            return result.returncode
+        # Archive the extracts as the importer does
+        from importer.__main__ import delete_files_in_directory
+        delete_files_in_directory("extracts")
+        return 0
+
     print("Loading metadata into staging area...")
     # Call importer
     if args.staging_project_id:
-        subprocess.run(["python", "-m", "importer", "--project_id", args.staging_project_id, "--dataset_id", args.staging_dataset_id], check=True)
+        subprocess.run(["python", "-m", "importer", "--project_id", args.staging_project_id, "--dataset_id", args.staging_dataset_id,
+                        "--parallelism", str(args.parallelism)] + full_reload_args, check=True)
+    elif args.staging_db_type:
+        subprocess.run(["python", "-m", "importer", "--db_type", args.staging_db_type, "--schema", args.staging_schema]
+                       + database_path_args + full_reload_args, check=True)
     elif args.staging_postgres_connection_string:
         subprocess.run(["python", "-m", "importer", "--postgres_connection_string", staging_postgres_connection_string,
-                      "--schema", args.staging_schema], check=True)
+                      "--schema", args.staging_schema, "--parallelism", str(args.parallelism)] + full_reload_args + fast_load_args, check=True)
     else:
         logging.error('Please specify either staging_project_id and staging_dataset_id for BigQuery or staging_postgres_connection_string for Postgres')
         return
@@ -212,10 +354,13 @@ def main():
     # Call reporter
     if args.staging_project_id:
         subprocess.run(["python", "-m", "reporter", "--db_type", "bigquery", "--project_id", args.staging_project_id,
-                      "--dataset_id", args.staging_dataset_id, "--schemas_to_compare", args.schemas_to_compare or "", "--schema_mapping", args.schema_mapping or "", "--format", args.format], check=True)
+                      "--dataset_id", args.staging_dataset_id, "--schemas_to_compare", args.schemas_to_compare or "", "--schema_mapping", args.schema_mapping or "", "--format", args.format] + source_hash_args, check=True)
+    elif args.staging_db_type:
+        subprocess.run(["python", "-m", "reporter", "--db_type", args.staging_db_type] + database_path_args +
+                       ["--schema_name", args.staging_schema, "--schemas_to_compare", args.schemas_to_compare or "", "--schema_mapping", args.schema_mapping or "", "--format", args.format] + source_hash_args, check=True)
     elif args.staging_postgres_connection_string:
         subprocess.run(["python", "-m", "reporter", "--db_type", "postgres", "--postgres_connection_string", staging_postgres_connection_string,
-                      "--schema_name", args.staging_schema, "--schemas_to_compare", args.schemas_to_compare or "", "--schema_mapping", args.schema_mapping or "", "--format", args.format], check=True)
+                      "--schema_name", args.staging_schema, "--schemas_to_compare", args.schemas_to_compare or "", "--schema_mapping", args.schema_mapping or "", "--format", args.format] + source_hash_args, check=True)
     else:
         logging.error('Please specify either project_id and dataset_id for BigQuery or connection_string for Postgres')
         return
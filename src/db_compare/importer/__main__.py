@@ -14,18 +14,20 @@
 
 
 import argparse
+import concurrent.futures
+import contextlib
+import csv
+import datetime
+import functools
+import io
 import os
-from google.cloud import bigquery
-from google.cloud.exceptions import NotFound
+import time
 import zipfile
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-import pandas as pd
-from sqlalchemy import text
 import shutil
 import re
 import sys
-from google.cloud import secretmanager
+
+from importer import extract_archive, schema_registry
 
 def resolve_postgres_connection_string(connection_string):
     """
@@ -59,6 +61,7 @@ def resolve_postgres_connection_string(connection_string):
 
 def get_secret(secret_name):
     """Fetches the secret value from Google Secret Manager."""
+    from google.cloud import secretmanager  # Only needed for gcp-secret: passwords
     client = secretmanager.SecretManagerServiceClient()
     project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
     if not project_id:
@@ -77,67 +80,345 @@ def resolve_password(password_arg):
 
 # Base = declarative_base()
 
+# Extract file types written by the collectors
+EXTRACT_EXTENSIONS = ('.csv', '.parquet')
+
+# Local staging databases that need no staging server, and their default files
+EMBEDDED_DATABASE_PATHS = {"duckdb": "staging.duckdb", "sqlite": "staging.sqlite"}
+
+# PostgreSQL column types of the Arrow types used in Parquet extracts
+ARROW_POSTGRES_TYPES = {
+    'int64': 'BIGINT',
+    'double': 'DOUBLE PRECISION',
+    'bool': 'BOOLEAN',
+    'string': 'TEXT',
+    'timestamp[us]': 'TIMESTAMP',
+    'timestamp[us, tz=UTC]': 'TIMESTAMPTZ',
+}
 
-def unzip_all_files(directory_path):
+def list_extract_files(csv_directory):
     """
-    Unzips all ZIP files found in the specified directory.
+    Lists the CSV and Parquet extracts of a directory.
 
-    Args:
-        directory_path (str): The path to the directory containing the ZIP files.
+    Returns:
+        list: (filename, opener) pairs, opener() returns a binary file object.
     """
-    for filename in os.listdir(directory_path):
-        if filename.endswith('.zip'):
-            zip_path = os.path.join(directory_path, filename)
+    return [(filename, functools.partial(open, os.path.join(csv_directory, filename), "rb"))
+            for filename in sorted(os.listdir(csv_directory)) if filename.endswith(EXTRACT_EXTENSIONS)]
 
-            try:
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(directory_path)  # Extract to same directory
-                    print(f"Unzipped: {filename}")
-            except zipfile.BadZipFile:
+class ArchiveMemberFile(io.BufferedReader):
+    """
+    Binary reader of an archive member. Reports the mode "rb" of a file opened
+    with open(path, "rb"), which the BigQuery client checks before an upload.
+    """
+    mode = "rb"
+
+def read_archive_member(archive, member_name):
+    """Opens a member of a zip archive given as a path or a binary file object."""
+    return ArchiveMemberFile(zipfile.ZipFile(archive).open(member_name))
+
+def list_archive_members(archives):
+    """
+    Lists the CSV and Parquet members of zip archives, which can be paths or
+    binary file objects (e.g. in-memory archives), without extracting them.
+
+    Returns:
+        list: (member name, opener) pairs, opener() returns a binary file object.
+    """
+    extract_files = []
+    for archive in archives:
+        if isinstance(archive, str):
+            with zipfile.ZipFile(archive) as zip_ref:
+                member_names = zip_ref.namelist()
+            open_member = functools.partial(read_archive_member, archive)
+        else:
+            # Members of an in-memory archive share its file position, one ZipFile
+            # serialises their reads when tables are loaded in parallel
+            zip_ref = zipfile.ZipFile(archive)
+            member_names = zip_ref.namelist()
+            open_member = lambda member_name, zip_ref=zip_ref: ArchiveMemberFile(zip_ref.open(member_name))
+        for member_name in member_names:
+            if member_name.endswith(EXTRACT_EXTENSIONS):
+                extract_files.append((member_name, functools.partial(open_member, member_name)))
+    return extract_files
+
+def list_directory_extracts(zip_directory, csv_directory):
+    """
+    Lists the extracts to import without unzipping them: the CSV and Parquet
+    members of the zip archives of zip_directory, read in place, and the
+    extract files of csv_directory that are not in one of these archives.
+
+    Returns:
+        list: (filename, opener) pairs, opener() returns a binary file object.
+    """
+    archives = []
+    for filename in sorted(os.listdir(zip_directory)):
+        if filename.endswith('.zip'):
+            zip_path = os.path.join(zip_directory, filename)
+            if zipfile.is_zipfile(zip_path):
+                archives.append(zip_path)
+            else:
                 print(f"Error: {filename} is not a valid ZIP file.")
+    extract_files = list_archive_members(archives)
+    print(f"Found {len(extract_files)} extracts in {len(archives)} archives of {zip_directory}")
+    member_names = {member_name for member_name, _ in extract_files}
+    return extract_files + [(filename, open_file) for filename, open_file in list_extract_files(csv_directory)
+                            if filename not in member_names]
 
-def truncate_tables(client, project_id, dataset_id, csv_directory):
-    """Truncates each unique table corresponding to CSV files in the directory."""
-    truncated_tables = set()
-    for filename in os.listdir(csv_directory):
-        if filename.endswith(".csv"):
-            table_name = filename.split("__")[1]
-            if table_name not in truncated_tables:
-                table_id = f"{project_id}.{dataset_id}.{table_name}"
-                try:
-                    truncate_query = f"DROP TABLE `{table_id}`"
-                    query_job = client.query(truncate_query)
-                    query_job.result()  # Wait for the truncation to complete
-                    print(f"Dropped table {table_name}")
-                except NotFound:
-                    print(f"Table {table_id} not found. Skipping drop operation.")
-                truncated_tables.add(table_name)  # Mark as truncated
-
-def load_csv_files(client, project_id, dataset_id, csv_directory):
-    """Loads CSV files into the corresponding BigQuery tables."""
-    dataset_ref = client.dataset(dataset_id)
-    for filename in os.listdir(csv_directory):
-        if filename.endswith(".csv"):
-            table_name = filename.split("__")[1]
-            table_ref = dataset_ref.table(table_name)
-            job_config = bigquery.LoadJobConfig(
-                source_format=bigquery.SourceFormat.CSV,
-                skip_leading_rows=1,
-                autodetect=True,
-                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-            )
-            file_path = os.path.join(csv_directory, filename)
+def read_extract_pkey(filename, open_file):
+    """
+    Returns the instance key (PKEY) of an extract, read from its first row.
+    All rows of an extract belong to the same instance.
+
+    Returns:
+        str: The PKEY, None if the extract has no rows or no PKEY column.
+    """
+    with open_file() as source_file:
+        if filename.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(source_file)
+            names = [name for name in parquet_file.schema_arrow.names if name.upper() == "PKEY"]
+            if not names or parquet_file.num_row_groups == 0:
+                return None
+            values = parquet_file.read_row_group(0, columns=names).column(0)
+            return values[0].as_py() if len(values) else None
+        rows = csv.reader([source_file.readline().decode("utf-8"), source_file.readline().decode("utf-8")], delimiter="|")
+        header, first_row = next(rows), next(rows, None)
+    columns = [column.upper() for column in header]
+    if not first_row or "PKEY" not in columns:
+        return None
+    return first_row[columns.index("PKEY")]
+
+def list_extract_pkeys(extract_files):
+    """Returns the sorted instance keys (PKEY) of the given extracts."""
+    return sorted({pkey for pkey in (read_extract_pkey(filename, open_file) for filename, open_file in extract_files) if pkey})
+
+def load_tables(extract_files, load_file, parallelism=1, failures=None, open_table=None):
+    """
+    Loads the extracts with up to parallelism tables at a time. The files of a
+    table (e.g. the extracts of both instances) are loaded one after the other
+    by the same worker, so they are appended to it safely.
+
+    Args:
+        extract_files (list): (filename, opener) pairs, see list_extract_files and list_archive_members.
+        load_file (callable): load_file(filename, source_file, table_name) loads a file and returns its row count.
+        parallelism (int): Maximum number of tables loaded at the same time.
+        failures (dict): If given, receives the error of every file that failed to load.
+        open_table (callable): If given, open_table(table_name) returns the
+            context manager of a transaction covering all files of the table,
+            whose value (e.g. a cursor) is passed to load_file as a fourth
+            argument. Once a file fails, the transaction is rolled back and the
+            other files of the table are reported as not loaded.
+
+    Returns:
+        dict: (rows, seconds) by table name.
+    """
+    tables = {}
+    for filename, open_file in extract_files:
+        tables.setdefault(filename.split("__")[1], []).append((filename, open_file))
+
+    def load_table_files(table_name, files, *load_args):
+        table_rows = 0
+        for filename, open_file in files:
+            start_time = time.perf_counter()
             try:
-                with open(file_path, "rb") as source_file:
-                    load_job = client.load_table_from_file(source_file, table_ref, job_config=job_config)
-                load_job.result()
+                with open_file() as source_file:
+                    rows = load_file(filename, source_file, table_name, *load_args) or 0
+                seconds = time.perf_counter() - start_time
+                print(f"Loaded {filename} into {table_name}: {rows} rows in {seconds:.2f}s ({rows / seconds if seconds else 0:,.0f} rows/s)")
+                table_rows += rows
             except Exception as e:
-                print(e)
-            print(f"Loaded {filename} into {table_name}")
+                print(f"Error loading {filename} into {table_name}: {e}")
+                if failures is not None:
+                    failures[filename] = str(e)
+                if open_table is not None:
+                    raise
+        return table_rows
 
-def load_csv_to_bigquery(project_id, dataset_id, csv_directory, location="US"):
-    """Main function to orchestrate the loading process."""
-    client = bigquery.Client(project=project_id)
+    def load_table(table_name, files):
+        table_start_time = time.perf_counter()
+        if open_table is None:
+            return load_table_files(table_name, files), time.perf_counter() - table_start_time
+        try:
+            with open_table(table_name) as table_context:
+                table_rows = load_table_files(table_name, files, table_context)
+        except Exception as e:
+            print(f"Rolled back the load of {table_name}")
+            if failures is not None:
+                for filename, _ in files:
+                    failures.setdefault(filename, f"Not loaded, the load of {table_name} was rolled back: {e}")
+            table_rows = 0
+        return table_rows, time.perf_counter() - table_start_time
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        futures = {table_name: executor.submit(load_table, table_name, files) for table_name, files in tables.items()}
+        return {table_name: future.result() for table_name, future in futures.items()}
+
+def print_load_summary(table_stats, seconds):
+    """Prints the rows and load time of every table and the wall clock time of the import."""
+    total_rows = sum(rows for rows, _ in table_stats.values())
+    print(f"Loaded {len(table_stats)} tables, {total_rows} rows in {seconds:.2f}s ({total_rows / seconds if seconds else 0:,.0f} rows/s):")
+    for table_name, (rows, table_seconds) in sorted(table_stats.items(), key=lambda item: -item[1][1]):
+        print(f"  {table_name:<20} {rows:>10} rows {table_seconds:8.2f}s ({rows / table_seconds if table_seconds else 0:,.0f} rows/s)")
+
+def truncate_tables(client, project_id, dataset_id, extract_files, location=None):
+    """
+    Drops each unique table corresponding to the CSV or Parquet extracts, with
+    a single multi-statement query job instead of one job per table.
+    """
+    table_names = sorted({filename.split("__")[1] for filename, _ in extract_files})
+    if not table_names:
+        return
+    drop_script = "\n".join(f"DROP TABLE IF EXISTS `{project_id}.{dataset_id}.{table_name}`;" for table_name in table_names)
+    client.query(drop_script, location=location).result()  # Wait for the drops to complete
+    print(f"Dropped tables {', '.join(table_names)}")
+
+def delete_instances_from_bigquery(client, project_id, dataset_id, extract_files, pkeys, location=None):
+    """
+    Deletes the rows of the given instances (PKEY) from the existing tables of
+    the extracts, with a single multi-statement query job. The rows of the
+    other instances already staged are kept.
+    """
+    from google.cloud import bigquery
+    existing_tables = {table.table_id for table in client.list_tables(dataset_id)}
+    table_names = sorted({filename.split("__")[1] for filename, _ in extract_files} & existing_tables)
+    if not table_names or not pkeys:
+        return
+    delete_script = "\n".join(f"DELETE FROM `{project_id}.{dataset_id}.{table_name}` WHERE PKEY IN UNNEST(@pkeys);" for table_name in table_names)
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ArrayQueryParameter("pkeys", "STRING", pkeys)])
+    client.query(delete_script, job_config=job_config, location=location).result()
+    print(f"Deleted the rows of {', '.join(pkeys)} from {', '.join(table_names)}")
+
+def record_load_history_bigquery(client, project_id, dataset_id, pkeys, location=None):
+    """Records the load time of the given instances (PKEY) in the load history table."""
+    from google.cloud import bigquery
+    table_id = f"{project_id}.{dataset_id}.{schema_registry.LOAD_HISTORY_TABLE}"
+    history_script = f"""
+        CREATE TABLE IF NOT EXISTS `{table_id}` (PKEY STRING, LOADED_AT TIMESTAMP);
+        INSERT INTO `{table_id}` (PKEY, LOADED_AT) SELECT pkey, CURRENT_TIMESTAMP() FROM UNNEST(@pkeys) AS pkey;
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ArrayQueryParameter("pkeys", "STRING", pkeys)])
+    client.query(history_script, job_config=job_config, location=location).result()
+
+def submit_load_jobs(client, dataset_id, extract_files, parallelism, failures):
+    """
+    Uploads the extracts with up to parallelism threads and returns their load
+    jobs without waiting for them. Upload errors are added to failures.
+
+    Returns:
+        list: (filename, table name, load job) tuples.
+    """
+    from google.cloud import bigquery
+    dataset_ref = client.dataset(dataset_id)
+
+    def submit(filename, open_file):
+        # Parquet files carry their own schema, no autodetection needed
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+        with open_file() as source_file:
+            if not filename.endswith(".parquet"):
+                # Registered tables are loaded with their declared types, others are autodetected
+                header = source_file.readline().decode("utf-8").rstrip("\r\n")
+                columns = schema_registry.header_columns(schema_registry.table_name(filename), next(csv.reader([header], delimiter="|")))
+                job_config = bigquery.LoadJobConfig(
+                    source_format=bigquery.SourceFormat.CSV,
+                    field_delimiter="|",
+                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+                )
+                if columns is None:
+                    source_file.seek(0)
+                    job_config.skip_leading_rows = 1
+                    job_config.autodetect = True
+                else:
+                    job_config.schema = schema_registry.bigquery_schema(columns)
+            return client.load_table_from_file(source_file, dataset_ref.table(filename.split("__")[1]), job_config=job_config)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        futures = [(filename, executor.submit(submit, filename, open_file)) for filename, open_file in extract_files]
+    jobs = []
+    for filename, future in futures:
+        try:
+            jobs.append((filename, filename.split("__")[1], future.result()))
+        except Exception as e:
+            failures[filename] = str(e)
+    return jobs
+
+def wait_for_load_jobs(jobs, table_stats, failures):
+    """
+    Waits for all submitted load jobs, adding the rows and the run time of
+    every table to table_stats and the errors of failed jobs to failures.
+    """
+    for filename, table_name, load_job in jobs:
+        try:
+            load_job.result()
+        except Exception as e:
+            failures[filename] = str(e)
+            continue
+        rows = load_job.output_rows or 0
+        print(f"Loaded {filename} into {table_name}: {rows} rows in {(load_job.ended - load_job.created).total_seconds():.2f}s")
+        table_rows, created, ended = table_stats.get(table_name, (0, load_job.created, load_job.ended))
+        table_stats[table_name] = (table_rows + rows, min(created, load_job.created), max(ended, load_job.ended))
+
+def create_registered_tables(client, project_id, dataset_id, table_names):
+    """Creates the tables of the schema registry among table_names with their declared schema."""
+    from google.cloud import bigquery
+    for table_name in table_names:
+        table = bigquery.Table(f"{project_id}.{dataset_id}.{table_name}",
+                               schema=schema_registry.bigquery_schema(schema_registry.table_columns(table_name)))
+        client.create_table(table, exists_ok=True)
+
+def load_csv_files(client, project_id, dataset_id, extract_files, parallelism=1):
+    """
+    Loads CSV and Parquet extracts into the corresponding BigQuery tables. The
+    load jobs are submitted up front and waited on together. The tables of the
+    schema registry are created beforehand, so all their files are loaded at
+    once. The first file of any other table creates it with an autodetected
+    schema, the other files of those tables are loaded once it exists.
+
+    Returns:
+        tuple: (rows, seconds) by table name and the error by failed file name.
+    """
+    table_names = sorted({filename.split("__")[1] for filename, _ in extract_files})
+    create_registered_tables(client, project_id, dataset_id, [table_name for table_name in table_names if schema_registry.table_columns(table_name)])
+
+    first_files, other_files, seen_tables = [], [], set()
+    for filename, open_file in extract_files:
+        table_name = filename.split("__")[1]
+        if table_name in seen_tables and not schema_registry.table_columns(table_name):
+            other_files.append((filename, open_file))
+        else:
+            first_files.append((filename, open_file))
+        seen_tables.add(table_name)
+
+    table_stats, failures = {}, {}
+    for wave in (first_files, other_files):
+        if wave:
+            wait_for_load_jobs(submit_load_jobs(client, dataset_id, wave, parallelism, failures), table_stats, failures)
+    return ({table_name: (rows, (ended - created).total_seconds()) for table_name, (rows, created, ended) in table_stats.items()},
+            failures)
+
+def load_extracts_to_bigquery(client, project_id, dataset_id, extract_files, location="US", parallelism=1, full_reload=False):
+    """
+    Creates the dataset if needed and replaces the rows of the instances
+    (PKEY) of the given extracts. Other instances already staged are kept,
+    unless full_reload drops the tables first.
+
+    Args:
+        client: BigQuery client.
+        project_id (str): Google Cloud project ID.
+        dataset_id (str): BigQuery dataset name.
+        extract_files (list): (filename, opener) pairs, see list_extract_files and list_archive_members.
+        location (str): Geographic location of the dataset.
+        parallelism (int): Maximum number of extracts uploaded at the same time.
+        full_reload (bool): Drop the tables of the extracts instead of replacing their instances.
+
+    Raises:
+        RuntimeError: If any extract failed to load, once all load jobs have finished.
+    """
+    from google.cloud import bigquery
+    from google.cloud.exceptions import NotFound
 
     # Dataset Creation (if not exists)
     try:
@@ -150,20 +431,289 @@ def load_csv_to_bigquery(project_id, dataset_id, csv_directory, location="US"):
         dataset = client.create_dataset(dataset)
         print(f"Created dataset {dataset_id} in {location}.")
 
-    # Truncate tables before loading
-    truncate_tables(client, project_id, dataset_id, csv_directory)
+    pkeys = list_extract_pkeys(extract_files)
+    if full_reload:
+        # Truncate tables before loading
+        truncate_tables(client, project_id, dataset_id, extract_files, location)
+    else:
+        delete_instances_from_bigquery(client, project_id, dataset_id, extract_files, pkeys, location)
 
     # Load CSV files
-    load_csv_files(client, project_id, dataset_id, csv_directory)
+    start_time = time.perf_counter()
+    table_stats, failures = load_csv_files(client, project_id, dataset_id, extract_files, parallelism)
+    print_load_summary(table_stats, time.perf_counter() - start_time)
+    if failures:
+        for filename, error in sorted(failures.items()):
+            print(f"Failed to load {filename}: {error}")
+        raise RuntimeError(f"{len(failures)} of {len(extract_files)} extracts failed to load into BigQuery: {', '.join(sorted(failures))}")
+    record_load_history_bigquery(client, project_id, dataset_id, pkeys, location)
+
+def load_csv_to_bigquery(project_id, dataset_id, csv_directory, location="US", parallelism=1, zip_directory=None, full_reload=False):
+    """Main function to orchestrate the loading process, the archives of zip_directory are read in place."""
+    from google.cloud import bigquery
+    client = bigquery.Client(project=project_id)
+    extract_files = list_directory_extracts(zip_directory, csv_directory) if zip_directory else list_extract_files(csv_directory)
+    load_extracts_to_bigquery(client, project_id, dataset_id, extract_files, location, parallelism, full_reload)
+
+@contextlib.contextmanager
+def staging_cursor(engine, cur=None):
+    """
+    Yields cur if given, the caller then owns the transaction, else a cursor on
+    a new connection of engine that is committed if the block succeeds.
+    """
+    if cur is not None:
+        yield cur
+        return
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as new_cur:
+            yield new_cur
+        conn.commit()
+    finally:
+        conn.close()
+
+def load_parquet_to_postgres(engine, source, table_name, dbschema, cur=None, unlogged=False):
+    """
+    Loads a Parquet extract into a PostgreSQL table. The table is created from
+    the Arrow schema of the file and the record batches are streamed in with
+    COPY, without a pandas round-trip or type inference. Empty strings are
+    loaded as NULL, as from the CSV extracts (see copy_csv_to_postgres).
+
+    Args:
+        engine: SQLAlchemy engine of the staging database.
+        source: Path or seekable binary file object of the Parquet file.
+        table_name (str): Name of the staging table.
+        dbschema (str): Schema of the staging table.
+        cur: Cursor to load on within the caller's transaction, by default the
+            file is loaded and committed on a new connection.
+        unlogged (bool): Create the table as UNLOGGED.
+
+    Returns:
+        int: The number of rows loaded.
+    """
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(source)
+    schema = parquet_file.schema_arrow
+    column_definitions = [(field.name.lower(), ARROW_POSTGRES_TYPES.get(str(field.type), "TEXT")) for field in schema]
+    columns = ", ".join(f'"{column}"' for column, _ in column_definitions)
+    # pyarrow quotes empty strings, FORCE_NULL loads them as NULL like the empty values of the CSV extracts
+    force_null = ", ".join(f'"{column}"' for column, column_type in column_definitions if column_type == "TEXT")
+    force_null_option = f", FORCE_NULL ({force_null})" if force_null else ""
+    copy_sql = f"COPY {dbschema}.{table_name} ({columns}) FROM STDIN WITH (FORMAT csv{force_null_option})"
+
+    row_count = 0
+    with staging_cursor(engine, cur) as cur:
+        create_staging_table(cur, dbschema, table_name, column_definitions, unlogged)
+        for batch in parquet_file.iter_batches():
+            buffer = io.BytesIO()
+            pacsv.write_csv(batch, buffer, pacsv.WriteOptions(include_header=False))
+            buffer.seek(0)
+            cur.copy_expert(copy_sql, buffer)
+            row_count += batch.num_rows
+    return row_count
+
+def create_staging_table(cur, dbschema, table_name, column_definitions, unlogged=False):
+    """
+    Creates a staging table with the given (name, type) columns, or adds the
+    columns it lacks if another extract already created it.
+    """
+    columns = ", ".join(f'"{name}" {column_type}' for name, column_type in column_definitions)
+    cur.execute(f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE IF NOT EXISTS {dbschema}.{table_name} ({columns})")
+    for name, column_type in column_definitions:
+        cur.execute(f'ALTER TABLE {dbschema}.{table_name} ADD COLUMN IF NOT EXISTS "{name}" {column_type}')
+
+def copy_csv_to_postgres(engine, source, table_name, dbschema, cur=None, unlogged=False):
+    """
+    Bulk loads a pipe delimited CSV extract into a PostgreSQL table with
+    COPY ... FROM STDIN. The table is created with the column types of the
+    schema registry and the file is streamed to the server as is, without
+    parsing it into a DataFrame. Empty values are loaded as NULL, quoted ("")
+    or not: the cursor extracts do not tell NULL from an empty string and COPY
+    exports quote empty strings, so both extraction paths load the same rows,
+    as on the other staging databases.
+
+    Args:
+        engine: SQLAlchemy engine of the staging database.
+        source: Binary file object of the CSV extract.
+        table_name (str): Name of the staging table.
+        dbschema (str): Schema of the staging table.
+        cur: Cursor to load on within the caller's transaction, by default the
+            file is loaded and committed on a new connection.
+        unlogged (bool): Create the table as UNLOGGED.
+
+    Returns:
+        int: The number of rows loaded.
+    """
+    # The header names the columns, COPY streams the rest of the file (hence no HEADER option)
+    header = source.readline().decode("utf-8").rstrip("\r\n")
+    column_definitions = schema_registry.postgres_column_definitions(table_name, next(csv.reader([header], delimiter="|")))
+    column_list = ", ".join(f'"{column}"' for column, _ in column_definitions)
+    force_null = ", ".join(f'"{column}"' for column, column_type in column_definitions if column_type == "TEXT")
+    force_null_option = f", FORCE_NULL ({force_null})" if force_null else ""
+    copy_sql = f"COPY {dbschema}.{table_name} ({column_list}) FROM STDIN WITH ({extract_archive.COPY_CSV_OPTIONS}, ENCODING 'UTF8'{force_null_option})"
+
+    with staging_cursor(engine, cur) as cur:
+        create_staging_table(cur, dbschema, table_name, column_definitions, unlogged)
+        cur.copy_expert(copy_sql, source, size=1024 * 1024)
+        row_count = cur.rowcount
+    return row_count
+
+def index_staging_table(cur, dbschema, table_name):
+    """
+    Creates the indexes of the schema registry on a loaded staging table and
+    refreshes its statistics with ANALYZE.
+
+    Returns:
+        tuple: (index seconds, analyze seconds)
+    """
+    start_time = time.perf_counter()
+    for index_name, columns in schema_registry.table_indexes(table_name):
+        column_list = ", ".join(f'"{column.lower()}"' for column in columns)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {dbschema}.{table_name} ({column_list})")
+    index_seconds = time.perf_counter() - start_time
+    cur.execute(f"ANALYZE {dbschema}.{table_name}")
+    return index_seconds, time.perf_counter() - start_time - index_seconds
+
+def index_staging_tables(engine, dbschema, table_names, parallelism=1):
+    """
+    Indexes and analyzes the loaded staging tables (see index_staging_table),
+    up to parallelism tables at a time, each on its own connection.
+
+    Args:
+        engine: SQLAlchemy engine of the staging database.
+        dbschema (str): Schema of the staging tables.
+        table_names (list): Loaded staging tables.
+        parallelism (int): Maximum number of tables indexed at the same time.
+
+    Returns:
+        dict: (index seconds, analyze seconds) by table name.
+    """
+    def index_table(table_name):
+        with staging_cursor(engine) as cur:
+            return index_staging_table(cur, dbschema, table_name)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        futures = {table_name: executor.submit(index_table, table_name) for table_name in table_names}
+        return {table_name: future.result() for table_name, future in futures.items()}
+
+def fast_load_extracts_to_postgres(engine, dbschema, extract_files, pkeys):
+    """
+    Loads the extracts in a single transaction with synchronous_commit off,
+    into UNLOGGED tables: the staging data can be rebuilt from the extract
+    archives, so it does not need to be WAL-logged. The registry indexes of
+    the tables are dropped during the load and rebuilt at the end. Every file
+    is loaded within a savepoint, so a file that fails to load does not abort
+    the load of the others and only the failed files are reported.
+
+    Args:
+        engine: SQLAlchemy engine of the staging database.
+        dbschema (str): Schema of the staging tables.
+        extract_files (list): (filename, opener) pairs, see list_extract_files and list_archive_members.
+        pkeys (list): Instances (PKEY) of the extracts, whose rows are replaced.
 
-def load_csv_to_postgres(csv_directory, postgres_connection_string, dbschema):
-    """Loads CSV files into the specified PostgreSQL database."""
+    Returns:
+        tuple: (rows, seconds) and (index seconds, analyze seconds) by table name.
+
+    Raises:
+        RuntimeError: If an extract failed to load, nothing is committed then.
+    """
+    table_names = sorted({filename.split("__")[1] for filename, _ in extract_files})
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL synchronous_commit = off")
+            cur.execute("""
+                SELECT c.relname, c.relpersistence
+                FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %s AND c.relkind = 'r'
+            """, (dbschema,))
+            persistence = dict(cur.fetchall())
+            for table_name in table_names:
+                if table_name not in persistence:
+                    continue
+                if persistence[table_name] == 'p':
+                    cur.execute(f"ALTER TABLE {dbschema}.{table_name} SET UNLOGGED")
+                for index_name, _ in schema_registry.table_indexes(table_name):
+                    cur.execute(f"DROP INDEX IF EXISTS {dbschema}.{index_name}")
+                if pkeys:
+                    cur.execute(f"DELETE FROM {dbschema}.{table_name} WHERE pkey = ANY(%s)", (pkeys,))
+                    print(f"Deleted {cur.rowcount} rows of {', '.join(pkeys)} from {dbschema}.{table_name}")
+            if pkeys:
+                # Stale rows of the reloaded instances in the registered tables without an extract in this load
+                for table_name in sorted(set(schema_registry.TABLE_SCHEMAS) & persistence.keys() - set(table_names)):
+                    cur.execute(f"DELETE FROM {dbschema}.{table_name} WHERE pkey = ANY(%s)", (pkeys,))
+                    print(f"Deleted {cur.rowcount} rows of {', '.join(pkeys)} from {dbschema}.{table_name}")
+
+            def load_file(filename, source_file, table_name):
+                cur.execute("SAVEPOINT fast_load_file")
+                try:
+                    if filename.endswith(".parquet"):
+                        rows = load_parquet_to_postgres(engine, source_file, table_name, dbschema, cur, unlogged=True)
+                    else:
+                        rows = copy_csv_to_postgres(engine, source_file, table_name, dbschema, cur, unlogged=True)
+                except Exception:
+                    cur.execute("ROLLBACK TO SAVEPOINT fast_load_file")
+                    raise
+                cur.execute("RELEASE SAVEPOINT fast_load_file")
+                return rows
+
+            failures = {}
+            table_stats = load_tables(extract_files, load_file, 1, failures)
+            if failures:
+                conn.rollback()
+                for filename, error in sorted(failures.items()):
+                    print(f"Failed to load {filename}: {error}")
+                raise RuntimeError(f"{len(failures)} of {len(extract_files)} extracts failed to load, the fast load was rolled back: {', '.join(sorted(failures))}")
+            index_stats = {table_name: index_staging_table(cur, dbschema, table_name) for table_name in sorted(table_stats)}
+        conn.commit()
+    finally:
+        conn.close()
+    return table_stats, index_stats
+
+def create_staging_engine(postgres_connection_string, dbschema, parallelism=1):
+    """
+    Creates the SQLAlchemy engine of the staging database, searching dbschema
+    first. Its pool keeps a connection for each of the parallelism workers.
+    """
+    from sqlalchemy import create_engine
     # dbschema='schema_compare' # Searches left-to-right
-    engine = create_engine(postgres_connection_string, connect_args={'options': '-csearch_path={}'.format(dbschema)})
-    # engine = create_engine(postgres_connection_string)
+    return create_engine(postgres_connection_string, pool_size=max(5, parallelism),
+                         connect_args={'options': '-csearch_path={}'.format(dbschema)})
+
+def load_extracts_to_postgres(engine, dbschema, extract_files, parallelism=1, full_reload=False, fast_load=False):
+    """
+    Creates the schema if needed and replaces the rows of the instances
+    (PKEY) of the given extracts. Other instances already staged are kept,
+    unless full_reload drops all tables of the schema first. The rows of a
+    table are deleted in the transaction that loads its extracts, so a table
+    that fails to load keeps its previous rows; the instances are deleted
+    from the registered tables that have no extract in the load.
+
+    Args:
+        engine: SQLAlchemy engine of the staging database.
+        dbschema (str): Schema of the staging tables.
+        extract_files (list): (filename, opener) pairs, see list_extract_files and list_archive_members.
+        parallelism (int): Maximum number of tables loaded at the same time, each on its own connection.
+        full_reload (bool): Drop all tables of the schema instead of replacing the instances of the extracts.
+        fast_load (bool): Load in a single transaction into UNLOGGED tables, see fast_load_extracts_to_postgres.
+
+    Returns:
+        dict: (rows, seconds) by table name.
+
+    Raises:
+        RuntimeError: If an extract failed to load, once the other extracts are loaded.
+    """
+    from sqlalchemy import bindparam, text
 
     # Base.metadata.create_all(engine)
 
+    extract_files = [(filename, open_file) for filename, open_file in extract_files
+                     if filename.endswith(".parquet") or (filename.endswith(".csv") and (not  ("defines" in filename or "eoj" in filename)))]
+    pkeys = list_extract_pkeys(extract_files)
+    loaded_tables = {filename.split("__")[1] for filename, _ in extract_files}
+
     # Create schema if it doesn't exist
     with engine.begin() as conn:
         conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {dbschema}"))
@@ -175,33 +725,266 @@ def load_csv_to_postgres(csv_directory, postgres_connection_string, dbschema):
         """))
         tables = [row[0] for row in result.fetchall()]
 
-        # Drop tables in a loop
-        for table in tables:
-            conn.execute(text(f"DROP TABLE IF EXISTS {dbschema}.{table}"))
-            print(f"Dropping already existing table in schema {dbschema}.{table}")
-        print(f"All tables in schema '{dbschema}' have been dropped.")
+        if full_reload:
+            # Drop tables in a loop
+            for table in tables:
+                conn.execute(text(f"DROP TABLE IF EXISTS {dbschema}.{table}"))
+                print(f"Dropping already existing table in schema {dbschema}.{table}")
+            print(f"All tables in schema '{dbschema}' have been dropped.")
+        elif pkeys and not fast_load:
+            # Stale rows of the reloaded instances in the registered tables without an extract in this
+            # load (e.g. sourcehash without --source_hash), the other tables are replaced as they are loaded
+            for table in sorted(set(schema_registry.TABLE_SCHEMAS) & set(tables) - loaded_tables):
+                delete_instances = text(f"DELETE FROM {dbschema}.{table} WHERE pkey IN :pkeys").bindparams(bindparam("pkeys", expanding=True))
+                result = conn.execute(delete_instances, {"pkeys": pkeys})
+                print(f"Deleted {result.rowcount} rows of {', '.join(pkeys)} from {dbschema}.{table}")
+        if not full_reload and not fast_load:
+            # Tables left UNLOGGED by a previous fast load are WAL-logged again, as the default load is crash safe
+            result = conn.execute(text("""
+                SELECT c.relname
+                FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = :dbschema AND c.relkind = 'r' AND c.relpersistence = 'u'
+            """), {"dbschema": dbschema})
+            unlogged_tables = [row[0] for row in result.fetchall()]
+            for table in sorted(loaded_tables & set(unlogged_tables)):
+                conn.execute(text(f"ALTER TABLE {dbschema}.{table} SET LOGGED"))
+                print(f"Restored WAL logging of {dbschema}.{table}")
 
+    @contextlib.contextmanager
+    def open_table(table_name):
+        # The rows of the reloaded instances are replaced in the transaction that loads the table,
+        # so a table that fails to load keeps its previous rows
+        with staging_cursor(engine) as cur:
+            if pkeys and not full_reload and table_name in tables:
+                cur.execute(f"DELETE FROM {dbschema}.{table_name} WHERE pkey = ANY(%s)", (pkeys,))
+                print(f"Deleted {cur.rowcount} rows of {', '.join(pkeys)} from {dbschema}.{table_name}")
+            yield cur
 
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    
+    def load_file(filename, source_file, table_name, cur):
+        if filename.endswith(".parquet"):
+            return load_parquet_to_postgres(engine, source_file, table_name, dbschema, cur)
+        return copy_csv_to_postgres(engine, source_file, table_name, dbschema, cur)
 
-    for filename in os.listdir(csv_directory):
-        if filename.endswith(".csv") and (not  ("defines" in filename or "eoj" in filename)):
-            file_path = os.path.join(csv_directory, filename)
-            table_name = filename.split("__")[1]
-            try:
-                # Attempt to read with comma delimiter first
-                df = pd.read_csv(file_path, sep='|')
-                # # Convert columns to lowercase
-                df.columns = df.columns.str.lower()
-                # print(df)
-
-                result = df.to_sql(table_name, engine, if_exists='append', index=False)
-                print(f"Rows loaded: {result}")
-                print(f"Loaded {filename} into PostgreSQL.")
-            except Exception as e:
-                print(e)
+    start_time = time.perf_counter()
+    if fast_load:
+        print("Fast load: UNLOGGED tables, single transaction, synchronous_commit off, indexes built at the end")
+        table_stats, index_stats = fast_load_extracts_to_postgres(engine, dbschema, extract_files, pkeys)
+        index_seconds = sum(sum(times) for times in index_stats.values())
+        print_load_summary(table_stats, time.perf_counter() - start_time - index_seconds)
+    else:
+        failures = {}
+        table_stats = load_tables(extract_files, load_file, parallelism, failures, open_table)
+        print_load_summary(table_stats, time.perf_counter() - start_time)
+        if failures:
+            for filename, error in sorted(failures.items()):
+                print(f"Failed to load {filename}: {error}")
+            raise RuntimeError(f"{len(failures)} of {len(extract_files)} extracts failed to load into PostgreSQL: {', '.join(sorted(failures))}")
+
+        # Index the join keys of the report queries and refresh the planner statistics
+        start_time = time.perf_counter()
+        index_stats = index_staging_tables(engine, dbschema, sorted(table_stats), parallelism)
+        index_seconds = time.perf_counter() - start_time
+    print(f"Indexed and analyzed {len(index_stats)} tables in {index_seconds:.2f}s:")
+    for table_name, (index_seconds, analyze_seconds) in sorted(index_stats.items()):
+        print(f"  {table_name:<20} indexes {index_seconds:8.2f}s analyze {analyze_seconds:8.2f}s")
+
+    # Record the loaded instances, the reporter compares the latest two by default
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {dbschema}.{schema_registry.LOAD_HISTORY_TABLE} (pkey TEXT, loaded_at TIMESTAMPTZ)"))
+        for pkey in pkeys:
+            conn.execute(text(f"INSERT INTO {dbschema}.{schema_registry.LOAD_HISTORY_TABLE} (pkey, loaded_at) VALUES (:pkey, now())"), {"pkey": pkey})
+    return table_stats
+
+def load_csv_to_postgres(csv_directory, postgres_connection_string, dbschema, parallelism=1, zip_directory=None, full_reload=False, fast_load=False):
+    """Loads CSV files into the specified PostgreSQL database, the archives of zip_directory are read in place."""
+    engine = create_staging_engine(postgres_connection_string, dbschema, parallelism)
+    extract_files = list_directory_extracts(zip_directory, csv_directory) if zip_directory else list_extract_files(csv_directory)
+    load_extracts_to_postgres(engine, dbschema, extract_files, parallelism, full_reload, fast_load)
+
+def connect_embedded_staging(db_type, database_path, dbschema):
+    """
+    Opens a local embedded staging database in autocommit mode. The staging
+    tables are in dbschema, a DuckDB schema or the name the SQLite database
+    file is attached as, so that the report queries address them as
+    <dbschema>.<table> on every staging database.
+
+    Args:
+        db_type (str): Either "duckdb" or "sqlite".
+        database_path (str): Database file, created if it does not exist.
+        dbschema (str): Schema of the staging tables.
+
+    Returns:
+        A DB-API connection.
+    """
+    if db_type == "duckdb":
+        import duckdb
+        conn = duckdb.connect(database_path)
+        conn.execute(f"CREATE SCHEMA IF NOT EXISTS {dbschema}")
+        return conn
+    import sqlite3
+    conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+    conn.execute(f"ATTACH DATABASE ? AS {dbschema}", (database_path,))
+    return conn
+
+def list_embedded_tables(conn, db_type, dbschema):
+    """Returns the tables of the schema of an embedded staging database."""
+    if db_type == "duckdb":
+        rows = conn.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = ?", [dbschema]).fetchall()
+    else:
+        rows = conn.execute(f"SELECT name FROM {dbschema}.sqlite_master WHERE type = 'table'").fetchall()
+    return [row[0] for row in rows]
+
+def create_embedded_table(conn, db_type, dbschema, table_name, column_definitions):
+    """
+    Creates a table of an embedded staging database with the given (name, type)
+    columns, or adds the columns it lacks if another extract already created it.
+    """
+    columns = ", ".join(f'"{name}" {column_type}' for name, column_type in column_definitions)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {dbschema}.{table_name} ({columns})")
+    if db_type == "duckdb":
+        for name, column_type in column_definitions:
+            conn.execute(f'ALTER TABLE {dbschema}.{table_name} ADD COLUMN IF NOT EXISTS "{name}" {column_type}')
+        return
+    existing_columns = {row[1] for row in conn.execute(f"PRAGMA {dbschema}.table_info({table_name})").fetchall()}
+    for name, column_type in column_definitions:
+        if name not in existing_columns:
+            conn.execute(f'ALTER TABLE {dbschema}.{table_name} ADD COLUMN "{name}" {column_type}')
+
+@contextlib.contextmanager
+def extract_file_path(filename, source_file):
+    """
+    Yields a path DuckDB can read an extract from: the file itself if it is on
+    disk, else a temporary copy of the archive member, removed afterwards.
+    """
+    if isinstance(source_file, io.BufferedReader) and not isinstance(source_file, ArchiveMemberFile):
+        yield source_file.name
+        return
+    import tempfile
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1], delete=False) as spool_file:
+        shutil.copyfileobj(source_file, spool_file, 1024 * 1024)
+    try:
+        yield spool_file.name
+    finally:
+        os.remove(spool_file.name)
+
+def load_extract_to_duckdb(conn, filename, source_file, table_name, dbschema):
+    """
+    Loads a CSV or Parquet extract into a DuckDB staging table with DuckDB's
+    own readers. The table is created with the column types of the schema
+    registry, the Parquet types for the columns that are not registered.
+
+    Returns:
+        int: The number of rows loaded.
+    """
+    with extract_file_path(filename, source_file) as path:
+        if filename.endswith(".parquet"):
+            reader = "read_parquet(?)"
+        else:
+            reader = "read_csv(?, header = true, delim = '|', quote = '\"', all_varchar = true)"
+        described = conn.execute(f"DESCRIBE SELECT * FROM {reader}", [path]).fetchall()
+        registered = schema_registry.columns_by_name(table_name)
+        create_embedded_table(conn, "duckdb", dbschema, table_name,
+                              [(name.lower(), schema_registry.DUCKDB_TYPES[registered[name.lower()].type] if name.lower() in registered else column_type)
+                               for name, column_type, *_ in described])
+        return conn.execute(f"INSERT INTO {dbschema}.{table_name} BY NAME SELECT * FROM {reader}", [path]).fetchone()[0]
+
+def load_extract_to_sqlite(conn, filename, source_file, table_name, dbschema):
+    """
+    Loads a CSV or Parquet extract into a SQLite staging table, inserting its
+    rows in batches. Empty CSV values are loaded as NULL, as COPY does.
+
+    Returns:
+        int: The number of rows loaded.
+    """
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(source_file)
+        column_names = parquet_file.schema_arrow.names
+        batches = ([column.to_pylist() for column in batch.columns] for batch in parquet_file.iter_batches())
+        rows = (row for columns in batches for row in zip(*columns))
+    else:
+        reader = csv.reader(io.TextIOWrapper(source_file, encoding="utf-8", newline=""), delimiter="|")
+        column_names = next(reader)
+        rows = ([value if value != "" else None for value in row] for row in reader)
+    column_definitions = schema_registry.column_definitions(table_name, column_names, schema_registry.SQLITE_TYPES)
+    create_embedded_table(conn, "sqlite", dbschema, table_name, column_definitions)
+    column_list = ", ".join(f'"{name}"' for name, _ in column_definitions)
+    insert_sql = f"INSERT INTO {dbschema}.{table_name} ({column_list}) VALUES ({', '.join('?' * len(column_definitions))})"
+    return conn.executemany(insert_sql, rows).rowcount
+
+def load_extracts_to_embedded(conn, db_type, dbschema, extract_files, full_reload=False):
+    """
+    Loads the extracts into a local embedded staging database (DuckDB or
+    SQLite) in a single transaction, replacing the rows of their instances
+    (PKEY) like load_extracts_to_postgres. The SQLite tables get the registry
+    indexes, DuckDB joins the staging tables without indexes.
+
+    Args:
+        conn: Connection returned by connect_embedded_staging.
+        db_type (str): Either "duckdb" or "sqlite".
+        dbschema (str): Schema of the staging tables.
+        extract_files (list): (filename, opener) pairs, see list_extract_files and list_archive_members.
+        full_reload (bool): Drop all tables of the schema instead of replacing the instances of the extracts.
+
+    Returns:
+        dict: (rows, seconds) by table name.
+
+    Raises:
+        RuntimeError: If an extract failed to load, nothing is committed then.
+    """
+    extract_files = [(filename, open_file) for filename, open_file in extract_files
+                     if filename.endswith(".parquet") or (filename.endswith(".csv") and (not  ("defines" in filename or "eoj" in filename)))]
+    pkeys = list_extract_pkeys(extract_files)
+    load_extract = load_extract_to_duckdb if db_type == "duckdb" else load_extract_to_sqlite
+
+    start_time = time.perf_counter()
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        tables = list_embedded_tables(conn, db_type, dbschema)
+        if full_reload:
+            for table in tables:
+                conn.execute(f"DROP TABLE IF EXISTS {dbschema}.{table}")
+            print(f"All tables in schema '{dbschema}' have been dropped.")
+        elif pkeys:
+            # Replace only the instances of the new extracts
+            for table in sorted({filename.split("__")[1] for filename, _ in extract_files} & set(tables)):
+                deleted = conn.execute(f"DELETE FROM {dbschema}.{table} WHERE pkey IN ({', '.join('?' * len(pkeys))})", pkeys)
+                print(f"Deleted {deleted.fetchone()[0] if db_type == 'duckdb' else deleted.rowcount} rows of {', '.join(pkeys)} from {dbschema}.{table}")
+
+        # A single connection loads the tables one at a time, DuckDB parallelises each load itself
+        failures = {}
+        table_stats = load_tables(extract_files, lambda filename, source_file, table_name: load_extract(conn, filename, source_file, table_name, dbschema), 1, failures)
+        if failures:
+            raise RuntimeError(f"{len(failures)} of {len(extract_files)} extracts failed to load, the load was rolled back: {', '.join(sorted(failures))}")
+
+        if db_type == "sqlite":
+            for table_name in sorted(table_stats):
+                for index_name, columns in schema_registry.table_indexes(table_name):
+                    column_list = ", ".join(f'"{column.lower()}"' for column in columns)
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {dbschema}.{index_name} ON {table_name} ({column_list})")
+            conn.execute(f"ANALYZE {dbschema}")
+
+        # Record the loaded instances, the reporter compares the latest two by default
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {dbschema}.{schema_registry.LOAD_HISTORY_TABLE} (pkey TEXT, loaded_at TIMESTAMP)")
+        loaded_at = datetime.datetime.now().isoformat(sep=" ")
+        for pkey in pkeys:
+            conn.execute(f"INSERT INTO {dbschema}.{schema_registry.LOAD_HISTORY_TABLE} (pkey, loaded_at) VALUES (?, ?)", [pkey, loaded_at])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    print_load_summary(table_stats, time.perf_counter() - start_time)
+    return table_stats
+
+def load_csv_to_embedded(csv_directory, db_type, database_path, dbschema, zip_directory=None, full_reload=False):
+    """Loads the extracts into a local DuckDB or SQLite staging database, the archives of zip_directory are read in place."""
+    conn = connect_embedded_staging(db_type, database_path, dbschema)
+    try:
+        extract_files = list_directory_extracts(zip_directory, csv_directory) if zip_directory else list_extract_files(csv_directory)
+        load_extracts_to_embedded(conn, db_type, dbschema, extract_files, full_reload)
+    finally:
+        conn.close()
+    print(f"Staging database: {database_path}")
 
 def delete_files_in_directory(directory):
     """Deletes all files in the specified directory."""
@@ -231,30 +1014,52 @@ def delete_files_in_directory(directory):
             print(f"Error moving or deleting file {filename}: {e}")
 
 def main():
-    parser = argparse.ArgumentParser(description="Load CSV files into BigQuery or PostgreSQL tables.")
+    parser = argparse.ArgumentParser(description="Load CSV files into BigQuery or PostgreSQL tables, or a local DuckDB or SQLite database.")
     parser.add_argument("--project_id", help="Your Google Cloud Project ID (for BigQuery). Use this if the staging area is BigQuery.")
     parser.add_argument("--dataset_id", help="The BigQuery dataset name. Use this if the staging area is BigQuery.")
-    parser.add_argument("--csv_directory", default="extracts", help="Directory containing CSV files.")
-    parser.add_argument("--zip_directory", default="extracts", help="Directory containing ZIP files.")
+    parser.add_argument("--csv_directory", default="extracts", help="Directory containing CSV files that are not in a ZIP file.")
+    parser.add_argument("--zip_directory", default="extracts", help="Directory containing ZIP files, loaded without unzipping them.")
     parser.add_argument("--location", default="US", help="Geographic location for the dataset (default: US). Use this if the staging area is BigQuery.")
     parser.add_argument("--postgres_connection_string", help="Connection string for your PostgreSQL database. Use this if the staging area is a postgres db. format: 'postgresql://username:pwd@ip_address/db_name'.")
-    parser.add_argument("--schema", default="schema_compare",help="Schema for your PostgreSQL database. Use this if the staging area is a postgres db.")
+    parser.add_argument("--schema", default="schema_compare",help="Schema for your PostgreSQL database. Use this if the staging area is a postgres db, or an embedded database.")
+    parser.add_argument("--parallelism", default=1, type=int, help="Number of tables loaded at the same time, as concurrent BigQuery load jobs or one PostgreSQL connection per table (default: 1)")
+    parser.add_argument("--fast_load", action="store_true", help="Load the PostgreSQL staging tables as UNLOGGED tables in a single transaction with synchronous_commit off, building the indexes at the end")
+    parser.add_argument("--full_reload", action="store_true", help="Drop the staging tables before loading instead of replacing only the instances (PKEY) of the new extracts")
+    parser.add_argument("--db_type", choices=sorted(EMBEDDED_DATABASE_PATHS), help="Load into a local embedded staging database instead of BigQuery or PostgreSQL, no staging server needed.")
+    parser.add_argument("--database_path", help=f"File of the embedded staging database (default: {', '.join(f'{path} for {db_type}' for db_type, path in EMBEDDED_DATABASE_PATHS.items())}).")
     
     args = parser.parse_args()
     # postgres_connection_string = resolve_password(args.postgres_connection_string)
 
      # Resolve the PostgreSQL connection string, replacing the password with the GCP secret if needed
-    postgres_connection_string = resolve_postgres_connection_string(args.postgres_connection_string)
-
-    unzip_all_files(args.zip_directory)
+    postgres_connection_string = resolve_postgres_connection_string(args.postgres_connection_string) if args.postgres_connection_string else None
 
+    # The archive members are streamed into the staging area, nothing is unzipped to disk
     if args.project_id and args.dataset_id:
-        load_csv_to_bigquery(args.project_id, args.dataset_id, args.csv_directory, args.location)
+        try:
+            load_csv_to_bigquery(args.project_id, args.dataset_id, args.csv_directory, args.location, args.parallelism, args.zip_directory, args.full_reload)
+        except RuntimeError as e:
+            # Keep the extracts for a retry
+            print(e)
+            return 1
+
+    if args.db_type in EMBEDDED_DATABASE_PATHS:
+        try:
+            load_csv_to_embedded(args.csv_directory, args.db_type, args.database_path or EMBEDDED_DATABASE_PATHS[args.db_type], args.schema, args.zip_directory, args.full_reload)
+        except RuntimeError as e:
+            # Keep the extracts for a retry
+            print(e)
+            return 1
 
     if args.postgres_connection_string:
-        load_csv_to_postgres(args.csv_directory, postgres_connection_string, args.schema)
+        try:
+            load_csv_to_postgres(args.csv_directory, postgres_connection_string, args.schema, args.parallelism, args.zip_directory, args.full_reload, args.fast_load)
+        except RuntimeError as e:
+            # Keep the extracts for a retry
+            print(e)
+            return 1
 
-    # Delete files after successful import
+    # Archive the zip files and delete the loose extracts after successful import
     delete_files_in_directory(args.csv_directory)
 
 if __name__ == "__main__":
@@ -0,0 +1,315 @@
+# Copyright 2024 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Extract archives written by the collectors: every query result is streamed
+into a member of a zip archive "<prefix>.zip" (or "<prefix>__<query>.zip"
+when the queries are extracted concurrently), compressed with one of
+COMPRESSION_METHODS. Members are pipe delimited CSV or, with the parquet
+extract format, Parquet files typed by the schema registry.
+
+Incremental extractions keep a snapshot of the previous archives and of the
+object manifest they were extracted from, and merge its unchanged rows with
+the re-extracted ones.
+
+Shared by the Oracle and Postgres collectors, which only differ in how they
+run the queries.
+"""
+
+import bz2
+import csv
+import io
+import json
+import lzma
+import os
+import shutil
+import time
+import zipfile
+import zlib
+
+from importer import schema_registry
+
+# Compression methods for the archive members (zstd needs Python 3.14+ zipfile support)
+COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'xz': zipfile.ZIP_LZMA,
+}
+if hasattr(zipfile, 'ZIP_ZSTANDARD'):
+    COMPRESSION_METHODS['zstd'] = zipfile.ZIP_ZSTANDARD
+
+# COPY options of the pipe delimited CSV extracts, shared by the COPY export
+# of pgcollector and the COPY load of the importer's Postgres staging area
+COPY_CSV_OPTIONS = "FORMAT csv, DELIMITER '|'"
+
+# Extract file formats and the compression of the Parquet column chunks
+EXTRACT_FORMATS = ['csv', 'parquet']
+PARQUET_COMPRESSION = 'zstd'
+
+# Range of the INT64 Parquet columns, and the number of decimal digits that always fit in it
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
+INT64_DIGITS = 18
+
+
+class ExtractionCancelled(Exception):
+    """Raised by a collector that stopped between two queries because its stop event was set."""
+
+
+def check_stop(stop_event):
+    """Raises ExtractionCancelled if the stop event of an extraction is set, e.g. because a sibling collector failed."""
+    if stop_event is not None and stop_event.is_set():
+        raise ExtractionCancelled("Extraction cancelled")
+
+
+def open_archive(zip_file, compression='deflate', compression_level=None):
+    """Opens a new extract archive whose members are compressed with the given method."""
+    return zipfile.ZipFile(zip_file, 'w', compression=COMPRESSION_METHODS[compression], compresslevel=compression_level)
+
+def open_archive_member(z, member_name):
+    """Opens a text stream that compresses everything written to it into a new member of the archive z."""
+    return io.TextIOWrapper(z.open(member_name, 'w', force_zip64=True), encoding='utf-8', newline='')
+
+def open_parquet_member(z, member_name):
+    """Opens a binary stream for a new Parquet member of the archive z. Parquet compresses its own pages, so the member is stored as is."""
+    zinfo = zipfile.ZipInfo(member_name, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = zipfile.ZIP_STORED
+    return z.open(zinfo, 'w', force_zip64=True)
+
+def get_codec_compressors():
+    """Returns a compressor factory for every codec available in this Python environment."""
+    compressors = {
+        'deflate': lambda: zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15),
+        'bzip2': bz2.BZ2Compressor,
+        'xz': lzma.LZMACompressor,
+    }
+    try:
+        from compression import zstd  # Python 3.14+
+        compressors['zstd'] = zstd.ZstdCompressor
+    except ImportError:
+        try:
+            import zstandard
+            compressors['zstd'] = lambda: zstandard.ZstdCompressor().compressobj()
+        except ImportError:
+            pass
+    return compressors
+
+def archive_size(zip_file):
+    """Returns the size of an archive given as a path or a binary file object."""
+    if isinstance(zip_file, str):
+        return os.path.getsize(zip_file)
+    return zip_file.seek(0, io.SEEK_END)
+
+def report_archive_sizes(zip_files, compression, cpu_seconds):
+    """Prints the compressed and uncompressed size of the extract archives."""
+    compressed_size = sum(archive_size(zip_file) for zip_file in zip_files)
+    uncompressed_size = 0
+    for zip_file in zip_files:
+        with zipfile.ZipFile(zip_file) as z:
+            uncompressed_size += sum(info.file_size for info in z.infolist())
+    ratio = compressed_size / uncompressed_size if uncompressed_size else 1
+    print(f"Archive size with {compression}: {compressed_size} bytes for {uncompressed_size} bytes of data ({ratio:.1%}), "
+          f"{cpu_seconds:.2f}s CPU for extraction and compression")
+
+def report_compression_costs(zip_files, chunk_size=1024 * 1024):
+    """
+    Recompresses the members of the extract archives with every available codec
+    and prints the resulting size and the CPU time spent by each codec, to help
+    choosing a --compression method for slow links.
+    """
+    compressors = get_codec_compressors()
+    sizes = dict.fromkeys(compressors, 0)
+    cpu_seconds = dict.fromkeys(compressors, 0.0)
+    uncompressed_size = 0
+    for zip_file in zip_files:
+        with zipfile.ZipFile(zip_file) as z:
+            for info in z.infolist():
+                active = {codec: factory() for codec, factory in compressors.items()}
+                with z.open(info) as member:
+                    for chunk in iter(lambda: member.read(chunk_size), b''):
+                        uncompressed_size += len(chunk)
+                        for codec, compressor in active.items():
+                            start_time = time.process_time()
+                            sizes[codec] += len(compressor.compress(chunk))
+                            cpu_seconds[codec] += time.process_time() - start_time
+                for codec, compressor in active.items():
+                    start_time = time.process_time()
+                    sizes[codec] += len(compressor.flush())
+                    cpu_seconds[codec] += time.process_time() - start_time
+    print(f"Compression codecs for {uncompressed_size} bytes of extracted data:")
+    for codec in compressors:
+        ratio = sizes[codec] / uncompressed_size if uncompressed_size else 1
+        print(f"  {codec}: {sizes[codec]} bytes ({ratio:.1%}), {cpu_seconds[codec]:.2f}s CPU")
+
+
+def rows_to_record_batch(rows, schema):
+    """
+    Converts a batch of row tuples into an Arrow record batch with the given
+    schema. Values of string columns are converted to strings, integers out of
+    the int64 range raise a ValueError naming the column instead of an Arrow
+    overflow error.
+    """
+    import pyarrow as pa
+    arrays = []
+    for column, field in zip(zip(*rows), schema):
+        if pa.types.is_floating(field.type):
+            column = [None if value is None else float(value) for value in column]
+        elif pa.types.is_integer(field.type):
+            column = [None if value is None else int(value) for value in column]
+            for value in column:
+                if value is not None and not INT64_MIN <= value <= INT64_MAX:
+                    raise ValueError(f"Value {value} of column {field.name} does not fit in a 64-bit integer, "
+                                     "extract with --extract_format csv.")
+        elif pa.types.is_string(field.type):
+            column = [value if value is None or isinstance(value, str) else str(value) for value in column]
+        arrays.append(pa.array(column, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def parquet_schema(description, description_schema, query_name=None):
+    """
+    Returns the Arrow schema of an extract and the columns to dictionary
+    encode. Tables of the schema registry get its column types, so the
+    extracts of every database have the same schema; other queries keep the
+    types of the cursor description.
+
+    Args:
+        description: Description of the cursor the extract is read from.
+        description_schema: Builds the Arrow schema of a cursor description
+            from the column types of the collector's database.
+        query_name: Name of the extraction query, to look its table up in the schema registry.
+    """
+    columns = None
+    if query_name:
+        columns = schema_registry.header_columns(schema_registry.table_name(query_name), [desc[0] for desc in description])
+    if columns is None:
+        return description_schema(description), True
+    return schema_registry.arrow_schema(columns), schema_registry.dictionary_columns(columns)
+
+def write_cursor_to_parquet(cur, stream, batch_size, description_schema, query_name=None):
+    """
+    Streams the rows of an executed cursor to a Parquet stream, one row group
+    per batch of batch_size rows, with the schema of the schema registry or
+    of the cursor description instead of one inferred from the data.
+
+    Args:
+        cur: A (server side) cursor on which a query has been executed.
+        stream: Binary stream the Parquet data is written to.
+        batch_size: Number of rows fetched per round trip.
+        description_schema: Builds the Arrow schema of the cursor description, see parquet_schema.
+        query_name: Name of the extraction query, to look its table up in the schema registry.
+
+    Returns:
+        int: The number of data rows written.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("The parquet extract format requires pyarrow (pip install pyarrow).")
+    # Server side cursors only expose their description after the first fetch
+    rows = cur.fetchmany(batch_size)
+    schema, use_dictionary = parquet_schema(cur.description, description_schema, query_name)
+    row_count = 0
+    with pq.ParquetWriter(stream, schema, compression=PARQUET_COMPRESSION, use_dictionary=use_dictionary) as writer:
+        while rows:
+            writer.write_batch(rows_to_record_batch(rows, schema))
+            row_count += len(rows)
+            rows = cur.fetchmany(batch_size)
+    return row_count
+
+
+def load_snapshot(snapshot_dir, fingerprint):
+    """Returns the object manifest of the previous extraction, or None when there is no usable snapshot."""
+    manifest_file = os.path.join(snapshot_dir, 'manifest.json')
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file, 'r') as f:
+        snapshot = json.load(f)
+    if snapshot.get('fingerprint') != fingerprint:
+        print("Snapshot was taken with different settings, running a full extraction.")
+        return None
+    return {(owner, object_name): signature for owner, object_name, signature in snapshot['objects']}
+
+def save_snapshot(snapshot_dir, fingerprint, manifest, archives):
+    """
+    Keeps a copy of the extract archives and their object manifest for the
+    next incremental run. archives maps the archive paths to the paths or
+    file objects the archives were written to.
+    """
+    if os.path.isdir(snapshot_dir):
+        shutil.rmtree(snapshot_dir)
+    os.makedirs(snapshot_dir)
+    for zip_path, zip_file in archives.items():
+        if isinstance(zip_file, str):
+            shutil.copy2(zip_file, snapshot_dir)
+        else:
+            zip_file.seek(0)
+            with open(os.path.join(snapshot_dir, os.path.basename(zip_path)), 'wb') as f:
+                shutil.copyfileobj(zip_file, f)
+    with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as f:
+        json.dump({'fingerprint': fingerprint,
+                   'objects': [[owner, object_name, signature] for (owner, object_name), signature in manifest.items()]}, f)
+
+def read_unchanged_rows(snapshot_dir, member_name, key_column, stale_keys):
+    """
+    Yields the header of a member of the snapshot archives, followed by its
+    rows whose (OWNER, key_column) object is not in stale_keys. Owners are
+    compared in upper case, as the extracts hold UPPER(owner) while the
+    manifest keeps the owner as it is in the catalog.
+    """
+    stale_keys = {(owner.upper(), object_name) for owner, object_name in stale_keys}
+    for filename in sorted(os.listdir(snapshot_dir)):
+        if not filename.endswith('.zip'):
+            continue
+        with zipfile.ZipFile(os.path.join(snapshot_dir, filename)) as z:
+            if member_name not in z.namelist():
+                continue
+            with io.TextIOWrapper(z.open(member_name), encoding='utf-8', newline='') as csvfile:
+                reader = csv.reader(csvfile, delimiter='|')
+                header = next(reader)
+                yield header
+                columns = [column.upper() for column in header]
+                owner_index, key_index = columns.index('OWNER'), columns.index(key_column.upper())
+                for row in reader:
+                    if (row[owner_index], row[key_index]) not in stale_keys:
+                        yield row
+            return
+    raise FileNotFoundError(f"{member_name} not found in snapshot {snapshot_dir}")
+
+def write_merged_csv(cur, csvfile, batch_size, header, unchanged_rows, lineterminator='\r\n'):
+    """
+    Writes the unchanged rows of the previous extract followed by the rows
+    re-extracted by the cursor (cur is None when no object changed). The rows
+    are not sorted again, so they do not follow the ORDER BY of the query.
+
+    Args:
+        lineterminator: Line ending of the collector's CSV extracts.
+
+    Returns:
+        int: The number of data rows written.
+    """
+    # Server side cursors only expose their description after the first fetch
+    rows = cur.fetchmany(batch_size) if cur is not None else []
+    if cur is not None and [desc[0].upper() for desc in cur.description] != [column.upper() for column in header]:
+        raise ValueError("Query columns differ from the snapshot, run without --incremental to rebuild it.")
+    writer = csv.writer(csvfile, delimiter='|', lineterminator=lineterminator)
+    writer.writerow(header)
+    row_count = 0
+    for row in unchanged_rows:
+        writer.writerow(row)
+        row_count += 1
+    while rows:
+        writer.writerows(rows)
+        row_count += len(rows)
+        rows = cur.fetchmany(batch_size)
+    return row_count
@@ -0,0 +1,203 @@
+# Copyright 2024 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Schema registry of the extract tables: the column names and types of every
+table the collectors extract, declared once and shared by the collectors
+(Parquet schemas), the importer (staging table creation and typed loads) and
+the reporter (staging schema checks).
+
+Extract files are named "<prefix>__<table>__data.<ext>"; the registry is keyed
+by <table>. Tables that are not registered keep the previous behaviour of
+each component (cursor types, autodetection, TEXT columns).
+"""
+
+import collections
+
+STRING = "STRING"
+INT64 = "INT64"
+
+# A column of an extract table. dictionary marks low cardinality columns
+# (instance keys, owners, object types...) that are dictionary encoded in
+# Parquet extracts.
+Column = collections.namedtuple("Column", ["name", "type", "dictionary"])
+
+PKEY = Column("PKEY", STRING, True)
+CON_ID = Column("CON_ID", INT64, True)
+OWNER = Column("OWNER", STRING, True)
+DMA_SOURCE_ID = Column("DMA_SOURCE_ID", STRING, True)
+DMA_MANUAL_ID = Column("DMA_MANUAL_ID", STRING, True)
+
+TABLE_SCHEMAS = {
+    "columns": [
+        PKEY, CON_ID, OWNER,
+        Column("TABLE_NAME", STRING, False),
+        Column("COLUMN_NAME", STRING, False),
+        Column("DATA_TYPE", STRING, True),
+        Column("DATA_LENGTH", INT64, False),
+        Column("DATA_PRECISION", INT64, False),
+        Column("DATA_SCALE", INT64, False),
+        Column("NULLABLE", STRING, True),
+        DMA_SOURCE_ID, DMA_MANUAL_ID,
+    ],
+    "instances": [PKEY, CON_ID],
+    "views": [
+        PKEY, CON_ID, OWNER,
+        Column("VIEW_NAME", STRING, False),
+        DMA_SOURCE_ID, DMA_MANUAL_ID,
+    ],
+    "dbobjectnames": [
+        PKEY, CON_ID, OWNER,
+        Column("OBJECT_NAME", STRING, False),
+        Column("OBJECT_TYPE", STRING, True),
+        DMA_SOURCE_ID, DMA_MANUAL_ID,
+    ],
+    "sourcecodedetailed": [
+        PKEY, CON_ID, OWNER,
+        Column("NAME", STRING, False),
+        Column("TYPE", STRING, True),
+        Column("NR_LINES", INT64, False),
+        DMA_SOURCE_ID, DMA_MANUAL_ID,
+    ],
+    "sourcehash": [
+        PKEY, CON_ID, OWNER,
+        Column("NAME", STRING, False),
+        Column("TYPE", STRING, True),
+        Column("SOURCE_HASH", STRING, False),
+        DMA_SOURCE_ID, DMA_MANUAL_ID,
+    ],
+    "triggers": [
+        PKEY, CON_ID, OWNER,
+        Column("TRIGGER_NAME", STRING, False),
+        Column("TABLE_NAME", STRING, False),
+        Column("STATUS", STRING, True),
+        DMA_SOURCE_ID, DMA_MANUAL_ID,
+    ],
+}
+
+# Staging table recording the load time of every instance (PKEY), the reporter
+# compares the latest two loaded instances by default
+LOAD_HISTORY_TABLE = "load_history"
+
+# Composite indexes of the PostgreSQL and SQLite staging tables, matching the
+# instance and object keys the report queries join and anti-join on
+TABLE_INDEXES = {
+    "columns": [("PKEY", "OWNER", "TABLE_NAME", "COLUMN_NAME")],
+    "views": [("PKEY", "OWNER", "VIEW_NAME")],
+    "dbobjectnames": [("PKEY", "OWNER", "OBJECT_NAME", "OBJECT_TYPE")],
+    "sourcecodedetailed": [("PKEY", "OWNER", "NAME", "TYPE")],
+    "sourcehash": [("PKEY", "OWNER", "NAME", "TYPE")],
+    "triggers": [("PKEY", "OWNER", "TRIGGER_NAME")],
+}
+
+# Column types of the registry in each staging database, and the types the
+# databases report back for them in information_schema
+POSTGRES_TYPES = {STRING: "TEXT", INT64: "BIGINT"}
+POSTGRES_INFORMATION_SCHEMA_TYPES = {STRING: "text", INT64: "bigint"}
+BIGQUERY_TYPES = {STRING: "STRING", INT64: "INT64"}
+# The embedded staging databases report the declared types back
+DUCKDB_TYPES = {STRING: "VARCHAR", INT64: "BIGINT"}
+SQLITE_TYPES = {STRING: "TEXT", INT64: "INTEGER"}
+
+
+def table_name(extract_name):
+    """Returns the table of an extract file or query name, e.g. "orcl__columns__data.csv" -> "columns"."""
+    parts = extract_name.split("__")
+    return parts[1] if len(parts) > 1 else extract_name
+
+
+def table_columns(table):
+    """
+    Returns the registered columns of a table.
+
+    Args:
+        table (str): Table name, e.g. "columns".
+
+    Returns:
+        list: Column tuples, None if the table is not registered.
+    """
+    return TABLE_SCHEMAS.get(table.lower())
+
+
+def columns_by_name(table):
+    """Returns the registered columns of a table by lowercase name, empty if the table is not registered."""
+    return {column.name.lower(): column for column in TABLE_SCHEMAS.get(table.lower(), [])}
+
+
+def header_columns(table, column_names):
+    """
+    Returns the registered columns of a table in the order of column_names
+    (e.g. an extract header), matched case-insensitively.
+
+    Returns:
+        list: Column tuples, None if the table is not registered or a name is not one of its columns.
+    """
+    columns = columns_by_name(table)
+    if not columns or any(name.lower() not in columns for name in column_names):
+        return None
+    return [columns[name.lower()] for name in column_names]
+
+
+def table_indexes(table):
+    """
+    Returns the indexes of a staging table.
+
+    Returns:
+        list: (index name, column names) tuples, empty if the table has no registered index.
+    """
+    return [(f"{table.lower()}_{'_'.join(columns).lower()}_idx", list(columns))
+            for columns in TABLE_INDEXES.get(table.lower(), [])]
+
+
+def column_definitions(table, column_names, types, default_type="TEXT"):
+    """
+    Returns the (lowercase name, type) definitions of the columns of an
+    extract in a staging database, default_type for the columns that are not
+    registered.
+
+    Args:
+        table (str): Table name, e.g. "columns".
+        column_names (list): Column names of the extract, e.g. its header.
+        types (dict): Staging database type of each registry type, e.g. POSTGRES_TYPES.
+        default_type (str): Type of the columns that are not registered.
+    """
+    columns = columns_by_name(table)
+    return [(name.lower(), types[columns[name.lower()].type] if name.lower() in columns else default_type)
+            for name in column_names]
+
+
+def postgres_column_definitions(table, column_names):
+    """
+    Returns the (lowercase name, PostgreSQL type) definitions of the columns of
+    an extract, TEXT for the columns that are not registered.
+    """
+    return column_definitions(table, column_names, POSTGRES_TYPES)
+
+
+def bigquery_schema(columns):
+    """Returns the BigQuery load schema of registered columns."""
+    from google.cloud import bigquery
+    return [bigquery.SchemaField(column.name, BIGQUERY_TYPES[column.type]) for column in columns]
+
+
+def arrow_schema(columns):
+    """Returns the Arrow schema of registered columns."""
+    import pyarrow as pa
+    arrow_types = {STRING: pa.string(), INT64: pa.int64()}
+    return pa.schema([pa.field(column.name, arrow_types[column.type]) for column in columns])
+
+
+def dictionary_columns(columns):
+    """Returns the names of the low cardinality columns, to dictionary encode in Parquet."""
+    return [column.name for column in columns if column.dictionary]
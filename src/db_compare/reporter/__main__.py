@@ -13,16 +13,23 @@
 # limitations under the License.
 
 import argparse
+import concurrent.futures
+import contextlib
+import csv
+import hashlib
+import html
 import os
+import queue
 import yaml
-from google.cloud import bigquery
-from tabulate import tabulate
 import datetime
-import psycopg2
 import re
 import sys
-from google.cloud import secretmanager
+import threading
+import time
+import uuid
 
+from importer import schema_registry
+from reporter.result_cache import DEFAULT_CACHE_DIRECTORY, DEFAULT_CACHE_SIZE_MB, ResultCache, cache_key
 
 
 # Configuration
@@ -31,13 +38,23 @@ DEFAULT_DATASET_NAME = "your_dataset_name"
 DEFAULT_TABLE_NAME = "instances"
 DEFAULT_SCHEMA_NAME = "schema_compare"
 CONFIG_FILE = "query_config.yaml"
+PRECOMPUTE_CONFIG_FILE = "precompute_config.yaml"  # Tables shared by the sections of query_config.yaml
+PRECOMPUTED_PLACEHOLDER = "<precomputed>"  # Prefix of the shared tables in the section queries
 QUERIES_FOLDER = "queries"
 LOG_FILE = "executed_reporter_queries.sql"  # Log file for the executed SQL queries
+SOURCE_HASH_SECTION = "Mismatched Source Code (hash)"
+SOURCE_HASH_QUERY = "source_hash_mismatch.sql"
+SOURCE_HASH_MISMATCH_FILE = "source_hash_mismatches.csv"  # Objects to pass to the collectors' --fetch_source
+REPORT_BATCH_SIZE = 10000  # Rows read from the staging area and written to the report at a time
+SECTION_QUEUE_SIZE = 2  # Batches read ahead by each concurrent section
+DEFAULT_PARALLELISM = 4  # Report sections run at the same time on PostgreSQL and DuckDB
+EMBEDDED_DATABASE_PATHS = {"duckdb": "staging.duckdb", "sqlite": "staging.sqlite"}  # Local staging databases loaded by the importer's --db_type
 
 # Global variables for database connections
 client = None  # BigQuery client
-cursor = None  # Postgres cursor
-conn = None   # Postgres connection
+cursor = None  # Postgres, DuckDB or SQLite cursor
+conn = None   # Postgres, DuckDB or SQLite connection
+postgres_pool = None  # Postgres connections of the concurrent report sections, getconn()/putconn()
 
 def resolve_postgres_connection_string(connection_string):
     """
@@ -71,6 +88,7 @@ def resolve_postgres_connection_string(connection_string):
 
 def get_secret(secret_name):
     """Fetches the secret value from Google Secret Manager."""
+    from google.cloud import secretmanager  # Only needed for gcp-secret: passwords
     client = secretmanager.SecretManagerServiceClient()
     project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
     if not project_id:
@@ -121,61 +139,388 @@ def replace_instance_id(query_file, instance_1_name, instance_2_name, schemas_to
         
         if db_type == "bigquery":
             query = query.replace('<dataset_name>', dataset_name)
-        elif db_type == "postgres":
+        else:
             query = query.replace('<dataset_name>', schema_name)
+        query = translate_query(query, db_type)
 
         log_query(query, query_file)  # Log the modified query
         return query
 
-def execute_queries(config, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name):
-    """Executes SQL queries from configuration."""
-    results = []
-    for section, query_file in config.items():
-        print("Checking: ", section)
-        query = replace_instance_id(query_file, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name)
-        results.append(execute_query(query))
-    return results
-
-def execute_query(query):
-    """Executes a single SQL query."""
-    global client, cursor
+def translate_query(query, staging_db_type):
+    """
+    Dialect shim of the report queries, written for BigQuery and PostgreSQL,
+    for the embedded staging databases: BigQuery's IF() is IIF() in SQLite.
+    DuckDB runs the queries as they are.
+    """
+    if staging_db_type == "sqlite":
+        query = re.sub(r"\bIF\s*\(", "IIF(", query, flags=re.IGNORECASE)
+    return query
+
+def execute_queries(config, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name, parallelism=DEFAULT_PARALLELISM, result_cache=None, data_version=None,
+                    precompute_config=None):
+    """
+    Executes the SQL queries of the configuration, see iter_section_results.
+
+    Returns:
+        list: The rows of every section, in the order of config.
+    """
+    # Close the sections explicitly, so that a failing query stops the other ones right away
+    with contextlib.closing(iter_section_results(config, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name,
+                                                 parallelism, result_cache, data_version, precompute_config)) as section_results:
+        return [[row for batch in batches for row in batch] for _, batches in section_results]
+
+def iter_section_results(config, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name, parallelism=DEFAULT_PARALLELISM, result_cache=None,
+                         data_version=None, precompute_config=None):
+    """
+    Executes the SQL queries of the configuration concurrently, as they are
+    independent read-only queries: BigQuery jobs are all submitted before
+    waiting on them, PostgreSQL queries run on up to parallelism connections
+    of postgres_pool and DuckDB queries on as many cursors. SQLite queries run
+    one after the other. The rows of every section are yielded in batches as
+    they are read, the sections running ahead of the one being read hold at
+    most SECTION_QUEUE_SIZE batches each. The latency of every section is printed.
+
+    Args:
+        result_cache (ResultCache): Cache of the query results, see
+            result_cache. The cached sections are not queried.
+        data_version (str): Version of the staging data the results are
+            cached for, see get_staging_data_version.
+        precompute_config (dict): Query file of every table shared by the
+            sections, see create_precomputed_tables. They are created before
+            the first section that reads them and dropped after the last one.
+
+    Returns:
+        iterator: (section, batches) pairs in the order of config, batches
+        iterates over lists of up to REPORT_BATCH_SIZE row dicts and is read
+        to the end before the next pair. The queries are submitted and the
+        shared tables created before it is returned.
+    """
+    queries = [(section, replace_instance_id(query_file, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name))
+               for section, query_file in config.items()]
+    precompute_queries = {table: replace_instance_id(query_file, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name)
+                          for table, query_file in (precompute_config or {}).items()}
+    start_time = time.perf_counter()
+    cached_batches = {}
+    if result_cache is not None:
+        # The names of the precomputed tables change with every run, their queries are keyed instead
+        precompute_text = "\n".join(precompute_queries.values())
+        cache_keys = {section: cache_key(db_type, data_version, query + precompute_text if PRECOMPUTED_PLACEHOLDER in query else query)
+                      for section, query in queries}
+        for section, key in cache_keys.items():
+            batches = result_cache.get_batches(key, REPORT_BATCH_SIZE)
+            if batches is not None:
+                cached_batches[section] = batches
+    uncached_queries = [(section, query) for section, query in queries if section not in cached_batches]
+    precomputed_prefix = None
+    if any(PRECOMPUTED_PLACEHOLDER in query for _, query in uncached_queries):
+        precomputed_prefix = create_precomputed_tables(precompute_queries, dataset_name, schema_name)
+        uncached_queries = [(section, query.replace(PRECOMPUTED_PLACEHOLDER, precomputed_prefix)) for section, query in uncached_queries]
+    # A SQLite connection can only be used by the thread that opened it, and the
+    # precomputed DuckDB tables are temporary tables of the staging cursor
+    concurrent_sections = (parallelism > 1 and db_type in ("postgres", "duckdb") and not (db_type == "postgres" and postgres_pool is None)
+                           and not (db_type == "duckdb" and precomputed_prefix is not None))
+    executor = None
+    stop = threading.Event()  # Set when the sections are no longer read, stops the section threads
+    section_sources = {}
+    uncached_query_texts = dict(uncached_queries)
+
+    def close():
+        stop.set()
+        if executor is not None:
+            executor.shutdown()
+        if precomputed_prefix is not None:
+            drop_precomputed_tables(precomputed_prefix, precompute_queries)
+
+    try:
+        if db_type == "bigquery":
+            for section, query in uncached_queries:
+                section_sources[section] = (client.query(query), time.perf_counter())
+        elif concurrent_sections:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=parallelism)
+            for section, query in uncached_queries:
+                section_sources[section] = queue.Queue(maxsize=SECTION_QUEUE_SIZE)
+                executor.submit(queue_section_batches, query, section_sources[section], stop)
+    except BaseException:
+        close()
+        raise
+
+    def read_sections():
+        try:
+            for section, _ in queries:
+                if section in cached_batches:
+                    batches = count_section_rows(section, cached_batches[section], cached=True)
+                elif db_type == "bigquery":
+                    batches = read_bigquery_batches(section, *section_sources[section])
+                elif concurrent_sections:
+                    batches = read_queued_batches(section, section_sources[section])
+                else:
+                    batches = count_section_rows(section, stream_section(uncached_query_texts[section]))
+                if result_cache is not None and section not in cached_batches:
+                    batches = result_cache.put_batches(cache_keys[section], batches)
+                yield section, batches
+                for _ in batches:  # Rows the caller did not read
+                    pass
+        finally:
+            close()
+        print(f"Ran {len(uncached_queries)} report queries in {time.perf_counter() - start_time:.2f}s, {len(cached_batches)} cached")
+    return read_sections()
+
+def count_section_rows(section, batches, cached=False):
+    """Yields the batches of a section on, then prints its row count and the seconds to its first batch."""
+    start_time = time.perf_counter()
+    seconds = None
+    rows = 0
+    for batch in batches:
+        if seconds is None:
+            seconds = time.perf_counter() - start_time
+        rows += len(batch)
+        yield batch
+    if seconds is None:
+        seconds = time.perf_counter() - start_time
+    print(f"Checked: {section} ({rows} rows, {'cached' if cached else f'{seconds:.2f}s'})")
+
+def read_bigquery_batches(section, query_job, submit_time):
+    """Yields the result pages of a section's BigQuery job, then prints its row count and duration."""
+    rows = 0
+    for page in query_job.result(page_size=REPORT_BATCH_SIZE).pages:
+        batch = list(page)
+        rows += len(batch)
+        yield batch
+    if query_job.started and query_job.ended:
+        seconds = (query_job.ended - query_job.started).total_seconds()
+    else:
+        seconds = time.perf_counter() - submit_time
+    print(f"Checked: {section} ({rows} rows, {seconds:.2f}s)")
+
+def queue_section_batches(query, section_queue, stop):
+    """
+    Runs a section query on its own connection or cursor and puts its
+    batches in section_queue, waiting while the queue is full, then its
+    seconds to the first batch. An error is put in the queue instead.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                section_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    start_time = time.perf_counter()
+    seconds = None
+    try:
+        with contextlib.closing(stream_section(query, concurrent_section=True)) as batches:
+            for batch in batches:
+                if seconds is None:
+                    seconds = time.perf_counter() - start_time
+                if not put(("rows", batch)):
+                    return
+        put(("end", seconds if seconds is not None else time.perf_counter() - start_time))
+    except Exception as e:
+        put(("error", e))
+
+def read_queued_batches(section, section_queue):
+    """Yields the batches queue_section_batches puts in section_queue, then prints the section's row count and latency."""
+    rows = 0
+    while True:
+        kind, item = section_queue.get()
+        if kind == "error":
+            raise item
+        if kind == "end":
+            break
+        rows += len(item)
+        yield item
+    print(f"Checked: {section} ({rows} rows, {item:.2f}s)")
+
+def stream_section(query, concurrent_section=False):
+    """
+    Yields the row batches of a section query, on a connection of
+    postgres_pool or a new DuckDB cursor if concurrent_section, else on the
+    staging connection. PostgreSQL rows are read through a server-side
+    cursor, so that only one batch of a section is held in memory.
+    """
+    if db_type == "postgres":
+        section_conn = postgres_pool.getconn() if concurrent_section else conn
+        try:
+            section_cursor = section_conn.cursor(name=f"report_section_{uuid.uuid4().hex[:12]}")
+            try:
+                yield from stream_query(query, section_cursor)
+            finally:
+                section_cursor.close()
+        finally:
+            if concurrent_section:
+                try:
+                    section_conn.rollback()  # End the read-only transaction before the connection is reused
+                finally:
+                    postgres_pool.putconn(section_conn)
+    elif db_type == "duckdb" and concurrent_section:
+        section_cursor = conn.cursor()
+        try:
+            yield from stream_query(query, section_cursor)
+        finally:
+            section_cursor.close()
+    else:
+        yield from stream_query(query)
+
+def create_precomputed_tables(precompute_queries, dataset_name, schema_name):
+    """
+    Materialises the intermediate results shared by several report sections
+    (missing objects, object counts per schema and type), so that the sections
+    read them instead of each deriving them again from the staging tables.
+    PostgreSQL and BigQuery get tables of this run in the staging schema or
+    dataset, readable by the concurrent sections, UNLOGGED on PostgreSQL and
+    expiring after a day on BigQuery. DuckDB and SQLite get temporary tables,
+    as the reporter opens their staging database read-only.
+
+    Args:
+        precompute_queries (dict): Substituted SELECT of every table, by table name.
+        dataset_name (str): BigQuery dataset of the staging tables.
+        schema_name (str): Postgres schema of the staging tables.
+
+    Returns:
+        str: Prefix of the table names, replaces <precomputed> in the section queries.
+    """
+    start_time = time.perf_counter()
+    run_id = uuid.uuid4().hex[:12]
     if db_type == "bigquery":
-        query_job = client.query(query)
-        results = list(query_job.result())
+        prefix = f"{dataset_name}.report_{run_id}_"
+        query_jobs = [client.query(f"CREATE TABLE {prefix}{table} OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 1 DAY)) AS {query}")
+                      for table, query in precompute_queries.items()]
+        for query_job in query_jobs:
+            query_job.result()
     elif db_type == "postgres":
-        cursor.execute(query)
-        headers = [desc[0] for desc in cursor.description]
-        results = [dict(zip(headers, row)) for row in cursor.fetchall()]
-    return results
-
-def generate_text_report(config, results, instance_1_name, instance_2_name):
-    """Generates a text report."""
-    report = "## Database Comparison Report\n\n"
-    for i, (section, query_file) in enumerate(config.items()):
-        report += f"### {section}\n"
-        table_data = results[i]
-        if table_data:
-            report += tabulate(table_data, headers="keys", tablefmt="github") + "\n\n"
+        prefix = f"{schema_name}.report_{run_id}_"
+        for table, query in precompute_queries.items():
+            cursor.execute(f"CREATE UNLOGGED TABLE {prefix}{table} AS {query}")
+            cursor.execute(f"ANALYZE {prefix}{table}")
+        conn.commit()  # Visible to the connections of the concurrent sections from now on
+    else:
+        prefix = "temp.report_"
+        for table, query in precompute_queries.items():
+            cursor.execute(f"CREATE TEMP TABLE {prefix}{table} AS {query}")
+    print(f"Precomputed {', '.join(precompute_queries)} in {time.perf_counter() - start_time:.2f}s")
+    return prefix
+
+def drop_precomputed_tables(prefix, tables):
+    """Drops the tables of create_precomputed_tables."""
+    if db_type == "postgres":
+        conn.rollback()  # In case a failed statement aborted the transaction
+    for table in tables:
+        if db_type == "bigquery":
+            client.query(f"DROP TABLE IF EXISTS {prefix}{table}").result()
         else:
-            report += "No results found.\n\n"
-    return report
+            cursor.execute(f"DROP TABLE IF EXISTS {prefix}{table}")
+    if db_type == "postgres":
+        conn.commit()
+
+def execute_query(query, query_cursor=None):
+    """Executes a single SQL query, on query_cursor if given else on the staging connection."""
+    return [row for batch in stream_query(query, query_cursor) for row in batch]
+
+def stream_query(query, query_cursor=None, batch_size=REPORT_BATCH_SIZE):
+    """
+    Executes a single SQL query, on query_cursor if given else on the staging
+    connection, and yields its rows in lists of up to batch_size row dicts
+    (BigQuery rows, one result page at a time).
+    """
+    global client, cursor
+    if db_type == "bigquery":
+        for page in client.query(query).result(page_size=batch_size).pages:
+            yield list(page)
+        return
+    query_cursor = query_cursor or cursor
+    query_cursor.execute(query)
+    headers = None
+    while True:
+        rows = query_cursor.fetchmany(batch_size)
+        if headers is None:
+            # Server-side PostgreSQL cursors describe their result after the first fetch. SQLite
+            # keeps the case of the unquoted names, PostgreSQL and DuckDB return them in lowercase
+            headers = [desc[0].lower() if db_type == "sqlite" else desc[0] for desc in query_cursor.description]
+        if not rows:
+            break
+        yield [dict(zip(headers, row)) for row in rows]
+
+def write_object_list(batches, file_name):
+    """
+    Writes the OWNER, NAME and TYPE of the result rows to a pipe delimited
+    file as they are read, yielding every batch on.
+    """
+    count = 0
+    with open(file_name, "w", newline="") as f:
+        writer = csv.writer(f, delimiter="|")
+        writer.writerow(["OWNER", "NAME", "TYPE"])
+        for batch in batches:
+            for row in batch:
+                row = {key.upper(): value for key, value in row.items()}
+                writer.writerow([row["OWNER"], row["NAME"], row["TYPE"]])
+            count += len(batch)
+            yield batch
+    print(f"{count} objects with a different source hash written to {file_name}")
+
+def text_table_widths(table):
+    """Returns the column widths of a github table, read from the separator line under its header."""
+    # The separator line holds one "-" per character of every column, plus its padding
+    return [len(separator) - 2 for separator in table.split("\n")[1].strip("|").split("|")]
+
+def generate_text_report(config, sections, instance_1_name, instance_2_name, output):
+    """
+    Writes a text report to output, one batch of rows at a time, as the
+    (section, batches) pairs of sections arrive. The batches after the first
+    of a section continue its table without the header, with the column
+    widths of the previous batches. A batch with wider values widens the
+    columns and repeats the header with the new widths, values are never cut.
+    """
+    from tabulate import tabulate
+    output.write("## Database Comparison Report\n\n")
+    for section, batches in sections:
+        output.write(f"### {section}\n")
+        widths = None
+        for batch in batches:
+            if not batch:
+                continue
+            if widths is None:
+                table = tabulate(batch, headers="keys", tablefmt="github")
+                widths = text_table_widths(table)
+            else:
+                # Headers padded to the current widths (less the 2 characters tabulate adds to
+                # headers) keep the narrower columns as wide as in the previous batches
+                headers = [str(key).ljust(width - 2) for key, width in zip(batch[0], widths)]
+                table = tabulate([list(row.values()) for row in batch], headers=headers, tablefmt="github")
+                batch_widths = text_table_widths(table)
+                if batch_widths == widths:
+                    table = table.split("\n", 2)[2]
+                widths = batch_widths
+            output.write(table + "\n")
+        output.write("\n" if widths is not None else "No results found.\n\n")
+
+def html_cell(value):
+    """Returns the HTML of a report value, only strings need escaping."""
+    if isinstance(value, str):
+        return html.escape(value, quote=False)
+    return str(value)
 
-def generate_html_report(config, results, instance_1_name, instance_2_name):
-    """Generates an HTML report."""
-    report = """
+def generate_html_report(config, sections, instance_1_name, instance_2_name, output):
+    """
+    Writes an HTML report to output, one batch of rows at a time, as the
+    (section, batches) pairs of sections arrive. Only the menu needs the
+    sections of config upfront.
+    """
+    output.write("""
     <!DOCTYPE html>
     <html>
     <head>
-    <title>Database Comparison Report</title>"""
+    <title>Database Comparison Report</title>""")
 
     # Include CSS files
     css_folder = os.path.join(get_script_path(), 'css')
     for filename in os.listdir(css_folder):
         if filename.endswith('.css'):
             with open(os.path.join(css_folder, filename), 'r') as css_file:
-                report += "<style>\n" + css_file.read() + "\n</style>\n"
+                output.write("<style>\n" + css_file.read() + "\n</style>\n")
 
-    report += """<style>
+    output.write("""<style>
     body {
         font-family: 'Arial', sans-serif;
         background-color: #f4f4f4;
@@ -283,58 +628,55 @@ def generate_html_report(config, results, instance_1_name, instance_2_name):
     <body>
     <h2>Database Comparison Report</h2>
     <ul>
-    """
-    for i, (section, query_file) in enumerate(config.items()):
-        report += f"<li><a href='#{section.replace(' ', '_')}'>{section}</a></li>"
-
-    report += "</ul>"
-
+    """)
     for i, (section, query_file) in enumerate(config.items()):
-        report += f"<h3><a name='{section.replace(' ', '_')}'></a>{section}</h3>"
-        table_data = results[i]
-        if table_data:
-            table_id = f"table_{i}"  # Unique ID for each table
-            report += f"<table id='{table_id}' class='display'><thead><tr>" # 'display' class is for DataTables
-            for header in table_data[0].keys():
-                report += f"<th>{header}</th>"
-            report += "</tr></thead><tbody>"
-            for row in table_data:
-                report += "<tr>"
-                for value in row.values():
-                    report += f"<td>{value}</td>" # Escape HTML special chars if needed
-                report += "</tr>"
-            report += "</tbody></table>"
-
+        output.write(f"<li><a href='#{section.replace(' ', '_')}'>{html.escape(section)}</a></li>")
 
+    output.write("</ul>")
 
+    for i, (section, batches) in enumerate(sections):
+        output.write(f"<h3><a name='{section.replace(' ', '_')}'></a>{html.escape(section)}</h3>")
+        has_rows = False
+        for batch in batches:
+            if not batch:
+                continue
+            if not has_rows:
+                table_id = f"table_{i}"  # Unique ID for each table
+                output.write(f"<table id='{table_id}' class='display'><thead><tr>") # 'display' class is for DataTables
+                output.write("".join(f"<th>{html.escape(header)}</th>" for header in batch[0].keys()))
+                output.write("</tr></thead><tbody>")
+                has_rows = True
+            output.write("".join("<tr>" + "".join(f"<td>{html_cell(value)}</td>" for value in row.values()) + "</tr>" for row in batch))
+        if has_rows:
+            output.write("</tbody></table>")
         else:
-            report += "<p>No results found.</p>"
+            output.write("<p>No results found.</p>")
 
     # Include JS files
     js_folder = os.path.join(get_script_path(), 'css')  # Adjust this if your JS is in a different folder
     for filename in os.listdir(js_folder):
         if filename.endswith('js'):
             with open(os.path.join(js_folder, filename), 'r') as js_file:
-                report += '\n<script type = "text/javascript">\n' + js_file.read() + "\n</script>\n"
+                output.write('\n<script type = "text/javascript">\n' + js_file.read() + "\n</script>\n")
 
     # Include minimized JS files
     js_folder = os.path.join(get_script_path(), 'css')  # Adjust this if your JS is in a different folder
     for filename in os.listdir(js_folder):
         if filename.endswith('min.js'):
             with open(os.path.join(js_folder, filename), 'r') as js_file:
-                report += '\n<script type = "text/javascript">\n' + js_file.read() + "\n</script>\n"
+                output.write('\n<script type = "text/javascript">\n' + js_file.read() + "\n</script>\n")
     
-    report += """
+    output.write("""
 
     <button class="back-to-top"><i class="fas fa-arrow-up"></i></button>
 
     <script>
-        $(document).ready( function () {"""  # Initialize DataTables in document.ready
+        $(document).ready( function () {""")  # Initialize DataTables in document.ready
 
     for i in range(len(config)):
-        report += f"$('#table_{i}').DataTable();"
+        output.write(f"$('#table_{i}').DataTable();")
 
-    report += """
+    output.write("""
     // Get the button element
         const backToTopButton = document.querySelector(".back-to-top");
 
@@ -357,9 +699,7 @@ def generate_html_report(config, results, instance_1_name, instance_2_name):
     </script>
     </body>
     </html>
-    """
-
-    return report
+    """)
 
 
 def get_instance_names(dataset_name, schema_name, table_name):
@@ -368,25 +708,308 @@ def get_instance_names(dataset_name, schema_name, table_name):
     if db_type == "bigquery":
         instances = client.query(f"SELECT DISTINCT PKEY FROM {dataset_name}.{table_name}").result()
         instance_names = [row[0] for row in instances]
-    elif db_type == "postgres":
+    else:
         cursor.execute(f"SELECT DISTINCT PKEY FROM {schema_name}.{table_name}")
         instance_names = [row[0] for row in cursor.fetchall()]
     return instance_names
 
-def main():
-    """Main function to execute the script."""
-    global CONFIG_FILE, QUERIES_FOLDER, client, cursor, conn, db_type, project_id, dataset_name, table_name, schema_name, schemas_to_compare, report_format  
+def get_latest_instance_names(dataset_name, schema_name):
+    """
+    Retrieves the instance names from the importer's load history, the most
+    recently loaded first.
+
+    Returns:
+        list: Instance names, None if the staging area has no load history.
+    """
+    global client, cursor
+    history_table = schema_registry.LOAD_HISTORY_TABLE
+    if not has_load_history(dataset_name, schema_name):
+        return None
+    if db_type == "bigquery":
+        rows = client.query(f"SELECT PKEY FROM {dataset_name}.{history_table} GROUP BY PKEY ORDER BY MAX(LOADED_AT) DESC, PKEY").result()
+        return [row[0] for row in rows]
+    cursor.execute(f"SELECT pkey FROM {schema_name}.{history_table} GROUP BY pkey ORDER BY MAX(loaded_at) DESC, pkey")
+    return [row[0] for row in cursor.fetchall()]
+
+def has_load_history(dataset_name, schema_name):
+    """Checks whether the staging area has the importer's load history table."""
+    history_table = schema_registry.LOAD_HISTORY_TABLE
+    if db_type == "bigquery":
+        from google.cloud.exceptions import NotFound
+        try:
+            client.get_table(f"{client.project}.{dataset_name}.{history_table}")
+        except NotFound:
+            return False
+        return True
+    if db_type == "duckdb":
+        cursor.execute("SELECT count(*) FROM information_schema.tables WHERE table_schema = ? AND table_name = ?", [schema_name, history_table])
+        return cursor.fetchone()[0] > 0
+    if db_type == "sqlite":
+        cursor.execute(f"SELECT count(*) FROM {schema_name}.sqlite_master WHERE type = 'table' AND name = ?", (history_table,))
+        return cursor.fetchone()[0] > 0
+    cursor.execute("SELECT to_regclass(%s)", (f"{schema_name}.{history_table}",))
+    return cursor.fetchone()[0] is not None
+
+def get_staging_data_version(dataset_name, schema_name):
+    """
+    Hashes the importer's load history as the version of the staging data:
+    every load adds a row per loaded instance (PKEY) and a full reload drops
+    the history, so the hash changes whenever the importer changes the data.
+
+    Returns:
+        str: SHA-256 of the load history, None if the staging area has no load history.
+    """
+    history_table = schema_registry.LOAD_HISTORY_TABLE
+    if not has_load_history(dataset_name, schema_name):
+        return None
+    if db_type == "bigquery":
+        rows = client.query(f"SELECT PKEY, LOADED_AT FROM {dataset_name}.{history_table} ORDER BY LOADED_AT, PKEY").result()
+        staging_area = f"{client.project}.{dataset_name}"
+    else:
+        cursor.execute(f"SELECT pkey, loaded_at FROM {schema_name}.{history_table} ORDER BY loaded_at, pkey")
+        rows = cursor.fetchall()
+        staging_area = schema_name
+    history = "\n".join(f"{row[0]}|{row[1]}" for row in rows)
+    return hashlib.sha256(f"{staging_area}\n{history}".encode("utf-8")).hexdigest()
+
+def check_staging_schema(dataset_name, schema_name):
+    """
+    Warns about staging columns whose type differs from the schema registry,
+    e.g. tables loaded by an older importer, as the report joins compare them
+    without casts.
+
+    Returns:
+        list: (table, column, staging type, registry type) of the mismatching columns.
+    """
+    if db_type == "bigquery":
+        rows = client.query(f"SELECT table_name, column_name, data_type FROM {dataset_name}.INFORMATION_SCHEMA.COLUMNS").result()
+        expected_types = schema_registry.BIGQUERY_TYPES
+    elif db_type == "duckdb":
+        cursor.execute("SELECT table_name, column_name, data_type FROM information_schema.columns WHERE table_schema = ?", [schema_name])
+        rows = cursor.fetchall()
+        expected_types = schema_registry.DUCKDB_TYPES
+    elif db_type == "sqlite":
+        cursor.execute(f"SELECT m.name, p.name, p.type FROM {schema_name}.sqlite_master m JOIN pragma_table_info(m.name, ?) p WHERE m.type = 'table'", (schema_name,))
+        rows = cursor.fetchall()
+        expected_types = schema_registry.SQLITE_TYPES
+    else:
+        cursor.execute("SELECT table_name, column_name, data_type FROM information_schema.columns WHERE table_schema = %s", (schema_name,))
+        rows = cursor.fetchall()
+        expected_types = schema_registry.POSTGRES_INFORMATION_SCHEMA_TYPES
+    mismatches = []
+    for table, column, data_type in rows:
+        registered = schema_registry.columns_by_name(table).get(column.lower())
+        if registered is not None and data_type.upper() != expected_types[registered.type].upper():
+            mismatches.append((table, column, data_type, expected_types[registered.type]))
+    for table, column, data_type, expected_type in mismatches:
+        print(f"Warning: {table}.{column} is {data_type} instead of {expected_type}, re-run the importer to reload it with the registry types.")
+    return mismatches
+
+def use_staging_connection(staging_db_type, bigquery_client=None, postgres_connection=None, embedded_connection=None, connection_pool=None):
+    """
+    Sets the staging database connection the report queries run on, so that
+    a caller (e.g. the compare pipeline) can share its own connection.
+
+    Args:
+        staging_db_type (str): One of "bigquery", "postgres", "duckdb" or "sqlite".
+        bigquery_client: BigQuery client, if the staging area is BigQuery.
+        postgres_connection: DB-API connection, if the staging area is Postgres.
+        embedded_connection: DB-API connection, if the staging area is a DuckDB
+            or SQLite database, see connect_embedded_staging.
+        connection_pool: Postgres connection pool with getconn() and putconn(),
+            e.g. a psycopg2 ThreadedConnectionPool, to run the report sections
+            concurrently.
+    """
+    global db_type, client, conn, cursor, postgres_pool
+    db_type = staging_db_type
+    client = bigquery_client
+    postgres_pool = connection_pool
+    conn = postgres_connection if postgres_connection is not None else embedded_connection
+    cursor = conn.cursor() if conn is not None else None
+
+def connect_embedded_staging(staging_db_type, database_path, schema_name):
+    """
+    Opens a local embedded staging database loaded by the importer's
+    --db_type duckdb or sqlite. The SQLite database file is attached as
+    schema_name, so that the queries address its tables as <schema_name>.<table>.
+    """
+    if staging_db_type == "duckdb":
+        import duckdb
+        return duckdb.connect(database_path, read_only=True)
+    import sqlite3
+    embedded_conn = sqlite3.connect(":memory:", uri=True)
+    embedded_conn.execute(f"ATTACH DATABASE ? AS {schema_name}", (f"file:{database_path}?mode=ro",))
+    return embedded_conn
+
+def generate_report(dataset_name, schema_name, table_name=DEFAULT_TABLE_NAME, schemas_to_compare=None, schema_mapping=None, report_format="text", source_hash=False, instance_ids=None, parallelism=DEFAULT_PARALLELISM, result_cache=None):
+    """
+    Runs the report queries on the connection set with use_staging_connection
+    and generates the comparison report.
+
+    Args:
+        dataset_name (str): BigQuery dataset of the staging tables.
+        schema_name (str): Postgres, DuckDB or SQLite schema of the staging tables.
+        table_name (str): Table holding the instance names.
+        schemas_to_compare (str): Schemas to be compared (comma-separated).
+        schema_mapping (str): Schema mapping i.e: 'SCHEMA_1/SCHEMA_2'.
+        report_format (str): Either "text" or "html".
+        source_hash (bool): Add the source hash mismatch section.
+        instance_ids (str): The two instances to compare (comma-separated), by
+            default the latest two loaded by the importer.
+        parallelism (int): Maximum number of report queries run at the same
+            time on PostgreSQL and DuckDB, see execute_queries.
+        result_cache (ResultCache): Cache of the section results, keyed by the
+            query and the staging data version, see result_cache. The results
+            are not cached if the staging area has no load history.
+
+    Returns:
+        str: The file name of the HTML report, None for the text report or if
+        there are fewer than two instances.
+    """
+    global CONFIG_FILE, QUERIES_FOLDER
     # Remove log file if it already exists
     if os.path.exists(LOG_FILE):
         os.remove(LOG_FILE)
-    
+
+    if schemas_to_compare:
+        schemas_to_compare = ",".join([f"'{item.strip()}'" for item in schemas_to_compare.split(',')])
+    if schema_mapping:
+        schema_mapping = schema_mapping.split('/')
+        QUERIES_FOLDER = 'queries_schema_mapped'
+        CONFIG_FILE = "query_config_schema_mapped.yaml"
+    else:
+        QUERIES_FOLDER = 'queries'
+        CONFIG_FILE = "query_config.yaml"
+
+    # Get instance names: the requested ones, else the latest two loaded
+    if instance_ids:
+        instance_names = [item.strip() for item in instance_ids.split(',')]
+    else:
+        instance_names = get_latest_instance_names(dataset_name, schema_name)
+        if instance_names and len(instance_names) >= 2:
+            instance_names = sorted(instance_names[:2])
+        else:
+            instance_names = get_instance_names(dataset_name, schema_name, table_name)
+
+    if len(instance_names) < 2:
+        print("Not enough instances found in the table.")
+        return None
+
+    check_staging_schema(dataset_name, schema_name)
+    instance_1_name, instance_2_name = instance_names[:2]
+    print("Instance 1:", instance_1_name)
+    print("Instance 2:", instance_2_name)
+    if schema_mapping:
+        print(f"Schema mapping - {instance_1_name}:{schema_mapping[0]}, {instance_2_name}:{schema_mapping[1]}")
+    # Load configuration and execute queries
+    with open(os.path.join(get_script_path(), CONFIG_FILE), "r") as f:
+        config = yaml.safe_load(f)
+    if source_hash:
+        config[SOURCE_HASH_SECTION] = SOURCE_HASH_QUERY
+    precompute_config = None
+    if not schema_mapping:
+        with open(os.path.join(get_script_path(), PRECOMPUTE_CONFIG_FILE), "r") as f:
+            precompute_config = yaml.safe_load(f)
+    data_version = get_staging_data_version(dataset_name, schema_name) if result_cache is not None else None
+    if result_cache is not None and data_version is None:
+        print("No load history in the staging area, the report results are not cached.")
+        result_cache = None
+    with contextlib.closing(iter_section_results(config, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name, parallelism,
+                                                 result_cache, data_version, precompute_config)) as section_results:
+        return write_report(config, section_results, instance_1_name, instance_2_name, report_format)
+
+def write_report(config, section_results, instance_1_name, instance_2_name, report_format="text"):
+    """
+    Writes the HTML report to a file or prints the text report, section by
+    section as the rows arrive, so that only a batch of rows is held in
+    memory. The source hash mismatches are written to
+    SOURCE_HASH_MISMATCH_FILE along the way.
+
+    Args:
+        section_results (iterable): (section, batches) pairs in the order of
+            config, see iter_section_results.
+
+    Returns:
+        str: The file name of the HTML report, None for the text report.
+    """
+    sections = ((section, write_object_list(batches, SOURCE_HASH_MISMATCH_FILE) if section == SOURCE_HASH_SECTION else batches)
+                for section, batches in section_results)
+    if report_format == "html":
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        report_file_name = f"database_comparison_report_{timestamp}.html"
+        with open(report_file_name, "w") as f:
+            generate_html_report(config, sections, instance_1_name, instance_2_name, f)
+        print(f"HTML report generated: {report_file_name}")
+        return report_file_name
+    generate_text_report(config, sections, instance_1_name, instance_2_name, sys.stdout)
+    return None
+
+def generate_direct_report(extract_files, schemas_to_compare=None, report_format="text", source_hash=False, instance_ids=None):
+    """
+    Generates the comparison report straight from the extracts of two
+    instances, computing the report sections in memory (see direct_diff)
+    instead of querying a staging database.
+
+    Args:
+        extract_files (list): (filename, opener) pairs, see importer's list_directory_extracts.
+        schemas_to_compare (str): Schemas to be compared (comma-separated).
+        report_format (str): Either "text" or "html".
+        source_hash (bool): Add the source hash mismatch section.
+        instance_ids (str): The two instances to compare (comma-separated), by
+            default the first two instances of the extracts.
+
+    Returns:
+        str: The file name of the HTML report, None for the text report or if
+        there are fewer than two instances.
+    """
+    from reporter import direct_diff
+    start_time = time.perf_counter()
+    tables = direct_diff.read_extract_tables(extract_files)
+    print(f"Read {sum(len(rows) for rows in tables.values())} extract rows in {time.perf_counter() - start_time:.2f}s")
+
+    if instance_ids:
+        instance_names = [item.strip() for item in instance_ids.split(',')]
+    else:
+        instance_names = sorted({row[0] for row in tables["instances"]})
+        if len(instance_names) > 2:
+            print(f"Found {len(instance_names)} instances in the extracts, comparing the first two, use --instance_ids to pick others.")
+    if len(instance_names) < 2:
+        print("Not enough instances found in the extracts.")
+        return None
+    instance_1_name, instance_2_name = instance_names[:2]
+    print("Instance 1:", instance_1_name)
+    print("Instance 2:", instance_2_name)
+
+    with open(os.path.join(get_script_path(), "query_config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    if source_hash:
+        config[SOURCE_HASH_SECTION] = SOURCE_HASH_QUERY
+    owners = [item.strip() for item in schemas_to_compare.split(',')] if schemas_to_compare else None
+    diff = direct_diff.ExtractDiff(tables, instance_1_name, instance_2_name, owners)
+    section_results = []
+    for section, query_file in list(config.items()):
+        if query_file not in direct_diff.SECTIONS:
+            print(f"Skipping {section}: no direct diff of {query_file}")
+            del config[section]
+            continue
+        start_time = time.perf_counter()
+        rows = diff.section(query_file)
+        print(f"Checked: {section} ({len(rows)} rows, {time.perf_counter() - start_time:.3f}s)")
+        section_results.append((section, [rows[i:i + REPORT_BATCH_SIZE] for i in range(0, len(rows), REPORT_BATCH_SIZE)]))
+    return write_report(config, section_results, instance_1_name, instance_2_name, report_format)
+
+def main():
+    """Main function to execute the script."""
+    global client, cursor, conn, db_type, project_id, dataset_name, table_name, schema_name, schemas_to_compare, report_format  
     parser = argparse.ArgumentParser(description="Generate database comparison report.")
     parser.add_argument("--dataset_id", help="BigQuery dataset name.")
     parser.add_argument("--table_name", help="BigQuery table name.")
     parser.add_argument("--format", default="text", choices=["text", "html"], help="Report format (text or html).")
-    parser.add_argument("--db_type", default="bigquery", choices=["bigquery", "postgres"], help="Database type.")
+    parser.add_argument("--db_type", default="bigquery", choices=["bigquery", "postgres"] + sorted(EMBEDDED_DATABASE_PATHS) + ["direct"], help="Database type, duckdb and sqlite are local databases loaded by the importer's --db_type, direct diffs the extracts of --extract_directory in memory without a staging database.")
+    parser.add_argument("--extract_directory", default="extracts", help="Directory of the extract archives read by --db_type direct (default: extracts).")
+    parser.add_argument("--database_path", help=f"File of the duckdb or sqlite staging database (default: {', '.join(EMBEDDED_DATABASE_PATHS.values())}).")
    
-    group = parser.add_mutually_exclusive_group(required=True)  # Ensure one is chosen
+    group = parser.add_mutually_exclusive_group()  # One is required unless the staging database is embedded
     group.add_argument("--postgres_connection_string", help="Connection string for your PostgreSQL database. Use this if the staging area is a postgres db. format: 'postgresql://username:pwd@ip_address/db_name'.")
     group.add_argument("--postgres_host", help="Postgres host. Either use postgres_host or postgres_connection_string")
     group.add_argument("--project_id", help="Google Cloud project ID.")
@@ -398,10 +1021,18 @@ def main():
     parser.add_argument("--schema_name", help="Postgres schema name.")
     parser.add_argument("--schemas_to_compare", help="Schemas to be compared (comma-separated).")
     parser.add_argument("--schema_mapping", help="Schema mapping i.e: 'SCHEMA_1/SCHEMA_2' (Only one mapping is allowed).")
+    parser.add_argument("--instance_ids", help="The two instances (PKEY) to compare, comma-separated (default: the latest two loaded by the importer).")
+    parser.add_argument("--parallelism", default=DEFAULT_PARALLELISM, type=int, help=f"Number of report queries run at the same time on PostgreSQL (one pooled connection each) and DuckDB (default: {DEFAULT_PARALLELISM}). BigQuery jobs are always submitted together.")
+    parser.add_argument("--cache_directory", default=DEFAULT_CACHE_DIRECTORY, help=f"Directory of the cached report query results (default: {DEFAULT_CACHE_DIRECTORY}).")
+    parser.add_argument("--cache_size_mb", default=DEFAULT_CACHE_SIZE_MB, type=int, help=f"Size of the result cache above which the least recently used results are deleted (default: {DEFAULT_CACHE_SIZE_MB}).")
+    parser.add_argument("--no_cache", action="store_true", help="Run every report query on the staging area instead of reusing the results cached for the same query and staging data.")
+    parser.add_argument("--source_hash", action="store_true", help=f"Compare the source hashes extracted with the collectors' --source_hash and write the mismatching objects to {SOURCE_HASH_MISMATCH_FILE}.")
     args = parser.parse_args()
+    if args.db_type not in list(EMBEDDED_DATABASE_PATHS) + ["direct"] and not (args.postgres_connection_string or args.postgres_host or args.project_id):
+        parser.error("one of the arguments --postgres_connection_string --postgres_host --project_id is required")
 
     # postgres_connection_string = resolve_password(args.postgres_connection_string)
-    postgres_connection_string = resolve_postgres_connection_string(args.postgres_connection_string)
+    postgres_connection_string = resolve_postgres_connection_string(args.postgres_connection_string) if args.postgres_connection_string else None
 
     # Get configuration
     project_id = args.project_id or os.environ.get("PROJECT_ID") or DEFAULT_PROJECT_ID
@@ -409,73 +1040,60 @@ def main():
     table_name = args.table_name or os.environ.get("TABLE_NAME") or DEFAULT_TABLE_NAME
     schema_name = args.schema_name or os.environ.get("SCHEMA_NAME") or DEFAULT_SCHEMA_NAME
     schemas_to_compare = args.schemas_to_compare or os.environ.get("SCHEMAS_TO_COMPARE")
-    schema_mapping = args.schema_mapping 
-    if schemas_to_compare:
-        schemas_to_compare = ",".join([f"'{item.strip()}'" for item in schemas_to_compare.split(',')])
-    if schema_mapping:
-        schema_mapping = schema_mapping.split('/')
-        QUERIES_FOLDER = 'queries_schema_mapped'
-        CONFIG_FILE = "query_config_schema_mapped.yaml"
-    
     report_format = args.format
     db_type = args.db_type
 
+    if db_type == "direct":
+        if args.schema_mapping:
+            parser.error("--schema_mapping is not supported with --db_type direct")
+        from importer.__main__ import list_directory_extracts
+        extract_files = list_directory_extracts(args.extract_directory, args.extract_directory)
+        generate_direct_report(extract_files, schemas_to_compare, report_format, args.source_hash, args.instance_ids)
+        return
+
     # Initialize database connection
     if db_type == "bigquery":
-        client = bigquery.Client(project=project_id)
+        from google.cloud import bigquery
+        use_staging_connection(db_type, bigquery_client=bigquery.Client(project=project_id))
     elif db_type == "postgres":
+        import psycopg2.pool
         if postgres_connection_string:
             match = re.match(r"postgresql://([^:]+):([^@]+)@([^/]+)/(.+)", postgres_connection_string)
             if match:
                 postgres_user, postgres_password, postgres_host, postgres_database = match.groups()
-                conn = psycopg2.connect(
+                connect_args = dict(
                     host=postgres_host,
                     user=postgres_user,
                     password=postgres_password,
                     database=postgres_database,
                 )
         elif args.postgres_host:
-            conn = psycopg2.connect(
+            connect_args = dict(
                 host=args.postgres_host,
                 port=args.postgres_port,
                 user=args.postgres_user,
                 password=args.postgres_password,
                 database=args.postgres_database,
             )
-        cursor = conn.cursor()
-
-    # Get instance names
-    instance_names = get_instance_names(dataset_name, schema_name, table_name)
-
-    if len(instance_names) >= 2:
-        instance_1_name, instance_2_name = instance_names[:2]
-        print("Instance 1:", instance_1_name)
-        print("Instance 2:", instance_2_name)
-        if schema_mapping:
-            print(f"Schema mapping - {instance_1_name}:{schema_mapping[0]}, {instance_2_name}:{schema_mapping[1]}")
-        # Load configuration and execute queries
-        with open(os.path.join(get_script_path(), CONFIG_FILE), "r") as f:
-            config = yaml.safe_load(f)
-        results = execute_queries(config, instance_1_name, instance_2_name, schemas_to_compare, schema_mapping, dataset_name, schema_name)
-
-        # Generate report
-        if report_format == "text":
-            report = generate_text_report(config, results, instance_1_name, instance_2_name)
-            print(report)
-        elif report_format == "html":
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            report_file_name = f"database_comparison_report_{timestamp}.html"
-            report = generate_html_report(config, results, instance_1_name, instance_2_name)
-            with open(report_file_name, "w") as f:
-                f.write(report)
-            print(f"HTML report generated: {report_file_name}")
+        # The report sections run concurrently on the connections of the pool,
+        # next to the staging connection taken from it below
+        connection_pool = psycopg2.pool.ThreadedConnectionPool(1, max(1, args.parallelism) + 1, **connect_args)
+        conn = connection_pool.getconn()
+        use_staging_connection(db_type, postgres_connection=conn, connection_pool=connection_pool)
     else:
-        print("Not enough instances found in the table.")
+        use_staging_connection(db_type, embedded_connection=connect_embedded_staging(db_type, args.database_path or EMBEDDED_DATABASE_PATHS[db_type], schema_name))
 
-    # Close database connection if necessary
-    if db_type == "postgres":
-        cursor.close()
-        conn.close()
+    report_cache = None if args.no_cache else ResultCache(args.cache_directory, args.cache_size_mb * 1024 * 1024)
+    try:
+        generate_report(dataset_name, schema_name, table_name, schemas_to_compare, args.schema_mapping, report_format, args.source_hash, args.instance_ids, args.parallelism,
+                        report_cache)
+    finally:
+        # Close database connection if necessary
+        if db_type != "bigquery":
+            cursor.close()
+            conn.close()
+        if postgres_pool is not None:
+            postgres_pool.closeall()
 
 if __name__ == "__main__":
     sys.argv[0] = re.sub(r'(-script\.pyw|\.exe)?$', '', sys.argv[0])
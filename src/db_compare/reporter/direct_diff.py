@@ -0,0 +1,233 @@
+# Copyright 2024 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Direct diff of two instances' extracts, without a staging database: the
+extract archives are read in place and the report sections of
+query_config.yaml are computed in Python with sets and counters of tuple keys.
+
+Every section returns the rows its query returns on a PostgreSQL staging
+area (lowercase column names, same filters and order). Like the queries, the
+sections only read the rows of the two instances compared.
+"""
+
+import collections
+import csv
+import io
+
+from importer import schema_registry
+
+# Columns read from each extract table, the other columns are skipped
+TABLE_COLUMNS = {
+    "instances": ("PKEY",),
+    "dbobjectnames": ("PKEY", "OWNER", "OBJECT_NAME", "OBJECT_TYPE"),
+    "columns": ("PKEY", "OWNER", "TABLE_NAME", "COLUMN_NAME"),
+    "sourcecodedetailed": ("PKEY", "OWNER", "NAME", "TYPE", "NR_LINES"),
+    "sourcehash": ("PKEY", "OWNER", "NAME", "TYPE", "SOURCE_HASH", "DMA_SOURCE_ID"),
+}
+
+# Object types of the tables whose columns are not reported as missing, as the
+# whole table is
+MISSING_TABLE_TYPES = ("TABLE", "PARTITIONED TABLE")
+
+
+def read_extract_rows(filename, source_file, column_names):
+    """
+    Reads the given columns of a CSV or Parquet extract, matched
+    case-insensitively. Empty CSV values are read as None, as COPY loads them.
+
+    Returns:
+        list: Row tuples in the order of column_names, None for the columns the extract lacks.
+    """
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(source_file)
+        names = {name.upper(): name for name in parquet_file.schema_arrow.names}
+        table = parquet_file.read(columns=[names[name] for name in column_names if name in names])
+        columns = [table.column(names[name]).to_pylist() if name in names else [None] * table.num_rows for name in column_names]
+        return list(zip(*columns))
+    reader = csv.reader(io.TextIOWrapper(source_file, encoding="utf-8", newline=""), delimiter="|")
+    header = [name.upper() for name in next(reader, [])]
+    indexes = [header.index(name) if name in header else None for name in column_names]
+    return [tuple(row[index] or None if index is not None else None for index in indexes) for row in reader]
+
+
+def read_extract_tables(extract_files, tables=TABLE_COLUMNS):
+    """
+    Reads the columns of TABLE_COLUMNS from the extracts of all instances.
+
+    Args:
+        extract_files (list): (filename, opener) pairs, see importer's list_directory_extracts.
+        tables (dict): Column names to read by table name.
+
+    Returns:
+        dict: Row tuples by table name, starting with the PKEY of the row.
+    """
+    rows = {table: [] for table in tables}
+    for filename, open_file in extract_files:
+        table = schema_registry.table_name(filename)
+        if table in tables and filename.endswith((".csv", ".parquet")):
+            with open_file() as source_file:
+                rows[table].extend(read_extract_rows(filename, source_file, tables[table]))
+    return rows
+
+
+class ExtractDiff:
+    """
+    Report sections of two instances computed from their extract rows. The
+    key sets and counters of each instance are built once and shared by the
+    sections that use them.
+
+    Args:
+        tables (dict): Row tuples by table name, see read_extract_tables.
+        instance_1 (str): PKEY of the first instance.
+        instance_2 (str): PKEY of the second instance.
+        owners (list): Schemas to compare, all schemas if empty.
+    """
+
+    def __init__(self, tables, instance_1, instance_2, owners=None):
+        self.tables = tables
+        self.instance_1 = instance_1
+        self.instance_2 = instance_2
+        self.owners = set(owners) if owners else None
+        # Result columns are named like the unquoted aliases of the queries on PostgreSQL
+        self.prefix_1 = instance_1.lower()
+        self.prefix_2 = instance_2.lower()
+        self.cache = {}
+
+    def instance_rows(self, table, instance):
+        """Returns the rows of an instance in a table without their PKEY, in the schemas to compare."""
+        key = ("rows", table, instance)
+        if key not in self.cache:
+            self.cache[key] = [row[1:] for row in self.tables.get(table, [])
+                               if row[0] == instance and (self.owners is None or row[1] in self.owners)]
+        return self.cache[key]
+
+    def instance_keys(self, table, instance, width):
+        """Returns the distinct keys (first width columns) of an instance's rows."""
+        key = ("keys", table, instance, width)
+        if key not in self.cache:
+            self.cache[key] = {row[:width] for row in self.instance_rows(table, instance)}
+        return self.cache[key]
+
+    def missing_keys(self, table, width):
+        """
+        Returns the keys present in only one of the instances.
+
+        Returns:
+            list: (key, present in instance 1, present in instance 2) tuples.
+        """
+        keys_1 = self.instance_keys(table, self.instance_1, width)
+        keys_2 = self.instance_keys(table, self.instance_2, width)
+        return [(key, key in keys_1, key in keys_2) for key in keys_1 ^ keys_2]
+
+    def status_rows(self, table, names, order):
+        """Returns the rows of a missing objects section, with the Present/Missing status of each instance."""
+        rows = [dict(zip(names, key), **{f"{self.prefix_1}_status": "Present" if in_1 else "Missing",
+                                         f"{self.prefix_2}_status": "Present" if in_2 else "Missing"})
+                for key, in_1, in_2 in self.missing_keys(table, len(names))]
+        return sorted(rows, key=lambda row: tuple(row[name] or "" for name in order))
+
+    def object_counts(self, mismatched_only=False, order=("owner", "object_type")):
+        """Returns the object counts by schema and object type of both instances."""
+        counts_1 = collections.Counter(row[0:3:2] for row in self.instance_rows("dbobjectnames", self.instance_1))
+        counts_2 = collections.Counter(row[0:3:2] for row in self.instance_rows("dbobjectnames", self.instance_2))
+        rows = [{"owner": owner, "object_type": object_type,
+                 f"{self.prefix_1}_count": counts_1[(owner, object_type)], f"{self.prefix_2}_count": counts_2[(owner, object_type)]}
+                for owner, object_type in counts_1.keys() | counts_2.keys()
+                if not mismatched_only or counts_1[(owner, object_type)] != counts_2[(owner, object_type)]]
+        return sorted(rows, key=lambda row: tuple(row[name] or "" for name in order))
+
+    def instances(self):
+        """Returns the compared instances found in the extracts."""
+        return [{"instance_id": pkey} for pkey in sorted({row[0] for row in self.tables.get("instances", [])}
+                                                         & {self.instance_1, self.instance_2})]
+
+    def missing_objects(self):
+        """Returns the objects present in only one of the instances."""
+        return self.status_rows("dbobjectnames", ("owner", "object_name", "object_type"), ("object_type", "object_name", "owner"))
+
+    def missing_columns(self):
+        """Returns the missing columns of the tables present in both instances."""
+        missing_tables = {key[:2] for key, _, _ in self.missing_keys("dbobjectnames", 3) if key[2] in MISSING_TABLE_TYPES}
+        rows = self.status_rows("columns", ("owner", "table_name", "column_name"), ("owner", "table_name", "column_name"))
+        return [row for row in rows if (row["owner"], row["table_name"]) not in missing_tables]
+
+    def missing_plsql(self):
+        """Returns the PL/SQL objects present in only one of the instances."""
+        return self.status_rows("sourcecodedetailed", ("owner", "name", "type"), ("type", "name", "owner"))
+
+    def line_counts(self, instance, detailed):
+        """Returns the PL/SQL line counts of an instance, by (owner, type, name) if detailed else by (owner, type)."""
+        line_counts = {}
+        for owner, name, object_type, nr_lines in self.instance_rows("sourcecodedetailed", instance):
+            if nr_lines is None:
+                continue
+            if detailed:
+                key = (owner, object_type, name)
+                line_counts[key] = max(line_counts.get(key, int(nr_lines)), int(nr_lines))
+            else:
+                key = (owner, object_type)
+                line_counts[key] = line_counts.get(key, 0) + int(nr_lines)
+        return line_counts
+
+    def line_count_mismatches(self, detailed=False):
+        """Returns the PL/SQL objects (detailed) or object types whose line count differs between the instances."""
+        line_counts_1 = self.line_counts(self.instance_1, detailed)
+        line_counts_2 = self.line_counts(self.instance_2, detailed)
+        rows = []
+        for key in sorted(line_counts_1.keys() & line_counts_2.keys()):
+            if line_counts_1[key] != line_counts_2[key]:
+                row = {"owner": key[0], "name": key[2], "type": key[1]} if detailed else {"owner": key[0], "type": key[1]}
+                row[f"{self.prefix_1}_line_count"] = line_counts_1[key]
+                row[f"{self.prefix_2}_line_count"] = line_counts_2[key]
+                rows.append(row)
+        return rows
+
+    def source_hash_mismatches(self):
+        """Returns the objects of both instances whose source hash differs."""
+        hashes_2 = collections.defaultdict(list)
+        for owner, name, object_type, source_hash, source_id in self.instance_rows("sourcehash", self.instance_2):
+            hashes_2[(owner, name, object_type, source_id)].append(source_hash)
+        rows = [{"owner": owner, "name": name, "type": object_type,
+                 f"{self.prefix_1}_source_hash": source_hash, f"{self.prefix_2}_source_hash": other_hash}
+                for owner, name, object_type, source_hash, source_id in self.instance_rows("sourcehash", self.instance_1)
+                for other_hash in hashes_2.get((owner, name, object_type, source_id), [])
+                if source_hash is not None and other_hash is not None and source_hash != other_hash]
+        return sorted(rows, key=lambda row: (row["owner"], row["type"], row["name"]))
+
+    def section(self, query_file):
+        """
+        Returns the rows of the report section of a query file.
+
+        Raises:
+            KeyError: If the section has no direct diff, see SECTIONS.
+        """
+        return SECTIONS[query_file](self)
+
+
+# Direct diff of the sections of query_config.yaml, by query file
+SECTIONS = {
+    "instances.sql": ExtractDiff.instances,
+    "object_counts.sql": lambda diff: diff.object_counts(order=("object_type", "owner")),
+    "object_counts_mismatch.sql": lambda diff: diff.object_counts(mismatched_only=True),
+    "object_counts_per_schema.sql": ExtractDiff.object_counts,
+    "object_counts_per_schema_mismatch.sql": lambda diff: diff.object_counts(mismatched_only=True),
+    "missing_objects.sql": ExtractDiff.missing_objects,
+    "missing_columns.sql": ExtractDiff.missing_columns,
+    "missing_plsql.sql": ExtractDiff.missing_plsql,
+    "line_count_mismatch.sql": ExtractDiff.line_count_mismatches,
+    "line_count_mismatch_detailed.sql": lambda diff: diff.line_count_mismatches(detailed=True),
+    "source_hash_mismatch.sql": ExtractDiff.source_hash_mismatches,
+}
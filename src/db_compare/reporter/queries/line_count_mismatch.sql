@@ -1,6 +1,7 @@
 WITH instances AS (
   SELECT DISTINCT PKEY AS instance_id
   FROM <dataset_name>.sourcecode
+  WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>')
 ),
 
 line_counts AS (
@@ -17,8 +18,8 @@ SELECT * FROM (
   SELECT
     OWNER,
     TYPE,
-    MAX(IF(instance_id = (SELECT instance_id FROM instances LIMIT 1 OFFSET 0), SUM_NR_LINES, NULL)) AS <instance_1_id>_line_count,
-    MAX(IF(instance_id = (SELECT instance_id FROM instances LIMIT 1 OFFSET 1), SUM_NR_LINES, NULL)) AS <instance_2_id>_line_count
+    MAX(IF(instance_id = '<instance_1_id>', SUM_NR_LINES, NULL)) AS <instance_1_id>_line_count,
+    MAX(IF(instance_id = '<instance_2_id>', SUM_NR_LINES, NULL)) AS <instance_2_id>_line_count
     -- Add more columns for additional instances as needed
   FROM line_counts i1
   GROUP BY OWNER, TYPE
@@ -1,6 +1,7 @@
 WITH instances AS (
   SELECT DISTINCT PKEY AS instance_id
   FROM <dataset_name>.sourcecodedetailed
+  WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>')
 ),
 
 line_counts AS (
@@ -19,8 +20,8 @@ SELECT * FROM (
     OWNER,
     NAME,
     TYPE,
-    MAX(IF(instance_id = (SELECT instance_id FROM instances LIMIT 1 OFFSET 0), NR_LINES, NULL)) AS <instance_1_id>_line_count,
-    MAX(IF(instance_id = (SELECT instance_id FROM instances LIMIT 1 OFFSET 1), NR_LINES, NULL)) AS <instance_2_id>_line_count
+    MAX(IF(instance_id = '<instance_1_id>', NR_LINES, NULL)) AS <instance_1_id>_line_count,
+    MAX(IF(instance_id = '<instance_2_id>', NR_LINES, NULL)) AS <instance_2_id>_line_count
     -- Add more columns for additional instances as needed
   FROM line_counts i1
   GROUP BY OWNER, TYPE, NAME
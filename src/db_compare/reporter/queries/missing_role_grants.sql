@@ -1,6 +1,7 @@
 WITH instances AS (
   SELECT DISTINCT PKEY AS instance_id
   FROM <dataset_name>.instances
+  WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>')
 ),
 all_roleprivs AS (
   SELECT DISTINCT GRANTEE, GRANTED_ROLE
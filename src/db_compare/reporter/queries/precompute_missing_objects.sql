@@ -0,0 +1,11 @@
+SELECT
+  OWNER,
+  OBJECT_NAME,
+  OBJECT_TYPE,
+  MAX(CASE WHEN PKEY = '<instance_1_id>' THEN 1 ELSE 0 END) AS in_instance_1,
+  MAX(CASE WHEN PKEY = '<instance_2_id>' THEN 1 ELSE 0 END) AS in_instance_2
+FROM <dataset_name>.dbobjectnames i1
+WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>') <schema_filter>
+GROUP BY OWNER, OBJECT_NAME, OBJECT_TYPE
+HAVING MAX(CASE WHEN PKEY = '<instance_1_id>' THEN 1 ELSE 0 END) = 0
+    OR MAX(CASE WHEN PKEY = '<instance_2_id>' THEN 1 ELSE 0 END) = 0
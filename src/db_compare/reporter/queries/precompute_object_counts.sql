@@ -0,0 +1,8 @@
+SELECT
+  OWNER,
+  OBJECT_TYPE,
+  SUM(CASE WHEN PKEY = '<instance_1_id>' THEN 1 ELSE 0 END) AS instance_1_count,
+  SUM(CASE WHEN PKEY = '<instance_2_id>' THEN 1 ELSE 0 END) AS instance_2_count
+FROM <dataset_name>.dbobjectnames i1
+WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>') <schema_filter>
+GROUP BY OWNER, OBJECT_TYPE
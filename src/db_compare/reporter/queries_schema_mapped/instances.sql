@@ -1 +1 @@
-SELECT DISTINCT PKEY AS instance_id FROM <dataset_name>.instances
\ No newline at end of file
+SELECT DISTINCT PKEY AS instance_id FROM <dataset_name>.instances WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>')
\ No newline at end of file
@@ -2,6 +2,7 @@
 WITH instances AS (
   SELECT DISTINCT PKEY AS instance_id
   FROM <dataset_name>.instances
+  WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>')
 ),
 all_columns AS (
   SELECT DISTINCT OWNER, TABLE_NAME, COLUMN_NAME
@@ -31,6 +32,7 @@ WHERE (i1.COLUMN_NAME IS NULL OR i2.COLUMN_NAME IS NULL)
   AND (a.OWNER,a.TABLE_NAME) NOT IN (WITH instances AS (
           SELECT DISTINCT PKEY AS instance_id
           FROM <dataset_name>.dbobjectnames
+          WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>')
         ),
         all_objects AS (
           SELECT DISTINCT OWNER, OBJECT_NAME, OBJECT_TYPE
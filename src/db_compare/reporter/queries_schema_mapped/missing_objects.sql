@@ -1,6 +1,7 @@
 WITH instances AS (
   SELECT DISTINCT PKEY AS instance_id
   FROM <dataset_name>.dbobjectnames
+  WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>')
 ),
 all_objects AS (
   SELECT DISTINCT OWNER, OBJECT_NAME, OBJECT_TYPE
@@ -0,0 +1,23 @@
+WITH instances AS (
+  SELECT DISTINCT PKEY AS instance_id
+  FROM <dataset_name>.instances
+  WHERE PKEY IN ('<instance_1_id>', '<instance_2_id>')
+),
+source_hashes AS (
+  SELECT PKEY AS instance_id, OWNER, NAME, TYPE, SOURCE_HASH, DMA_SOURCE_ID
+  FROM <dataset_name>.sourcehash
+  WHERE PKEY IN (SELECT instance_id FROM instances)
+)
+-- Hashes are only comparable between databases of the same engine
+SELECT
+  i1.OWNER,
+  i1.NAME,
+  i1.TYPE,
+  i1.SOURCE_HASH AS <instance_1_id>_source_hash,
+  i2.SOURCE_HASH AS <instance_2_id>_source_hash
+FROM source_hashes i1
+JOIN source_hashes i2 ON i1.NAME = i2.NAME AND i1.TYPE = i2.TYPE AND i1.DMA_SOURCE_ID = i2.DMA_SOURCE_ID
+WHERE i1.instance_id = '<instance_1_id>' AND i2.instance_id = '<instance_2_id>'
+AND i1.OWNER = '<instance_1_owner>' AND i2.OWNER = '<instance_2_owner>'
+AND i1.SOURCE_HASH != i2.SOURCE_HASH
+ORDER BY i1.TYPE, i1.NAME;
@@ -0,0 +1,126 @@
+# Copyright 2024 Google LLC
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     https://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+On-disk cache of the report section results, so that rendering a report
+again (another format, another --schemas_to_compare subset) does not re-run
+the queries whose staging data did not change.
+
+A result is stored as a file of one JSON row per line, named after the hash
+of its key: the staging database type, the staging data version (see the
+reporter's get_staging_data_version) and the fully substituted query text.
+Results are read and written in batches of rows, so that a cached section is
+never held in memory as a whole. Reading a result refreshes its modification
+time, and the least recently used files are evicted once the cache directory
+exceeds its size limit.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+DEFAULT_CACHE_DIRECTORY = ".report_cache"
+DEFAULT_CACHE_SIZE_MB = 256
+CACHE_FORMAT = 2  # Bump to invalidate the results cached by older versions
+
+
+def cache_key(staging_db_type, data_version, query):
+    """Returns the file name stem of a query result, a SHA-256 of everything the result depends on."""
+    key = json.dumps([CACHE_FORMAT, staging_db_type, data_version, query])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of query results (batches of row dicts) in a directory.
+
+    Args:
+        directory (str): Cache directory, created on the first write.
+        max_bytes (int): Total size of the cached files above which the least
+            recently used ones are deleted.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        """Returns the file of a key's result."""
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get_batches(self, key, batch_size):
+        """
+        Reads the cached rows of a key and marks them as recently used.
+
+        Returns:
+            iterator: Lists of up to batch_size row dicts, None if the key is not cached.
+        """
+        path = self.path(key)
+        try:
+            f = open(path, "r", encoding="utf-8")
+            os.utime(path)
+        except OSError:
+            return None
+
+        def read_batches():
+            with f:
+                batch = []
+                for line in f:
+                    batch.append(json.loads(line))
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+        return read_batches()
+
+    def put_batches(self, key, batches):
+        """
+        Caches the rows of a key as they are read, yielding every batch on,
+        then evicts the least recently used results beyond max_bytes. The
+        result is only stored if the batches are read to the end. Values JSON
+        does not represent (e.g. Decimal) are stored as strings, as the report
+        renders them.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first, so that a concurrent reader never sees a partial result
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for batch in batches:
+                    f.write("".join(json.dumps(dict(row.items()), default=str) + "\n" for row in batch))
+                    yield batch
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used results until the cache fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size